@@ -1,4 +1,5 @@
 from .custom_pages import *
+from .messages import *
 from .streamers import *
 from .user import *
 from .viewers import *
@@ -1,17 +1,21 @@
-from collections.abc import Iterable
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Any, cast, no_type_check
 
 import pytz
 from fastapi import Request
 from sqladmin import Admin, BaseView, ModelView
+from sqladmin._types import MODEL_ATTR
 from sqladmin.authentication import AuthenticationBackend, login_required
+from sqladmin.filters import get_column_obj, get_parameter_name, get_title
 from sqladmin.formatters import BASE_FORMATTERS
 from sqladmin.helpers import get_column_python_type
-from sqladmin.pagination import Pagination
+from sqladmin.pagination import PageControl, Pagination
 from sqlalchemy import Select, func, inspect, or_, select
 from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.orm import InstrumentedAttribute, Mapper, selectinload
+from starlette.datastructures import URL
 from starlette.responses import RedirectResponse, Response
 
 from dependencies.db import EngineTypeEnum, _get_db, engines
@@ -66,6 +70,58 @@ class AdminBackend(AuthenticationBackend):
         return RedirectResponse(request.url_for("admin:login"), status_code=302)
 
 
+@dataclass
+class KeysetPagination(Pagination):
+    """Страницы по курсору (before_id/after_id). Номеров страниц и общего количества нет, только prev/next"""
+
+    previous_cursor: Any = None
+    next_cursor: Any = None
+    _previous_page: PageControl | None = field(default=None, init=False)
+    _next_page: PageControl | None = field(default=None, init=False)
+
+    @property
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def previous_page(self) -> PageControl:
+        return cast(PageControl, self._previous_page)
+
+    @property
+    def next_page(self) -> PageControl:
+        return cast(PageControl, self._next_page)
+
+    def add_pagination_urls(self, base_url: URL) -> None:
+        base_url = base_url.remove_query_params(["before_id", "after_id", "page"])
+        self.page_controls = [PageControl(number=1, url=str(base_url))]
+        if self.has_previous:
+            self._previous_page = PageControl(0, str(base_url.include_query_params(after_id=self.previous_cursor)))
+        if self.has_next:
+            self._next_page = PageControl(2, str(base_url.include_query_params(before_id=self.next_cursor)))
+
+
+class IdFilter:
+    """Фильтр по id без выборки всех значений для сайдбара. Значение задается в url (например, ссылкой из строки)"""
+
+    def __init__(self, column: MODEL_ATTR, title: str | None = None, parameter_name: str | None = None):
+        self.column = column
+        self.title = title or get_title(column)
+        self.parameter_name = parameter_name or get_parameter_name(column)
+
+    async def lookups(self, request: Request, model: Any, run_query: Callable[[Select], Any]) -> list[tuple[str, str]]:
+        value = request.query_params.get(self.parameter_name)
+        return [("", "All")] + ([(value, value)] if value else [])
+
+    async def get_filtered_query(self, query: Select, value: Any, model: Any) -> Select:
+        if not str(value).isdigit():
+            return query
+        return query.filter(get_column_obj(self.column, model) == int(value))
+
+
 class BaseModelView(ModelView):
     _exclude: Iterable[InstrumentedAttribute[Any]] = []  # доп exclude кастомной логики
     can_edit = True
@@ -73,6 +129,8 @@ class BaseModelView(ModelView):
     can_delete = True
     page_size = 100
     pagination_enable = True
+    # для больших таблиц: страницы по первичному ключу вместо offset и count(*), сортировка только по нему
+    keyset_pagination = False
 
     column_type_formatters = BASE_FORMATTERS | {
         float: lambda v: v and round(v, 2),
@@ -129,6 +187,8 @@ class BaseModelView(ModelView):
         return True
 
     async def list(self, request: Request) -> Pagination:
+        if self.keyset_pagination:
+            return await self.keyset_list(request)
         if self.pagination_enable:
             return await super().list(request)
 
@@ -155,6 +215,52 @@ class BaseModelView(ModelView):
             count=count,
         )
 
+    async def keyset_list(self, request: Request) -> KeysetPagination:
+        page_size = self.validate_page_number(request.query_params.get("pageSize"), 0)
+        page_size = min(page_size or self.page_size, max(self.page_size_options))
+        before_id = request.query_params.get("before_id", "")
+        after_id = request.query_params.get("after_id", "")
+        search = request.query_params.get("search", None)
+        pk = self.pk_columns[0]
+
+        stmt = self.list_query(request)
+        for relation in self._list_relations:
+            stmt = stmt.options(selectinload(relation))
+        for filter_ in self.get_filters():
+            if request.query_params.get(filter_.parameter_name):
+                stmt = await filter_.get_filtered_query(stmt, request.query_params[filter_.parameter_name], self.model)
+        if search:
+            stmt = self.search_query(stmt=stmt, term=search)
+
+        # лишняя строка показывает, есть ли страница дальше
+        if after_id.isdigit():
+            stmt = stmt.filter(pk > int(after_id)).order_by(pk.asc()).limit(page_size + 1)
+        else:
+            if before_id.isdigit():
+                stmt = stmt.filter(pk < int(before_id))
+            stmt = stmt.order_by(pk.desc()).limit(page_size + 1)
+        rows = list(await self._run_query(stmt))
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        previous_cursor = next_cursor = None
+        if after_id.isdigit():
+            rows.reverse()
+            previous_cursor = has_more and rows and getattr(rows[0], pk.key) or None
+            next_cursor = rows and getattr(rows[-1], pk.key) or int(after_id) + 1
+        else:
+            previous_cursor = before_id.isdigit() and rows and getattr(rows[0], pk.key) or None
+            next_cursor = has_more and getattr(rows[-1], pk.key) or None
+
+        return KeysetPagination(
+            rows=rows,
+            page=1,
+            page_size=page_size,
+            count=len(rows),
+            previous_cursor=previous_cursor,
+            next_cursor=next_cursor,
+        )
+
 
 class CustomAdmin(Admin):
     @login_required
@@ -1,15 +1,18 @@
 from datetime import datetime
 
 from fastapi import Request
+from fastapi.responses import ORJSONResponse
 from sqladmin import expose
 from sqladmin.authentication import login_required
 from sqladmin.templating import _TemplateResponse
 
 from admin.bases import CustomBaseView
 from dependencies.db import _get_db
-from dependencies.redis import _get_redis
+from dependencies.redis import _get_redis, presence_cache
 from repository.streamers import StreamerProfileRepository
 from repository.viewers import ViewerProfileRepository
+from sockets import admission_controller, events_limiter, outbound_limiter
+from utils.cache import caches
 
 
 class ConstanceView(CustomBaseView):
@@ -79,3 +82,22 @@ class StreamersOnlineView(CustomBaseView):
             "admin/streamers_data.html",
             {"request": request, "rows": rows},
         )
+
+
+class SocketsStatsView(CustomBaseView):
+    name = "Статистика сокетов"
+    icon = "fa-solid fa-chart-line"
+
+    @expose("/sockets-stats", methods=["GET"])
+    @login_required
+    async def sockets_stats(self, request: Request) -> ORJSONResponse:
+        """Метрики текущего процесса"""
+        return ORJSONResponse(
+            {
+                "admission": admission_controller.stats(),
+                "events": events_limiter.stats(),
+                "outbound": outbound_limiter.stats(),
+                "presence_cache": presence_cache.stats(),
+                "caches": caches.stats(),
+            }
+        )
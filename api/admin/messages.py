@@ -0,0 +1,28 @@
+from markupsafe import Markup
+from sqlalchemy import Select, func
+
+from admin.bases import BaseModelView, IdFilter
+from models.messages import MESSAGES_SEARCH_CONFIG, Message, messages_text_search
+
+
+def _filter_link(parameter_name: str):
+    return lambda m, a: Markup('<a href="?{}={}">{}</a>').format(parameter_name, getattr(m, a), getattr(m, a))
+
+
+class MessageAdmin(BaseModelView, model=Message):
+    # переписки только читаем (удаление мимо буфера в Redis и conversations оставило бы их устаревшими).
+    # Таблица большая: поиск по GIN индексу, страницы по id без count(*)
+    can_create = False
+    can_edit = False
+    can_delete = False
+    keyset_pagination = True
+    column_searchable_list = [Message.text]
+    column_filters = [IdFilter(Message.streamer_id), IdFilter(Message.viewer_id)]
+    column_formatters = {
+        "streamer_id": _filter_link("streamer_id"),
+        "viewer_id": _filter_link("viewer_id"),
+    }
+
+    def search_query(self, stmt: Select, term: str) -> Select:
+        query = func.websearch_to_tsquery(MESSAGES_SEARCH_CONFIG, term)
+        return stmt.filter(messages_text_search(Message.text).bool_op("@@")(query))
@@ -1,6 +1,9 @@
 from markupsafe import Markup
 
 from admin.bases import BaseModelView
+from dependencies.db import _get_db
+from dependencies.redis import _get_redis
+from logic.streamers import invalidate_streamer_card, refresh_streamer_rating, sync_streamer_rating
 from models.streamers import StreamerMark, StreamerProfile
 
 
@@ -11,12 +14,39 @@ class StreamerProfileAdmin(BaseModelView, model=StreamerProfile):
         ).format(m.avatar_url),
     }
     column_formatters_detail = column_formatters
+    # агрегаты оценок ведет rate_streamer
+    form_excluded_columns = [StreamerProfile.rating_sum, StreamerProfile.rating_count]
 
     def on_model_change(self, data, model, is_created, request):
         if not is_created and model.user_id != int(data["user"]):
             raise Exception("Нельзя менять привязку к пользователю!")
         return super().on_model_change(data, model, is_created, request)
 
+    # after_* вызываются после коммита, раньше сбрасывать карточку нельзя
+    async def after_model_change(self, data, model, is_created, request):
+        async with _get_redis() as redis:
+            await invalidate_streamer_card(redis, model.id)
+            # force_rating мог поменяться
+            async with _get_db() as db:
+                await sync_streamer_rating(db, redis, model.id)
+
+    async def after_model_delete(self, model, request):
+        async with _get_redis() as redis:
+            await invalidate_streamer_card(redis, model.id)
+
 
 class StreamerMarksAdmin(BaseModelView, model=StreamerMark):
-    pass
+    # правка оценок в обход rate_streamer - агрегаты стримера пересчитываются целиком
+    async def after_model_change(self, data, model, is_created, request):
+        await self._refresh_rating(model.streamer_id)
+
+    async def after_model_delete(self, model, request):
+        await self._refresh_rating(model.streamer_id)
+
+    @staticmethod
+    async def _refresh_rating(streamer_id: int) -> None:
+        async with _get_db() as db:
+            await refresh_streamer_rating(db, streamer_id)
+        async with _get_redis() as redis, _get_db() as db:
+            await invalidate_streamer_card(redis, streamer_id)
+            await sync_streamer_rating(db, redis, streamer_id)
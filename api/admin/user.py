@@ -2,6 +2,8 @@ from fastapi import Request
 
 from admin.bases import BaseModelView
 from dependencies.db import _get_db
+from dependencies.redis import _get_redis
+from logic.auth import is_streamer_user
 from models.streamers import StreamerProfile
 from models.user import User
 from models.viewers import ViewerProfile
@@ -48,4 +50,7 @@ class UserAdmin(BaseModelView, model=User):
             if not is_exists:
                 await repo.save(StreamerProfile(user_id=model.id))
 
+        async with _get_redis() as redis:
+            await is_streamer_user.invalidate(redis=redis, user_id=model.id)
+
         await super().after_model_change(data, model, is_created, request)
@@ -1,4 +1,6 @@
 from admin.bases import BaseModelView
+from dependencies.redis import _get_redis
+from logic.viewers import invalidate_viewer_card
 from models.viewers import ViewerProfile
 
 
@@ -7,3 +9,11 @@ class ViewerProfileAdmin(BaseModelView, model=ViewerProfile):
         if not is_created and model.user_id != int(data["user"]):
             raise Exception("Нельзя менять привязку к пользователю!")
         return super().on_model_change(data, model, is_created, request)
+
+    async def after_model_change(self, data, model, is_created, request):
+        async with _get_redis() as redis:
+            await invalidate_viewer_card(redis, model.id)
+
+    async def after_model_delete(self, model, request):
+        async with _get_redis() as redis:
+            await invalidate_viewer_card(redis, model.id)
@@ -13,7 +13,7 @@ from fastapi import FastAPI as _FastAPI
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRoute
-from redis.asyncio import ConnectionPool
+from redis.asyncio import ConnectionPool, Redis
 from sqladmin import Admin, BaseView
 from sqladmin.authentication import AuthenticationBackend
 from starlette.staticfiles import StaticFiles
@@ -22,13 +22,16 @@ from starlette.templating import Jinja2Templates
 from admin.bases import CustomAdmin, authentication_backend
 from app_logging import init_sentry, set_logging_config
 from dependencies.db import EngineTypeEnum, _get_db, engines
+from dependencies.redis import make_redis_client, presence_cache
 from endpoints import router
 from exceptions.bases import BaseHttpError, Http500
+from logic.streamers import rebuild_free_streamers, warm_streamers_cards
 from settings.conf import databases, settings
 from sockets import *  # noqa: F403
-from sockets import register_handlers
+from sockets import register_admission, register_handlers, register_outbound_limits
+from utils.cache import caches
 from utils.handlers import any_exception_handler, logic_exception_handler, unhandled_validation_exception_handler
-from utils.libs import generate_error_responses
+from utils.libs import catch, generate_error_responses
 from utils.middleware import TracemallocMiddleware
 
 origins = ["https://nex2ilo.com"]
@@ -95,6 +98,12 @@ def init_scheduler():
     return scheduler
 
 
+async def warm_caches(redis: Redis) -> None:
+    async with _get_db() as db:
+        await rebuild_free_streamers(db, redis)
+        await warm_streamers_cards(redis)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     if databases.fake_redis:
@@ -114,11 +123,21 @@ async def lifespan(app: FastAPI):
 
     app.state.arq_pool = arq_pool
     app.state.redis_pool = redis_pool
+    app.state.redis = make_redis_client(redis_pool)
     app.state.templates = init_templates()
     app.state.scheduler = scheduler
 
+    if databases.redis_presence_cache and not databases.fake_redis:
+        await presence_cache.start(app.state.redis)
+    if not databases.fake_redis:
+        # в одном процессе с fake redis инвалидации других процессов не бывает
+        await caches.start(app.state.redis)
+    await catch(warm_caches(app.state.redis))
+
     yield
 
+    await presence_cache.stop()
+    await caches.stop()
     scheduler.shutdown()
     await arq_pool.close()
     await redis_pool.disconnect()
@@ -198,6 +217,8 @@ def init_sio():
 
 def init_sockets_app(sio, fastapi_app):
     register_handlers(sio)
+    register_admission(sio)
+    register_outbound_limits(sio)
     return socketio.ASGIApp(sio, other_asgi_app=fastapi_app)
 
 
@@ -1,17 +1,36 @@
 from collections.abc import AsyncGenerator, Callable
 from contextlib import asynccontextmanager
-from functools import wraps
+from functools import lru_cache, wraps
 from typing import Any
 
 from fastapi import Request
-from redis.asyncio import Redis
+from redis.asyncio import ConnectionPool, Redis
 
 from settings.conf import databases
+from utils.redis import AutoPipelineRedis, TrackedHashCache
+
+# sid-ы и пары стример-зритель читаются на каждое сообщение и сигналинг, а меняются только при (пере)подключениях
+presence_cache = TrackedHashCache(("streamers:sid", "viewers:sid", "streamers:viewers", "viewers:streamers"))
+
+
+def make_redis_client(pool: ConnectionPool) -> Redis:
+    if databases.redis_autopipeline:
+        return AutoPipelineRedis(connection_pool=pool)
+    return Redis(connection_pool=pool)
+
+
+@lru_cache
+def get_redis_client() -> Redis:
+    """
+    Общий на процесс клиент для сокетов.
+    Команды из конкурентных обработчиков склеиваются в пайплайны, поэтому клиент не создается на каждый вызов
+    """
+    pool = ConnectionPool.from_url(databases.redis_url.unicode_string(), decode_responses=True)
+    return make_redis_client(pool)
 
 
 async def get_redis(request: Request) -> AsyncGenerator[Redis]:
-    async with Redis(connection_pool=request.app.state.redis_pool) as redis:
-        yield redis
+    yield request.app.state.redis
 
 
 @asynccontextmanager
@@ -28,10 +47,9 @@ def with_redis():
     def decorator(func: Callable[..., Any]):
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            async with _get_redis() as redis:
-                if "redis" not in kwargs:
-                    kwargs["redis"] = redis
-                return await func(*args, **kwargs)
+            if "redis" not in kwargs:
+                kwargs["redis"] = get_redis_client()
+            return await func(*args, **kwargs)
 
         return wrapper
 
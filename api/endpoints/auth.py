@@ -12,6 +12,7 @@ from models import User
 from schemas.auth import LoginRequestSchema, LoginResponseSchema
 from schemas.user import UserSchema
 from settings import conf
+from utils.conditional import ResponseValidator, conditional_get
 from utils.libs import generate_error_responses
 
 from ._tags import Tags
@@ -60,7 +61,10 @@ async def logout_endpoint(
 )
 async def get_me_endpoint(
     user: User = Depends(get_current_active_user),
+    validator: ResponseValidator = Depends(conditional_get("private, no-cache")),
 ) -> UserSchema:
+    if not_modified := validator.check(user.id, user.updated.timestamp(), last_modified=user.updated):
+        return not_modified
     user_data = UserSchema(
         id=user.id,
         username=user.username,
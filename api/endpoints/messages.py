@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Depends, Query
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
-from dependencies import get_db
+from dependencies import get_db, get_redis
 from dependencies.auth import get_current_active_user
 from exceptions.auth import WrongCredentials
 from exceptions.bases import Http403
-from logic.messages import get_messages
+from logic.messages import get_conversations, get_messages, get_unread_counters, mark_messages_read
 from models import User
-from schemas.messages import MessageSchema
+from schemas.messages import ConversationSchema, MessageSchema
 from utils.libs import generate_error_responses
 
 from ._tags import Tags
@@ -23,9 +24,59 @@ router = APIRouter(tags=[Tags.messages])
 async def get_messages_endpoint(
     streamer_id: int = Query(..., description="ID стримера"),
     viewer_id: int = Query(..., description="ID зрителя"),
+    limit: int = Query(50, ge=1, le=200, description="Размер страницы"),
+    before_id: int | None = Query(None, description="Сообщения старше этого ID"),
+    since_id: int | None = Query(None, description="Сообщения новее этого ID"),
     user: User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(get_redis),
 ) -> list[MessageSchema]:
     if user.streamer_profile.id != streamer_id and user.viewer_profile.id != viewer_id:
         raise Http403
-    return await get_messages(db, streamer_id, viewer_id)
+    return await get_messages(db, redis, streamer_id, viewer_id, limit, before_id, since_id)
+
+
+@router.get(
+    "/conversations",
+    summary="Переписки с последним сообщением",
+    responses=generate_error_responses("GetConversationsEndpointErrors", WrongCredentials),
+)
+async def get_conversations_endpoint(
+    limit: int = Query(50, ge=1, le=200, description="Размер страницы"),
+    before_id: int | None = Query(None, description="Переписки с последним сообщением старше этого ID"),
+    user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db),
+) -> list[ConversationSchema]:
+    if user.is_streamer:
+        return await get_conversations(db, streamer_id=user.streamer_profile.id, limit=limit, before_id=before_id)
+    return await get_conversations(db, viewer_id=user.viewer_profile.id, limit=limit, before_id=before_id)
+
+
+@router.get(
+    "/unread",
+    summary="Непрочитанные сообщения по перепискам",
+    responses=generate_error_responses("GetUnreadEndpointErrors", WrongCredentials),
+)
+async def get_unread_endpoint(
+    user: User = Depends(get_current_active_user),
+    redis: Redis = Depends(get_redis),
+) -> dict[int, int]:
+    if user.is_streamer:
+        return await get_unread_counters(redis, user.streamer_profile.id, True)
+    return await get_unread_counters(redis, user.viewer_profile.id, False)
+
+
+@router.post(
+    "/conversations/{counterpart_id}/read",
+    summary="Отметить переписку прочитанной",
+    responses=generate_error_responses("MarkConversationReadEndpointErrors", WrongCredentials),
+)
+async def mark_conversation_read_endpoint(
+    counterpart_id: int,
+    user: User = Depends(get_current_active_user),
+    redis: Redis = Depends(get_redis),
+) -> None:
+    if user.is_streamer:
+        await mark_messages_read(redis, user.streamer_profile.id, True, counterpart_id)
+    else:
+        await mark_messages_read(redis, user.viewer_profile.id, False, counterpart_id)
@@ -1,14 +1,25 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Response
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
 from dependencies import get_db, get_redis
 from dependencies.auth import get_current_active_user
 from exceptions.auth import WrongCredentials
 from exceptions.bases import Http403, Http404
-from logic.streamers import get_free_online_streamers, get_streamer, rate_streamer
+from logic.streamers import (
+    LobbySort,
+    get_free_online_streamers_payload,
+    get_streamer_card,
+    get_streamers_batch,
+    invalidate_streamer_card,
+    rate_streamer,
+    serialize_streamer,
+    update_online_streamer_rating,
+)
 from logic.viewers import get_streamer_viewer
 from models import User
-from schemas.streamers import StreamerMarkSchema, StreamerSchema, ViewerSchema
+from schemas.streamers import StreamerMarkSchema, StreamerSchema, StreamersBatchSchema, ViewerSchema
+from settings.conf import other_settings
+from utils.conditional import ResponseValidator, conditional_get
 from utils.libs import generate_error_responses
 
 from ._tags import Tags
@@ -19,14 +30,37 @@ router = APIRouter(tags=[Tags.streamers])
 @router.get(
     "/",
     summary="Список свободных стримеров",
+    response_model=list[StreamerSchema],
     responses=generate_error_responses("GetFreeOnlineStreamersEndpointErrors", WrongCredentials),
 )
 async def get_free_online_streamers_endpoint(
+    limit: int = Query(50, ge=1, le=200, description="Размер страницы"),
+    cursor: int = Query(0, ge=0, description="Смещение страницы"),
+    sort: LobbySort = Query("-rating", description="Сортировка по рейтингу"),
+    user: User = Depends(get_current_active_user),
+    redis: AsyncSession = Depends(get_redis),
+    validator: ResponseValidator = Depends(conditional_get("private, no-cache")),
+) -> Response:
+    # ответ уже закодирован и закэширован, повторная валидация не нужна.
+    # Версия присутствия не ловит правки профилей, поэтому ETag - от самого готового ответа
+    payload = await get_free_online_streamers_payload(redis, limit, cursor, sort)
+    if not_modified := validator.check(payload):
+        return not_modified
+    return Response(payload, media_type="application/json", headers=validator.headers)
+
+
+@router.get(
+    "/batch",
+    summary="Стримеры по списку id",
+    response_model=StreamersBatchSchema,
+    responses=generate_error_responses("GetStreamersBatchEndpointErrors", WrongCredentials),
+)
+async def get_streamers_batch_endpoint(
+    ids: list[int] = Query(max_length=other_settings.profiles_batch_max_size, description="id стримеров"),
     user: User = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_db),
     redis: AsyncSession = Depends(get_redis),
-) -> list[StreamerSchema]:
-    return await get_free_online_streamers(db, redis)
+) -> Response:
+    return Response(await get_streamers_batch(redis, ids), media_type="application/json")
 
 
 @router.get(
@@ -36,24 +70,29 @@ async def get_free_online_streamers_endpoint(
 )
 async def get_current_streamer_endpoint(
     user: User = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_db),
 ) -> StreamerSchema:
     if not user.is_streamer:
         raise Http403
-    return await get_streamer(db, user.streamer_profile.id)
+    return serialize_streamer(user.streamer_profile)
 
 
 @router.get(
     "/{streamer_id}",
     summary="Информация о стримере",
+    response_model=StreamerSchema,
     responses=generate_error_responses("GetStreamerEndpointErrors", WrongCredentials, Http404),
 )
 async def get_streamer_endpoint(
     streamer_id: int,
     user: User = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_db),
-) -> StreamerSchema:
-    return await get_streamer(db, streamer_id)
+    redis: AsyncSession = Depends(get_redis),
+    validator: ResponseValidator = Depends(conditional_get("private, max-age=10")),
+) -> Response:
+    # карточка сбрасывается при правках профиля и оценках, поэтому ETag - от нее самой
+    card = await get_streamer_card(redis, streamer_id)
+    if not_modified := validator.check(card):
+        return not_modified
+    return Response(card, media_type="application/json", headers=validator.headers)
 
 
 @router.post(
@@ -66,8 +105,13 @@ async def rate_streamer_endpoint(
     data: StreamerMarkSchema,
     user: User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db),
+    redis: AsyncSession = Depends(get_redis),
 ) -> None:
-    await rate_streamer(db, user.viewer_profile.id, data.mark, streamer_id)
+    rating = await rate_streamer(db, user.viewer_profile.id, data.mark, streamer_id)
+    # рейтинг в карточке и в лобби: обновляем только после коммита
+    await db.commit()
+    await invalidate_streamer_card(redis, streamer_id)
+    await update_online_streamer_rating(redis, streamer_id, rating)
 
 
 @router.get(
@@ -78,7 +122,6 @@ async def rate_streamer_endpoint(
 async def get_streamer_viewers_endpoint(
     streamer_id: int,
     user: User = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_db),
     redis: AsyncSession = Depends(get_redis),
 ) -> ViewerSchema:
-    return await get_streamer_viewer(db, redis, streamer_id)
+    return await get_streamer_viewer(redis, streamer_id)
@@ -1,13 +1,15 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Response
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
-from dependencies import get_db
+from dependencies import get_redis
 from dependencies.auth import get_current_active_user
 from exceptions.auth import WrongCredentials
 from exceptions.bases import Http404
-from logic.viewers import get_viewer
+from logic.viewers import get_viewer, get_viewer_card, get_viewers_batch
 from models import User
-from schemas.streamers import ViewerSchema
+from schemas.streamers import ViewerSchema, ViewersBatchSchema
+from settings.conf import other_settings
+from utils.conditional import ResponseValidator, conditional_get
 from utils.libs import generate_error_responses
 
 from ._tags import Tags
@@ -15,6 +17,20 @@ from ._tags import Tags
 router = APIRouter(tags=[Tags.viewers])
 
 
+@router.get(
+    "/batch",
+    summary="Зрители по списку id",
+    response_model=ViewersBatchSchema,
+    responses=generate_error_responses("GetViewersBatchEndpointErrors", WrongCredentials),
+)
+async def get_viewers_batch_endpoint(
+    ids: list[int] = Query(max_length=other_settings.profiles_batch_max_size, description="id зрителей"),
+    user: User = Depends(get_current_active_user),
+    redis: AsyncSession = Depends(get_redis),
+) -> Response:
+    return Response(await get_viewers_batch(redis, ids), media_type="application/json")
+
+
 @router.get(
     "/me",
     summary="Профиль зрителя текущего пользователя",
@@ -22,19 +38,24 @@ router = APIRouter(tags=[Tags.viewers])
 )
 async def get_current_viewer_endpoint(
     user: User = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_db),
+    redis: AsyncSession = Depends(get_redis),
 ) -> ViewerSchema:
-    return await get_viewer(db, user.viewer_profile.id)
+    return await get_viewer(redis, user.viewer_profile.id)
 
 
 @router.get(
     "/{viewer_id}",
     summary="Информация о зрителе",
+    response_model=ViewerSchema,
     responses=generate_error_responses("GetViewerEndpointErrors", WrongCredentials, Http404),
 )
 async def get_viewer_endpoint(
     viewer_id: int,
     user: User = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_db),
-) -> ViewerSchema:
-    return await get_viewer(db, viewer_id)
+    redis: AsyncSession = Depends(get_redis),
+    validator: ResponseValidator = Depends(conditional_get("private, max-age=60")),
+) -> Response:
+    card = await get_viewer_card(redis, viewer_id)
+    if not_modified := validator.check(card):
+        return not_modified
+    return Response(card, media_type="application/json", headers=validator.headers)
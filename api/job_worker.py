@@ -8,14 +8,17 @@ from arq import cron
 from arq.connections import RedisSettings
 from arq.typing import WorkerCoroutine
 from httpx import AsyncClient
-from redis.asyncio import ConnectionPool, Redis
+from redis.asyncio import ConnectionPool
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
 from app_logging import init_sentry, set_logging_config
 from dependencies.db import get_binds
+from dependencies.redis import make_redis_client
 from schemas.jobs import JobContext
 from settings.conf import databases, settings
 from settings.db import EngineTypeEnum, engines
+from tasks.matchmaking import release_expired_reservations_task
+from tasks.messages import flush_messages_task, maintain_messages_partitions_task
 from tasks.streamers import clean_offline_streamers_task
 from tasks.viewers import clean_offline_viewers_task
 from utils.constants import HOUR
@@ -28,6 +31,7 @@ async def startup(ctx: JobContext) -> None:  # pragma: no cover
     # ctx содержит redis, но он именно ArqRedis. Сделаем стандартный
     redis_pool: ConnectionPool = ConnectionPool.from_url(databases.redis_url.unicode_string(), decode_responses=True)
     ctx["_redis_pool"] = redis_pool
+    ctx["_redis"] = make_redis_client(redis_pool)
     ctx["_db_maker"] = partial(
         AsyncSession, bind=engines[EngineTypeEnum.DEFAULT_ENGINE], binds=get_binds(), expire_on_commit=True
     )
@@ -42,7 +46,7 @@ async def job_startup(ctx: JobContext) -> None:  # pragma: no cover
     ctx["_exit_stack"] = exit_stack
 
     ctx["db_session"] = ctx["_db_maker"]()
-    ctx["redis_session"] = Redis(connection_pool=ctx["_redis_pool"])
+    ctx["redis_session"] = ctx["_redis"]  # общий клиент, команды параллельных задач склеиваются в пайплайны
     ctx["httpx_client"] = AsyncClient()
     ctx["sio"] = socketio.AsyncServer(
         async_mode="asgi",
@@ -56,7 +60,6 @@ async def job_startup(ctx: JobContext) -> None:  # pragma: no cover
 
 async def job_shutdown(ctx: JobContext) -> None:  # pragma: no cover
     exit_stack: AsyncExitStack = ctx["_exit_stack"]
-    redis_session = ctx["redis_session"]
     db_session = ctx["db_session"]
     httpx_client = ctx["httpx_client"]
 
@@ -65,7 +68,6 @@ async def job_shutdown(ctx: JobContext) -> None:  # pragma: no cover
     await httpx_client.aclose()
     await db_session.commit()
     await db_session.close()
-    await redis_session.close()
 
 
 def repeat_every(interval: int, start: int = 0, end: int = 60) -> set[int]:
@@ -84,6 +86,9 @@ QUEUES = {
         "cron_jobs": [
             cron(adapt(clean_offline_streamers_task), max_tries=1, second=repeat_every(5)),
             cron(adapt(clean_offline_viewers_task), max_tries=1, second=repeat_every(5)),
+            cron(adapt(release_expired_reservations_task), max_tries=1, second=repeat_every(5)),
+            cron(adapt(flush_messages_task), max_tries=1, second=repeat_every(1)),
+            cron(adapt(maintain_messages_partitions_task), max_tries=1, hour={3}, minute={0}, second={0}),
         ],
     },
 }
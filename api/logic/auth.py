@@ -1,13 +1,19 @@
+import secrets
+
+import orjson
 from loguru import logger
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from exceptions.auth import WrongCredentials
 from models.user import User
+from repository.user import UserRepository
 from services.auth import UserSessionService
 from services.jwt import JwtTokenService
 from services.user import UserService
 from settings import conf
 from utils.auth import verify_password
+from utils.libs import cached
 
 
 async def login_user_by_password(db: AsyncSession, username: str, password: str) -> str:
@@ -23,7 +29,10 @@ async def login_user_by_password(db: AsyncSession, username: str, password: str)
     if user.username != username or not verify_password(password, user.password):
         raise WrongCredentials
 
-    token = jwt_service.create_token(user.id, conf.other_settings.users_session_ttl, conf.other_settings.jwt_secret)
+    # is_streamer нужен admission control, чтобы без БД пропускать стримеров вперед при шторме подключений
+    token = jwt_service.create_token(
+        user.id, conf.other_settings.users_session_ttl, conf.other_settings.jwt_secret, is_streamer=user.is_streamer
+    )
     await session_service.create_session(user.id, token, conf.other_settings.users_session_ttl)
     return token
 
@@ -44,3 +53,30 @@ async def get_user_by_token(db: AsyncSession, token: str) -> User | None:
     if not user:
         return None
     return user
+
+
+# флаг меняется только в админке, она и сбрасывает ключ. Нужен admission control для токенов без claim is_streamer
+@cached(
+    "users:is_streamer",
+    ttl=conf.other_settings.profile_cards_ttl,
+    local_ttl=conf.other_settings.profile_cards_local_ttl,
+    max_size=conf.other_settings.profile_cards_max_size,
+)
+async def is_streamer_user(db: AsyncSession, redis: Redis, user_id: int) -> bool:
+    return await UserRepository(db).exists(User.id == user_id, User.is_streamer)
+
+
+async def create_resume_token(redis: Redis, session: dict) -> str:
+    token = secrets.token_urlsafe(32)
+    await redis.set(f"sessions:resume:{token}", orjson.dumps(session), ex=conf.other_settings.resume_token_ttl)
+    return token
+
+
+async def pop_resume_token(redis: Redis, token: str) -> dict | None:
+    """Токен одноразовый: при резюме выдается новый"""
+    session = await redis.getdel(f"sessions:resume:{token}")
+    return session and orjson.loads(session) or None
+
+
+async def refresh_resume_token(redis: Redis, token: str) -> None:
+    await redis.expire(f"sessions:resume:{token}", conf.other_settings.resume_token_ttl)
@@ -0,0 +1,113 @@
+from itertools import batched
+
+import socketio
+from redis.asyncio import Redis
+
+from logic.streamers import LOBBY_VERSION_KEY, mark_streamer_free
+from settings.conf import other_settings, sockets_namespaces as namespaces
+from utils.libs import utc_now
+
+# Очередь зрителей, ждущих любого свободного стримера (score - время входа, FIFO) и их sid в лобби для пуша.
+# Свободный стример с самым высоким рейтингом бронируется за первым в очереди: пока бронь жива,
+# место не видно в лобби и занять его может только этот зритель
+MATCH_SCRIPT = """
+local matched = {}
+for _ = 1, tonumber(ARGV[2]) do
+    local streamer = redis.call('ZRANGE', KEYS[1], -1, -1)[1]
+    if not streamer then break end
+    local viewer = redis.call('ZPOPMIN', KEYS[2])[1]
+    if not viewer then break end
+    redis.call('ZREM', KEYS[1], streamer)
+    redis.call('HSET', KEYS[3], streamer, viewer)
+    redis.call('ZADD', KEYS[4], ARGV[1], streamer)
+    table.insert(matched, streamer)
+    table.insert(matched, viewer)
+end
+if #matched > 0 then
+    redis.call('INCR', KEYS[5])
+end
+return matched
+"""
+
+RELEASE_RESERVATION_SCRIPT = """
+local viewer = redis.call('HGET', KEYS[1], ARGV[1])
+if not viewer then return false end
+local deadline = redis.call('ZSCORE', KEYS[2], ARGV[1])
+if deadline and tonumber(deadline) > tonumber(ARGV[2]) then return false end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+return viewer
+"""
+
+
+async def enqueue_viewer(sio: socketio.AsyncServer, redis: Redis, viewer_id: int, sid: str) -> int:
+    """Встать в очередь. Повторный вход место в очереди не сбрасывает. Возвращает позицию (с 0)"""
+    now_ts = int(utc_now().timestamp() * 1000)
+    pipe = redis.pipeline()
+    pipe.zadd("matchmaking:queue", {viewer_id: now_ts}, nx=True)
+    pipe.hset("matchmaking:sid", viewer_id, sid)
+    pipe.zrank("matchmaking:queue", viewer_id)
+    *_, position = await pipe.execute()
+
+    await sio.emit("matchmaking:queued", {"position": position}, to=sid, namespace=namespaces.lobby)
+    await match_viewers(sio, redis)
+    return position
+
+
+async def dequeue_viewer(redis: Redis, viewer_id: int) -> None:
+    pipe = redis.pipeline()
+    pipe.zrem("matchmaking:queue", viewer_id)
+    pipe.hdel("matchmaking:sid", viewer_id)
+    await pipe.execute()
+
+
+async def match_viewers(sio: socketio.AsyncServer, redis: Redis) -> list[tuple[int, int]]:
+    """Разобрать очередь по свободным местам. Вызывается на каждом освобождении места и входе в очередь"""
+    deadline = int((utc_now() + other_settings.matchmaking_reservation_ttl).timestamp())
+    keys = (
+        "streamers:free",
+        "matchmaking:queue",
+        "streamers:reserved",
+        "streamers:reserved:deadlines",
+        LOBBY_VERSION_KEY,
+    )
+    matched = await redis.eval(MATCH_SCRIPT, len(keys), *keys, deadline, other_settings.matchmaking_batch_size)
+    pairs = [(int(streamer_id), int(viewer_id)) for streamer_id, viewer_id in batched(matched, 2)]
+    if not pairs:
+        return []
+
+    viewers_sids = await redis.hmget("matchmaking:sid", [viewer_id for _, viewer_id in pairs])
+    for (streamer_id, _), viewer_sid in zip(pairs, viewers_sids, strict=True):
+        if viewer_sid:
+            await sio.emit(
+                "matchmaking:matched", {"streamer_id": streamer_id}, to=viewer_sid, namespace=namespaces.lobby
+            )
+        await sio.emit("streamers:busy", {"streamer_id": streamer_id}, namespace=namespaces.lobby)
+    return pairs
+
+
+async def release_expired_reservations(sio: socketio.AsyncServer, redis: Redis) -> None:
+    """Зритель не подключился вовремя - место возвращается в лобби и разыгрывается заново"""
+    now_ts = int(utc_now().timestamp())
+    streamers_ids = await redis.zrangebyscore("streamers:reserved:deadlines", 0, now_ts)
+    keys = ("streamers:reserved", "streamers:reserved:deadlines")
+    released = False
+    for streamer_id in streamers_ids:
+        viewer_id = await redis.eval(RELEASE_RESERVATION_SCRIPT, len(keys), *keys, streamer_id, now_ts)
+        if not viewer_id:
+            continue
+
+        released = True
+        pipe = redis.pipeline()
+        mark_streamer_free(pipe, streamer_id)
+        pipe.incr(LOBBY_VERSION_KEY)
+        pipe.hget("matchmaking:sid", viewer_id)
+        *_, viewer_sid = await pipe.execute()
+        if viewer_sid:
+            await sio.emit(
+                "matchmaking:expired", {"streamer_id": int(streamer_id)}, to=viewer_sid, namespace=namespaces.lobby
+            )
+        await sio.emit("streamers:free", {"streamer_id": int(streamer_id)}, namespace=namespaces.lobby)
+
+    if released:
+        await match_viewers(sio, redis)
@@ -1,40 +1,441 @@
+import asyncio
+import gzip
+from contextlib import suppress
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import orjson
 import socketio
 from loguru import logger
 from redis.asyncio import Redis
+from redis.exceptions import ResponseError, WatchError
+from sqlalchemy import ColumnElement, desc
 from sqlalchemy.ext.asyncio.session import AsyncSession
+from types_aiobotocore_s3.client import S3Client
+
+from dependencies.redis import presence_cache
+from models.messages import Conversation, Message
+from repository.messages import ConversationRepository, MessageRepository
+from schemas.messages import ConversationSchema, MessageSchema
+from settings.conf import other_settings, sockets_namespaces
+from utils.libs import utc_now
+
+MESSAGES_STREAM = "messages:stream"
+MESSAGES_GROUP = "messages:writers"
+MESSAGES_EPOCH_MS = 1735689600000  # 2025-01-01 UTC
+# created пишется после выдачи id и, возможно, на другом хосте
+MESSAGES_ID_CLOCK_SKEW = timedelta(minutes=1)
+# id меньше - из sequence, до next_message_id (схема дает их не раньше чем через 2**30 мс, ~12 дней, от эпохи)
+MESSAGES_SCHEME_MIN_ID = 1 << 50
+ARCHIVE_UPLOAD_PART_SIZE = 8 * 1024 * 1024  # S3: части кроме последней не меньше 5 МБ
+# последний элемент заполненного из БД буфера. Метка живет в том же ключе: вытеснили список - вытеснили и ее
+RECENT_MESSAGES_FILLED = "filled"
+
+# новое сообщение в начало буфера, метка заполненности остается последней. ARGV: сообщение, метка, размер, ttl
+PUSH_RECENT_MESSAGE_SCRIPT = """
+local filled = redis.call('LINDEX', KEYS[1], -1) == ARGV[2]
+if filled then
+    redis.call('RPOP', KEYS[1])
+end
+redis.call('LPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[3]) - 1)
+if filled then
+    redis.call('RPUSH', KEYS[1], ARGV[2])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+"""
+
 
-from models.messages import Message
-from repository.messages import MessageRepository
-from schemas.messages import MessageSchema
-from settings.conf import sockets_namespaces
+async def next_message_id(redis: Redis) -> int:
+    """
+    Id выдается до записи в БД: старшие биты - миллисекунды, младшие 20 - счетчик из Redis.
+    Растет вместе с created и служит ключом идемпотентности при записи из стрима
+    """
+    counter = await redis.incr("messages:id:counter")
+    ms = int(utc_now().timestamp() * 1000) - MESSAGES_EPOCH_MS
+    return ms << 20 | counter & 0xFFFFF
+
+
+def message_id_time(message_id: int) -> datetime | None:
+    """Когда выдан id next_message_id. None - id из sequence, по нему время не узнать"""
+    if message_id < MESSAGES_SCHEME_MIN_ID:
+        return None
+    return datetime.fromtimestamp(((message_id >> 20) + MESSAGES_EPOCH_MS) / 1000, UTC)
 
 
 async def create_message(
-    sio: socketio.AsyncServer, db: AsyncSession, redis: Redis, streamer_id: int, from_streamer: bool, text: str
+    sio: socketio.AsyncServer, redis: Redis, streamer_id: int, from_streamer: bool, text: str
 ) -> None:
-    viewer_id = await redis.hget("streamers:viewers", streamer_id)
+    viewer_id = await presence_cache.hget(redis, "streamers:viewers", streamer_id)
     if not viewer_id:
         logger.critical("Not found viewer id when seding message (streamer id: {})", streamer_id)
         return
 
-    repo = MessageRepository(db)
-    obj = Message(streamer_id=streamer_id, viewer_id=int(viewer_id), from_streamer=from_streamer, text=text)
-    await repo.save(obj)
+    if from_streamer:
+        sid = await presence_cache.hget(redis, "viewers:sid", viewer_id)
+    else:
+        sid = await presence_cache.hget(redis, "streamers:sid", streamer_id)
+
+    message = {
+        "id": await next_message_id(redis),
+        "created": utc_now(),
+        "streamer_id": streamer_id,
+        "viewer_id": int(viewer_id),
+        "from_streamer": from_streamer,
+        "text": text,
+    }
+    data = MessageSchema(id=message["id"], created=message["created"], text=text, from_streamer=from_streamer)
+
+    # в БД пишет воркер (flush_messages), доставка не ждет коммита
+    await asyncio.gather(
+        redis.xadd(MESSAGES_STREAM, {"data": orjson.dumps(message)}),
+        sio.emit("message", data.model_dump(), to=sid, namespace=sockets_namespaces.streamers),
+        push_recent_message(redis, streamer_id, viewer_id, data),
+        _incr_unread(redis, streamer_id, int(viewer_id), from_streamer),
+    )
+
 
+def _unread_key(profile_id: int, is_streamer: bool) -> str:
+    """Hash непрочитанных участника: собеседник -> количество"""
+    return f"messages:unread:{'streamers' if is_streamer else 'viewers'}:{profile_id}"
+
+
+async def _incr_unread(redis: Redis, streamer_id: int, viewer_id: int, from_streamer: bool) -> None:
     if from_streamer:
-        sid = await redis.hget("viewers:sid", viewer_id)
+        await redis.hincrby(_unread_key(viewer_id, False), streamer_id)
     else:
-        sid = await redis.hget("streamers:sid", streamer_id)
+        await redis.hincrby(_unread_key(streamer_id, True), viewer_id)
+
+
+async def mark_messages_read(redis: Redis, profile_id: int, is_streamer: bool, counterpart_id: int) -> None:
+    await redis.hdel(_unread_key(profile_id, is_streamer), counterpart_id)
 
-    data = MessageSchema(created=obj.created, text=text, from_streamer=from_streamer)
-    await sio.emit("message", data.model_dump(), to=sid, namespace=sockets_namespaces.streamers)
+
+async def get_unread_counters(redis: Redis, profile_id: int, is_streamer: bool) -> dict[int, int]:
+    """Непрочитанные по всем перепискам участника одним HGETALL, без БД"""
+    counters = await redis.hgetall(_unread_key(profile_id, is_streamer))
+    return {int(counterpart_id): int(count) for counterpart_id, count in counters.items()}
+
+
+def _recent_messages_key(streamer_id: int, viewer_id: int) -> str:
+    return f"messages:{streamer_id}:{viewer_id}:recent"
+
+
+def _encode_recent_message(message: MessageSchema) -> bytes:
+    return orjson.dumps([message.id, message.created.timestamp(), message.from_streamer, message.text])
+
+
+def _decode_recent_message(data: str) -> MessageSchema:
+    message_id, created, from_streamer, text = orjson.loads(data)
+    return MessageSchema(
+        id=message_id, created=datetime.fromtimestamp(created, UTC), from_streamer=from_streamer, text=text
+    )
+
+
+async def push_recent_message(redis: Redis, streamer_id: int, viewer_id: int, message: MessageSchema) -> None:
+    """Без метки буфер остается незаполненным: первое чтение дольет его из БД, не потеряв еще не записанное"""
+    await redis.eval(
+        PUSH_RECENT_MESSAGE_SCRIPT,
+        1,
+        _recent_messages_key(streamer_id, viewer_id),
+        _encode_recent_message(message),
+        RECENT_MESSAGES_FILLED,
+        other_settings.recent_messages_size,
+        int(other_settings.recent_messages_ttl.total_seconds()),
+    )
+
+
+def _message_values(data: str) -> dict:
+    values = orjson.loads(data)
+    values["created"] = values["updated"] = datetime.fromisoformat(values["created"])
+    return values
+
+
+def _conversations_values(messages: list[dict]) -> list[dict]:
+    """Последнее сообщение каждой пары в пачке"""
+    last: dict[tuple[int, int], dict] = {}
+    for message in messages:
+        pair = message["streamer_id"], message["viewer_id"]
+        if pair not in last or last[pair]["id"] < message["id"]:
+            last[pair] = message
+    now = utc_now()
+    return [
+        {
+            "created": now,
+            "updated": now,
+            "streamer_id": message["streamer_id"],
+            "viewer_id": message["viewer_id"],
+            "last_message_id": message["id"],
+            "last_message_created": message["created"],
+            "last_message_from_streamer": message["from_streamer"],
+            "last_message_text": message["text"],
+        }
+        for message in last.values()
+    ]
+
+
+async def flush_messages(
+    db: AsyncSession, redis: Redis, consumer: str, batch_size: int = 1000, min_idle_time: int = 60_000
+) -> int:
+    """
+    Переносит сообщения из стрима в БД пачками вместе с последними сообщениями переписок.
+    At-least-once: запись подтверждается только после коммита,
+    неподтвержденные записи упавших воркеров забираются через XAUTOCLAIM, дубли отсекает id
+    """
+    try:
+        await redis.xgroup_create(MESSAGES_STREAM, MESSAGES_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+    _, entries, *_ = await redis.xautoclaim(
+        MESSAGES_STREAM, MESSAGES_GROUP, consumer, min_idle_time=min_idle_time, start_id="0-0", count=batch_size
+    )
+    repo = MessageRepository(db)
+    flushed = 0
+    while True:
+        if not entries:
+            response = await redis.xreadgroup(MESSAGES_GROUP, consumer, {MESSAGES_STREAM: ">"}, count=batch_size)
+            entries = response and response[0][1]
+        if not entries:
+            return flushed
+
+        ids = [entry_id for entry_id, _ in entries]
+        values = [_message_values(fields["data"]) for _, fields in entries if fields]
+        await repo.insert_ignore_existing(values)
+        await ConversationRepository(db).upsert_last_messages(_conversations_values(values))
+        await db.commit()
+
+        pipe = redis.pipeline()
+        pipe.xack(MESSAGES_STREAM, MESSAGES_GROUP, *ids)
+        pipe.xdel(MESSAGES_STREAM, *ids)
+        await pipe.execute()
+        flushed += len(ids)
+        entries = None
+
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    month = dt.month - 1 + months
+    return dt.replace(year=dt.year + month // 12, month=month % 12 + 1)
+
+
+async def maintain_messages_partitions(db: AsyncSession, months_ahead: int, retention_months: int) -> list[str]:
+    """
+    Создает помесячные партиции на months_ahead месяцев вперед. Возвращает партиции для archive_messages_partition:
+    те, что целиком старше retention_months, и отцепленные, но не удаленные прошлыми запусками
+    """
+    repo = MessageRepository(db)
+    partitions = await repo.list_partitions()
+    month_start = utc_now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    # старая таблица после миграции может покрывать и текущий месяц
+    covered_until = max((upper for upper in partitions.values() if upper), default=month_start)
+    for i in range(months_ahead + 1):
+        start = _add_months(month_start, i)
+        name = f"messages_y{start:%Y}m{start:%m}"
+        if name not in partitions and start >= covered_until:
+            await repo.create_partition(name, start, _add_months(start, 1))
+            logger.info("Created messages partition {}", name)
+
+    cutoff = _add_months(month_start, -retention_months)
+    expired = [name for name, upper in partitions.items() if upper and upper <= cutoff]
+    return [*await repo.list_detached_partitions(), *expired]
+
+
+async def archive_messages_partition(
+    db: AsyncSession, name: str, archive_dir: Path, s3_client: S3Client | None = None, bucket: str = ""
+) -> str:
+    """
+    Выгружает партицию в csv.gz (локально или в S3), потом отцепляет и удаляет ее.
+    Если выгрузка упала, партиция остается и выгрузится при следующем запуске. Возвращает путь/ключ архива
+    """
+    repo = MessageRepository(db)
+    await asyncio.to_thread(archive_dir.mkdir, parents=True, exist_ok=True)
+    path = archive_dir / f"{name}.csv.gz"
+    # сжатие и запись на диск - в потоке, чтобы не держать event loop воркера
+    file = await asyncio.to_thread(gzip.open, path, "wb")
+    try:
+
+        async def write(chunk: bytes) -> None:
+            await asyncio.to_thread(file.write, chunk)
+
+        await repo.copy_partition(name, write)
+    finally:
+        await asyncio.to_thread(file.close)
+
+    location = str(path)
+    if s3_client and bucket:
+        location = f"s3://{bucket}/messages/{path.name}"
+        await _upload_multipart(s3_client, bucket, f"messages/{path.name}", path)
+        await asyncio.to_thread(path.unlink)
+
+    if name in await repo.list_partitions():
+        await repo.detach_partition(name)
+    await repo.drop_partition(name)
+    logger.info("Archived messages partition {} to {}", name, location)
+    return location
+
+
+async def _upload_multipart(
+    s3_client: S3Client, bucket: str, key: str, path: Path, part_size: int = ARCHIVE_UPLOAD_PART_SIZE
+) -> None:
+    """Загрузка файла частями: в памяти не больше одной части. Недогруженная загрузка отменяется"""
+    upload = await s3_client.create_multipart_upload(Bucket=bucket, Key=key)
+    upload_id = upload["UploadId"]
+    parts = []
+    try:
+        with await asyncio.to_thread(path.open, "rb") as file:
+            while chunk := await asyncio.to_thread(file.read, part_size):
+                part_number = len(parts) + 1
+                part = await s3_client.upload_part(
+                    Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=chunk
+                )
+                parts.append({"PartNumber": part_number, "ETag": part["ETag"]})
+        await s3_client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        await s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
 
 
 def _get_message_schema_from_obj(message: Message) -> MessageSchema:
-    return MessageSchema(from_streamer=message.from_streamer, text=message.text, created=message.created)
+    return MessageSchema(id=message.id, from_streamer=message.from_streamer, text=message.text, created=message.created)
+
+
+async def _fill_recent_messages(db: AsyncSession, redis: Redis, streamer_id: int, viewer_id: int) -> None:
+    """
+    Ленивое заполнение буфера из БД. Сообщения, которые уже в буфере, но еще не дошли до БД, сохраняются.
+    Если за время чтения в буфер что-то дописали - не заполняем, попробуем при следующем открытии
+    """
+    key = _recent_messages_key(streamer_id, viewer_id)
+    size = other_settings.recent_messages_size
+    async with redis.pipeline() as pipe:
+        await pipe.watch(key)
+        cached = await pipe.lrange(key, 0, -1)
+        cached = [_decode_recent_message(data) for data in cached if data != RECENT_MESSAGES_FILLED]
+
+        repo = MessageRepository(db)
+        filters = [Message.streamer_id == streamer_id, Message.viewer_id == viewer_id]
+        stored = [
+            _get_message_schema_from_obj(m) for m in await repo.list_(*filters, order_by=desc(Message.id), limit=size)
+        ]
+        merged = {message.id: message for message in (*stored, *cached)}
+        messages = sorted(merged.values(), key=lambda message: message.id, reverse=True)[:size]
+
+        pipe.multi()
+        pipe.delete(key)
+        pipe.rpush(key, *map(_encode_recent_message, messages), RECENT_MESSAGES_FILLED)
+        pipe.expire(key, other_settings.recent_messages_ttl)
+        with suppress(WatchError):
+            await pipe.execute()
+
+
+async def _get_recent_messages(
+    redis: Redis, streamer_id: int, viewer_id: int, limit: int, before_id: int | None, since_id: int | None
+) -> tuple[bool, list[MessageSchema] | None]:
+    """Заполнен ли буфер и страница из него (None, если буфер ее не покрывает)"""
+    cached = await redis.lrange(_recent_messages_key(streamer_id, viewer_id), 0, -1)
+    if not cached or cached[-1] != RECENT_MESSAGES_FILLED:
+        return False, None
 
+    messages = [_decode_recent_message(data) for data in cached[:-1]]  # от новых к старым
+    # буфер не заполнен до конца - значит в нем вся переписка
+    complete = len(messages) < other_settings.recent_messages_size
+    if before_id is not None:
+        messages = [message for message in messages if message.id < before_id]
+    if since_id is not None:
+        if not complete and messages and messages[-1].id > since_id:
+            return True, None
+        return True, [message for message in reversed(messages) if message.id > since_id][:limit]
+
+    page = messages[:limit]
+    if len(page) < limit and not complete:
+        return True, None
+    page.reverse()
+    return True, page
+
+
+async def get_messages(
+    db: AsyncSession,
+    redis: Redis,
+    streamer_id: int,
+    viewer_id: int,
+    limit: int = 50,
+    before_id: int | None = None,
+    since_id: int | None = None,
+) -> list[MessageSchema]:
+    """
+    Страница переписки по возрастанию (created, id). Id растет вместе с created, поэтому курсором служит id.
+    По умолчанию - последние limit сообщений, before_id - страница старше, since_id - новее (догрузка пропущенного).
+    Свежие страницы отдаются из буфера в Redis, более старые - из БД
+    """
+    filled, page = await _get_recent_messages(redis, streamer_id, viewer_id, limit, before_id, since_id)
+    if not filled and before_id is None:
+        await _fill_recent_messages(db, redis, streamer_id, viewer_id)
+        filled, page = await _get_recent_messages(redis, streamer_id, viewer_id, limit, before_id, since_id)
+    if page is not None:
+        return page
 
-async def get_messages(db: AsyncSession, streamer_id: int, viewer_id: int) -> list[MessageSchema]:
     repo = MessageRepository(db)
-    messages = await repo.list_(Message.viewer_id == viewer_id, Message.streamer_id == streamer_id)
+    filters = _messages_page_filters(streamer_id, viewer_id, before_id, since_id)
+    order_by = Message.id if since_id is not None else desc(Message.id)
+    messages = await repo.list_(*filters, order_by=order_by, limit=limit)
+    if since_id is None:
+        messages.reverse()
     return [_get_message_schema_from_obj(message) for message in messages]
+
+
+def _messages_page_filters(
+    streamer_id: int, viewer_id: int, before_id: int | None, since_id: int | None
+) -> list[ColumnElement[bool]]:
+    """
+    Условия страницы по курсору. messages партиционирована по created: граница created из времени id курсора
+    отсекает лишние партиции, иначе индекс (streamer_id, viewer_id, id) проверяется в каждой
+    """
+    filters = [Message.streamer_id == streamer_id, Message.viewer_id == viewer_id]
+    if before_id is not None:
+        filters.append(Message.id < before_id)
+        if before := message_id_time(before_id):
+            filters.append(Message.created < before + MESSAGES_ID_CLOCK_SKEW)
+    if since_id is not None:
+        filters.append(Message.id > since_id)
+        if since := message_id_time(since_id):
+            filters.append(Message.created > since - MESSAGES_ID_CLOCK_SKEW)
+    return filters
+
+
+async def get_conversations(
+    db: AsyncSession,
+    streamer_id: int | None = None,
+    viewer_id: int | None = None,
+    limit: int = 50,
+    before_id: int | None = None,
+) -> list[ConversationSchema]:
+    """
+    Переписки стримера (или зрителя) с последним сообщением, от свежих к старым.
+    Курсор - id последнего сообщения в последней переписке страницы
+    """
+    filters = []
+    if streamer_id is not None:
+        filters.append(Conversation.streamer_id == streamer_id)
+    if viewer_id is not None:
+        filters.append(Conversation.viewer_id == viewer_id)
+    if before_id is not None:
+        filters.append(Conversation.last_message_id < before_id)
+
+    repo = ConversationRepository(db)
+    conversations = await repo.list_(*filters, order_by=desc(Conversation.last_message_id), limit=limit)
+    return [
+        ConversationSchema(
+            streamer_id=conversation.streamer_id,
+            viewer_id=conversation.viewer_id,
+            last_message=MessageSchema(
+                id=conversation.last_message_id,
+                created=conversation.last_message_created,
+                from_streamer=conversation.last_message_from_streamer,
+                text=conversation.last_message_text,
+            ),
+        )
+        for conversation in conversations
+    ]
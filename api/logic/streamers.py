@@ -1,17 +1,60 @@
+import asyncio
+from collections.abc import Iterable
 from datetime import timedelta
+from typing import Literal
 
+import orjson
 import socketio
 from redis.asyncio import Redis
 from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
+from dependencies.db import _get_db
+from dependencies.redis import presence_cache
 from exceptions.bases import Http404
 from models.streamers import StreamerMark, StreamerProfile
 from repository.streamers import StreamerMarkRepository, StreamerProfileRepository
 from schemas.streamers import StreamerSchema
-from settings.conf import sockets_namespaces as namespaces
+from settings.conf import other_settings, sockets_namespaces as namespaces
+from utils.cache import TwoTierCache
 from utils.libs import utc_now
 
+# версия множества свободных стримеров, растет на каждом переходе присутствия
+LOBBY_VERSION_KEY = "streamers:free:version"
+LOBBY_PAYLOAD_KEY = "streamers:free:payload"
+
+# свободные онлайн стримеры по рейтингу. Рейтинг онлайн стримеров (streamers:rating) фиксируется при подключении
+# и нужен, чтобы вернуть стримера в streamers:free, когда освобождается место
+MARK_STREAMER_FREE_SCRIPT = """
+local rating = redis.call('ZSCORE', KEYS[2], ARGV[1])
+if rating and redis.call('HEXISTS', KEYS[3], ARGV[1]) == 0 and redis.call('HEXISTS', KEYS[4], ARGV[1]) == 0 then
+    redis.call('ZADD', KEYS[1], rating, ARGV[1])
+end
+"""
+
+# новый рейтинг онлайн стримера: меняет и порядок в лобби, если стример свободен
+UPDATE_STREAMER_RATING_SCRIPT = """
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+    if redis.call('ZADD', KEYS[2], 'XX', 'CH', ARGV[2], ARGV[1]) == 1 then
+        redis.call('INCR', KEYS[3])
+    end
+end
+"""
+
+type LobbySort = Literal["rating", "-rating"]
+
+_lobby_rebuilds: dict[tuple, asyncio.Future[str]] = {}
+
+
+def mark_streamer_free(redis: Redis, streamer_id: int | str):
+    """
+    Добавить стримера в streamers:free, если он онлайн, без зрителя и не забронирован очередью.
+    Атомарно, можно звать на пайплайне
+    """
+    keys = ("streamers:free", "streamers:rating", "streamers:viewers", "streamers:reserved")
+    return redis.eval(MARK_STREAMER_FREE_SCRIPT, len(keys), *keys, streamer_id)
+
 
 async def disconnect_streamer(sio: socketio.AsyncServer, redis: Redis, streamer_id: int, reason: str) -> None:
     async with redis.lock(f"streamers:{streamer_id}:disconnect:lock", timeout=5):
@@ -24,9 +67,15 @@ async def disconnect_streamer(sio: socketio.AsyncServer, redis: Redis, streamer_
         if sid:
             pipe = redis.pipeline()
             pipe.zrem("streamers:online", streamer_id)
+            pipe.zrem("streamers:rating", streamer_id)
+            pipe.zrem("streamers:free", streamer_id)
+            pipe.hdel("streamers:reserved", streamer_id)
+            pipe.zrem("streamers:reserved:deadlines", streamer_id)
             pipe.hdel("streamers:sid", streamer_id)
+            pipe.incr(LOBBY_VERSION_KEY)
             pipe.hget("viewers:sid", viewer_id)
             *_, viewer_sid = await pipe.execute()
+            presence_cache.invalidate("streamers:sid")
 
             if viewer_sid:
                 await sio.emit(
@@ -37,16 +86,22 @@ async def disconnect_streamer(sio: socketio.AsyncServer, redis: Redis, streamer_
             await sio.disconnect(sid, namespaces.streamers)
 
 
-async def connect_streamer(sio: socketio.AsyncServer, redis: Redis, streamer_id: int, sid: str) -> None:
+async def connect_streamer(
+    sio: socketio.AsyncServer, redis: Redis, streamer_id: int, sid: str, rating: float = 0
+) -> None:
     async with redis.lock(f"streamers:{streamer_id}:connect:lock", timeout=5):
         await disconnect_streamer(sio, redis, streamer_id, "second_connect")
 
         now_ts = int(utc_now().timestamp())
         pipe = redis.pipeline()
         pipe.zadd("streamers:online", {streamer_id: now_ts})
+        pipe.zadd("streamers:rating", {streamer_id: rating})
+        mark_streamer_free(pipe, streamer_id)
         pipe.hset("streamers:sid", streamer_id, sid)
+        pipe.incr(LOBBY_VERSION_KEY)
         pipe.hget("streamers:viewers", streamer_id)
         *_, viewer_id = await pipe.execute()
+        presence_cache.invalidate("streamers:sid")
 
         if viewer_id:
             viewer_sid = await redis.hget("viewers:sid", viewer_id)
@@ -56,26 +111,95 @@ async def connect_streamer(sio: socketio.AsyncServer, redis: Redis, streamer_id:
         await sio.emit("streamers:connected", {"streamer_id": streamer_id}, namespace=namespaces.lobby)
 
 
+async def resume_streamer(sio: socketio.AsyncServer, redis: Redis, streamer_id: int, sid: str) -> bool:
+    """
+    Вернуть присутствие переподключившемуся стримеру: sid подменяется на месте,
+    без отключения зрителя и событий в лобби. False - присутствие уже снято, нужен обычный connect
+    """
+    lock = redis.lock(f"streamers:{streamer_id}:connect:lock", timeout=5)
+    disconnect_lock = redis.lock(f"streamers:{streamer_id}:disconnect:lock", timeout=5)
+    async with lock, disconnect_lock:
+        old_sid = await redis.hget("streamers:sid", streamer_id)
+        if not old_sid:
+            return False
+
+        now_ts = int(utc_now().timestamp())
+        pipe = redis.pipeline()
+        pipe.zadd("streamers:online", {streamer_id: now_ts})
+        pipe.hset("streamers:sid", streamer_id, sid)
+        pipe.hget("streamers:viewers", streamer_id)
+        *_, viewer_id = await pipe.execute()
+        presence_cache.invalidate("streamers:sid")
+
+    # зрителю нужно переподнять WebRTC с новым сокетом
+    viewer_sid = viewer_id and await redis.hget("viewers:sid", viewer_id)
+    if viewer_sid:
+        await sio.emit("streamers:connected", to=viewer_sid, namespace=namespaces.streamers)
+    if old_sid != sid:
+        await sio.disconnect(old_sid, namespaces.streamers)
+    return True
+
+
+async def update_online_streamer_rating(redis: Redis, streamer_id: int, rating: float | None) -> None:
+    """Звать после коммита нового рейтинга. Офлайн стримеров не касается - рейтинг возьмется при подключении"""
+    keys = ("streamers:rating", "streamers:free", LOBBY_VERSION_KEY)
+    await redis.eval(UPDATE_STREAMER_RATING_SCRIPT, len(keys), *keys, streamer_id, float(rating or 0))
+
+
+async def sync_streamer_rating(db: AsyncSession, redis: Redis, streamer_id: int) -> None:
+    """Рейтинг онлайн стримера из БД, после правок в обход rate_streamer"""
+    streamers = await StreamerProfileRepository(db).list_by_ids([streamer_id])
+    if streamers:
+        await update_online_streamer_rating(redis, streamer_id, streamers[0].rating)
+
+
+async def rebuild_free_streamers(db: AsyncSession, redis: Redis) -> None:
+    """
+    Пересборка streamers:rating и streamers:free по streamers:online с рейтингами из БД.
+    Идемпотентна, зовется при старте: стримеры, подключенные до появления этих множеств или пока они
+    расходились с присутствием, иначе не попадут в лобби и очередь до переподключения
+    """
+    online_ids = list(map(int, await redis.zrange("streamers:online", 0, -1)))
+    streamers = await StreamerProfileRepository(db).list_by_ids(online_ids) if online_ids else []
+    ratings = {streamer.id: float(streamer.rating or 0) for streamer in streamers}
+
+    pipe = redis.pipeline()
+    pipe.zrange("streamers:rating", 0, -1)
+    pipe.zrange("streamers:free", 0, -1)
+    stale = {int(i) for members in await pipe.execute() for i in members} - set(online_ids)
+
+    pipe = redis.pipeline()
+    if stale:
+        pipe.zrem("streamers:rating", *stale)
+        pipe.zrem("streamers:free", *stale)
+    if ratings:
+        pipe.zadd("streamers:rating", ratings)
+    for streamer_id in ratings:
+        mark_streamer_free(pipe, streamer_id)
+    pipe.incr(LOBBY_VERSION_KEY)
+    await pipe.execute()
+
+
 async def ping_streamer(redis: Redis, streamer_id: int) -> None:
     now_ts = int(utc_now().timestamp())
     await redis.zadd("streamers:online", {streamer_id: now_ts})
 
 
 async def offer_from_streamer(sio: socketio.AsyncServer, redis: Redis, streamer_id: int, data: dict) -> None:
-    viewer_id = await redis.hget("streamers:viewers", streamer_id)
-    viewer_sid = await redis.hget("viewers:sid", viewer_id)
+    viewer_id = await presence_cache.hget(redis, "streamers:viewers", streamer_id)
+    viewer_sid = await presence_cache.hget(redis, "viewers:sid", viewer_id)
     await sio.emit("webrtc:offer", data, to=viewer_sid, namespace=namespaces.streamers)
 
 
 async def answer_from_streamer(sio: socketio.AsyncServer, redis: Redis, streamer_id: int, data: dict) -> None:
-    viewer_id = await redis.hget("streamers:viewers", streamer_id)
-    viewer_sid = await redis.hget("viewers:sid", viewer_id)
+    viewer_id = await presence_cache.hget(redis, "streamers:viewers", streamer_id)
+    viewer_sid = await presence_cache.hget(redis, "viewers:sid", viewer_id)
     await sio.emit("webrtc:answer", data, to=viewer_sid, namespace=namespaces.streamers)
 
 
 async def ice_from_streamer(sio: socketio.AsyncServer, redis: Redis, streamer_id: int, data: dict) -> None:
-    viewer_id = await redis.hget("streamers:viewers", streamer_id)
-    viewer_sid = await redis.hget("viewers:sid", viewer_id)
+    viewer_id = await presence_cache.hget(redis, "streamers:viewers", streamer_id)
+    viewer_sid = await presence_cache.hget(redis, "viewers:sid", viewer_id)
     await sio.emit("webrtc:ice", data, to=viewer_sid, namespace=namespaces.streamers)
 
 
@@ -86,64 +210,154 @@ async def clean_offline_streamers(sio: socketio.AsyncServer, redis: Redis) -> No
         await disconnect_streamer(sio, redis, streamer_id, "inactive")
 
 
-async def get_streamer_rating(db: AsyncSession, streamer_id: int) -> tuple[float, int]:
-    q = select(
-        func.avg(StreamerMark.mark).label("avg_mark"),
-    ).where(StreamerMark.streamer_id == streamer_id)
+def serialize_streamer(streamer: StreamerProfile) -> StreamerSchema:
+    rating = streamer.rating
+    rating = rating and round(rating, 2)
+    return StreamerSchema(id=streamer.id, name=streamer.name, rating=rating, avatar_url=streamer.avatar_url)
 
-    result = await db.execute(q)
-    return result.one()[0]
 
+# карточки профилей меняются только из админки и оценками, поэтому хранятся готовым JSON
+streamers_cards: TwoTierCache[int] = TwoTierCache(
+    "streamers:cards",
+    other_settings.profile_cards_ttl,
+    other_settings.profile_cards_local_ttl,
+    other_settings.profile_cards_max_size,
+)
 
-async def serialize_streamer(db: AsyncSession, streamer: StreamerProfile) -> StreamerSchema:
-    rating = streamer.force_rating or await get_streamer_rating(db, streamer.id)
-    rating = rating and round(rating, 2)
 
-    avatar_url = streamer.avatar_url
-    return StreamerSchema(id=streamer.id, name=streamer.name, rating=rating, avatar_url=avatar_url)
+async def _load_streamers_cards(streamers_ids: list[int]) -> dict[int, str]:
+    # загрузку ждут несколько запросов, поэтому сессия своя: сессия первого закрывается вместе с ним
+    async with _get_db() as db:
+        streamers = await StreamerProfileRepository(db).list_by_ids(streamers_ids)
+    return {streamer.id: serialize_streamer(streamer).model_dump_json() for streamer in streamers}
 
 
-async def get_streamer(db: AsyncSession, redis: Redis, streamer_id: int) -> StreamerSchema:
-    repo = StreamerProfileRepository(db)
-    streamer = await repo.first(StreamerProfile.id == streamer_id)
-    if not streamer:
+async def get_streamers_cards(redis: Redis, streamers_ids: Iterable[int]) -> dict[int, str]:
+    """JSON карточек StreamerSchema. Несуществующих стримеров в ответе нет"""
+    return await streamers_cards.get_many(redis, streamers_ids, _load_streamers_cards)
+
+
+async def get_streamer_card(redis: Redis, streamer_id: int) -> str:
+    card = (await get_streamers_cards(redis, [streamer_id])).get(streamer_id)
+    if card is None:
         raise Http404
+    return card
 
-    return await serialize_streamer(db, streamer)
 
+async def get_streamer(redis: Redis, streamer_id: int) -> StreamerSchema:
+    return StreamerSchema.model_validate_json(await get_streamer_card(redis, streamer_id))
 
-async def get_free_online_streamers_ids(redis: Redis) -> list[int]:
-    pipe = redis.pipeline()
-    pipe.zrange("streamers:online", 0, -1)
-    pipe.hkeys("streamers:viewers")
-    online_streamers_ids, busy_streamers_ids = await pipe.execute()
-    return list(map(int, set(online_streamers_ids) - set(busy_streamers_ids)))
 
+def serialize_cards_batch(ids: Iterable[int], cards: dict[int, str]) -> str:
+    """JSON ответа пакетного запроса карточек: найденные в порядке запроса и список отсутствующих id"""
+    ids = list(dict.fromkeys(ids))
+    items = ",".join(cards[i] for i in ids if i in cards)
+    return f'{{"items":[{items}],"missing":{orjson.dumps([i for i in ids if i not in cards]).decode()}}}'
 
-async def get_free_online_streamers(db: AsyncSession, redis: Redis) -> list[StreamerSchema]:
-    streamers_ids = await get_free_online_streamers_ids(redis)
-    if not streamers_ids:
-        return []
 
-    repo = StreamerProfileRepository(db)
-    streamers = await repo.list_(StreamerProfile.id.in_(streamers_ids))
-    return [await serialize_streamer(db, streamer) for streamer in streamers]
+async def get_streamers_batch(redis: Redis, streamers_ids: list[int]) -> str:
+    return serialize_cards_batch(streamers_ids, await get_streamers_cards(redis, streamers_ids))
+
+
+async def invalidate_streamer_card(redis: Redis, streamer_id: int) -> None:
+    """Звать после коммита, иначе параллельный запрос успеет закэшировать старую карточку"""
+    await streamers_cards.invalidate(redis, streamer_id)
+
+
+async def warm_streamers_cards(redis: Redis) -> None:
+    """Прогрев карточек онлайн стримеров при старте, чтобы первые списки лобби не шли в БД"""
+    streamers_ids = list(map(int, await redis.zrange("streamers:online", 0, -1)))
+    await get_streamers_cards(redis, streamers_ids)
+
+
+async def get_free_online_streamers_ids(
+    redis: Redis, limit: int | None = None, cursor: int = 0, sort: LobbySort = "-rating"
+) -> list[int]:
+    """Страница streamers:free, cursor - смещение. O(log N + limit)"""
+    stop = -1 if limit is None else cursor + limit - 1
+    streamers_ids = await redis.zrange("streamers:free", cursor, stop, desc=sort == "-rating")
+    return list(map(int, streamers_ids))
+
 
+async def get_free_online_streamers(
+    redis: Redis, limit: int | None = None, cursor: int = 0, sort: LobbySort = "-rating"
+) -> list[StreamerSchema]:
+    cards = await _get_free_online_streamers_cards(redis, limit, cursor, sort)
+    return [StreamerSchema.model_validate_json(card) for card in cards]
 
-async def rate_streamer(db: AsyncSession, viewer_id: int, mark: int, streamer_id: int) -> None:
+
+async def _get_free_online_streamers_cards(redis: Redis, limit: int | None, cursor: int, sort: LobbySort) -> list[str]:
+    streamers_ids = await get_free_online_streamers_ids(redis, limit, cursor, sort)
+    cards = await get_streamers_cards(redis, streamers_ids)
+    return [cards[i] for i in streamers_ids if i in cards]
+
+
+async def get_free_online_streamers_payload(
+    redis: Redis, limit: int | None = None, cursor: int = 0, sort: LobbySort = "-rating"
+) -> str:
+    """
+    Готовый JSON страницы свободных стримеров. В Redis лежит вместе с версией присутствия, на которой собран:
+    пока версия та же - ответ стоит один MGET. Конкурентные пересборки одной версии в процессе склеиваются в одну.
+    Пересборка общая для нескольких запросов, поэтому от сессии запроса не зависит (карточки грузятся в своей)
+    """
+    payload_key = f"{LOBBY_PAYLOAD_KEY}:{sort}:{cursor}:{limit}"
+    version, cached = await redis.mget(LOBBY_VERSION_KEY, payload_key)
+    version = version or "0"
+    if cached:
+        cached_version, _, payload = cached.partition("\n")
+        if cached_version == version:
+            return payload
+
+    rebuild_key = (version, payload_key)
+    rebuild = _lobby_rebuilds.get(rebuild_key)
+    if rebuild is None:
+        rebuild = asyncio.ensure_future(
+            _rebuild_free_online_streamers_payload(redis, version, payload_key, limit, cursor, sort)
+        )
+        _lobby_rebuilds[rebuild_key] = rebuild
+        rebuild.add_done_callback(lambda _: _lobby_rebuilds.pop(rebuild_key, None))
+    # отмена одного запроса не должна отменять пересборку для остальных
+    return await asyncio.shield(rebuild)
+
+
+async def _rebuild_free_online_streamers_payload(
+    redis: Redis, version: str, payload_key: str, limit: int | None, cursor: int, sort: LobbySort
+) -> str:
+    # карточки уже в JSON, список склеивается без сериализации
+    cards = await _get_free_online_streamers_cards(redis, limit, cursor, sort)
+    payload = f"[{','.join(cards)}]"
+    # если версия успела смениться, запись с прошлой версией просто не совпадет при чтении
+    await redis.set(payload_key, f"{version}\n{payload}", ex=other_settings.lobby_payload_ttl)
+    return payload
+
+
+async def rate_streamer(db: AsyncSession, viewer_id: int, mark: int, streamer_id: int) -> float | None:
+    """Возвращает новый рейтинг стримера"""
     repo = StreamerProfileRepository(db)
-    streamer_exists = await repo.exists(StreamerProfile.id == streamer_id)
-    if not streamer_exists:
+    # строка стримера заблокирована до конца транзакции: оценки стримера и агрегаты меняются по очереди
+    streamer = await repo.get(StreamerProfile.id == streamer_id, select_for_update=True, raise_exception_if_none=False)
+    if not streamer:
         raise Http404
 
-    streamers_marks_repo = StreamerMarkRepository(db)
-    await streamers_marks_repo.update_or_create(
-        {"mark": mark},
-        viewer_id=viewer_id,
-        streamer_id=streamer_id,
+    old_mark = await StreamerMarkRepository(db).upsert_mark(viewer_id, streamer_id, mark)
+    streamer.rating_sum += mark - (old_mark or 0)
+    streamer.rating_count += 1 if old_mark is None else 0
+    await repo.flush()
+    return streamer.rating
+
+
+async def refresh_streamer_rating(db: AsyncSession, streamer_id: int) -> None:
+    """Пересчет агрегатов по всем оценкам. Для правок оценок в обход rate_streamer (админка)"""
+    q = select(func.coalesce(func.sum(StreamerMark.mark), 0), func.count()).where(
+        StreamerMark.streamer_id == streamer_id
+    )
+    rating_sum, rating_count = (await db.execute(q)).one()
+    repo = StreamerProfileRepository(db)
+    await repo.update(
+        StreamerProfile.id == streamer_id, values={"rating_sum": rating_sum, "rating_count": rating_count}
     )
 
 
 async def is_streamer_exists(db: AsyncSession, streamer_id: int) -> bool:
     repo = StreamerProfileRepository(db)
-    return await repo.exists(StreamerProfile.id == streamer_id)
+    return await repo.exists_by_id(streamer_id)
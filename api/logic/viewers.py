@@ -1,17 +1,50 @@
+from collections.abc import Iterable
 from datetime import timedelta
 
 import socketio
 from redis.asyncio import Redis
-from sqlalchemy.ext.asyncio.session import AsyncSession
 
+from dependencies.db import _get_db
+from dependencies.redis import presence_cache
 from exceptions.bases import Http404
 from exceptions.streamers import NoSeatsError
+from logic.matchmaking import match_viewers
+from logic.streamers import LOBBY_VERSION_KEY, mark_streamer_free, serialize_cards_batch
 from models.viewers import ViewerProfile
 from repository.viewers import ViewerProfileRepository
 from schemas.streamers import ViewerSchema
-from settings.conf import sockets_namespaces as namespaces
+from settings.conf import other_settings, sockets_namespaces as namespaces
+from utils.cache import TwoTierCache
 from utils.libs import utc_now
 
+# место занимается атомарно с проверкой брони очереди: свободно или забронировано этим же зрителем
+CLAIM_SEAT_SCRIPT = """
+local viewer = redis.call('HGET', KEYS[1], ARGV[1])
+local reserved = redis.call('HGET', KEYS[2], ARGV[1])
+if (viewer and viewer ~= ARGV[2]) or (reserved and reserved ~= ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[4], ARGV[1])
+redis.call('ZREM', KEYS[5], ARGV[2])
+redis.call('HDEL', KEYS[6], ARGV[2])
+return 1
+"""
+
+
+async def claim_seat(redis: Redis, viewer_id: int, streamer_id: int) -> bool:
+    keys = (
+        "streamers:viewers",
+        "streamers:reserved",
+        "streamers:reserved:deadlines",
+        "streamers:free",
+        "matchmaking:queue",
+        "matchmaking:sid",
+    )
+    return bool(await redis.eval(CLAIM_SEAT_SCRIPT, len(keys), *keys, streamer_id, viewer_id))
+
 
 async def disconnect_viewer(sio: socketio.AsyncServer, redis: Redis, viewer_id: int, reason: str) -> None:
     async with redis.lock(f"viewers:{viewer_id}:disconnect:lock", timeout=5):
@@ -26,8 +59,11 @@ async def disconnect_viewer(sio: socketio.AsyncServer, redis: Redis, viewer_id:
             pipe.hdel("viewers:sid", viewer_id)
             pipe.hdel("streamers:viewers", streamer_id)
             pipe.hdel("viewers:streamers", viewer_id)
+            mark_streamer_free(pipe, streamer_id)
+            pipe.incr(LOBBY_VERSION_KEY)
             pipe.hget("streamers:sid", streamer_id)
             *_, streamer_sid = await pipe.execute()
+            presence_cache.invalidate("viewers:sid", "streamers:viewers", "viewers:streamers")
 
             if streamer_sid:
                 await sio.emit(
@@ -36,24 +72,33 @@ async def disconnect_viewer(sio: socketio.AsyncServer, redis: Redis, viewer_id:
             await sio.emit("streamers:free", {"streamer_id": streamer_id}, namespace=namespaces.lobby)
             await sio.emit("viewers:disconnected", {"reason": reason}, to=sid, namespace=namespaces.streamers)
             await sio.disconnect(sid, namespaces.streamers)
+            await match_viewers(sio, redis)
 
 
 async def connect_viewer(sio: socketio.AsyncServer, redis: Redis, viewer_id: int, sid: str, streamer_id: int) -> None:
     async with redis.lock(f"streamer:{streamer_id}:viewers:lock", timeout=5):
-        connected_viewer_id = await redis.hget("streamers:viewers", streamer_id)
-        if connected_viewer_id and connected_viewer_id != str(viewer_id):
+        pipe = redis.pipeline()
+        pipe.hget("streamers:viewers", streamer_id)
+        pipe.hget("streamers:reserved", streamer_id)
+        holders = await pipe.execute()
+        if any(holder and holder != str(viewer_id) for holder in holders):
             raise NoSeatsError
 
         await disconnect_viewer(sio, redis, viewer_id, "second_connect")
 
+        # очередь могла забронировать место, пока зритель отключался от прошлого
+        if not await claim_seat(redis, viewer_id, streamer_id):
+            raise NoSeatsError
+
         now_ts = int(utc_now().timestamp())
         pipe = redis.pipeline()
         pipe.zadd("viewers:online", {viewer_id: now_ts})
         pipe.hset("viewers:sid", viewer_id, sid)
-        pipe.hset("streamers:viewers", streamer_id, viewer_id)
         pipe.hset("viewers:streamers", viewer_id, streamer_id)
+        pipe.incr(LOBBY_VERSION_KEY)
         pipe.hget("streamers:sid", streamer_id)
         *_, streamer_sid = await pipe.execute()
+        presence_cache.invalidate("viewers:sid", "streamers:viewers", "viewers:streamers")
 
         if streamer_sid:
             await sio.emit(
@@ -63,26 +108,57 @@ async def connect_viewer(sio: socketio.AsyncServer, redis: Redis, viewer_id: int
         await sio.emit("streamers:busy", {"streamer_id": streamer_id}, namespace=namespaces.lobby)
 
 
+async def resume_viewer(sio: socketio.AsyncServer, redis: Redis, viewer_id: int, sid: str, streamer_id: int) -> bool:
+    """
+    Вернуть место переподключившемуся зрителю: sid подменяется на месте, место не освобождается,
+    лобби ничего не видит. False - место уже потеряно, нужен обычный connect
+    """
+    lock = redis.lock(f"streamer:{streamer_id}:viewers:lock", timeout=5)
+    disconnect_lock = redis.lock(f"viewers:{viewer_id}:disconnect:lock", timeout=5)
+    async with lock, disconnect_lock:
+        pipe = redis.pipeline()
+        pipe.hget("viewers:sid", viewer_id)
+        pipe.hget("viewers:streamers", viewer_id)
+        old_sid, connected_streamer_id = await pipe.execute()
+        if not old_sid or connected_streamer_id != str(streamer_id):
+            return False
+
+        now_ts = int(utc_now().timestamp())
+        pipe = redis.pipeline()
+        pipe.zadd("viewers:online", {viewer_id: now_ts})
+        pipe.hset("viewers:sid", viewer_id, sid)
+        pipe.hget("streamers:sid", streamer_id)
+        *_, streamer_sid = await pipe.execute()
+        presence_cache.invalidate("viewers:sid")
+
+    # стримеру нужно переподнять WebRTC с новым сокетом
+    if streamer_sid:
+        await sio.emit("viewers:connected", {"viewer_id": viewer_id}, to=streamer_sid, namespace=namespaces.streamers)
+    if old_sid != sid:
+        await sio.disconnect(old_sid, namespaces.streamers)
+    return True
+
+
 async def ping_viewer(redis: Redis, viewer_id: int) -> None:
     now_ts = int(utc_now().timestamp())
     await redis.zadd("viewers:online", {viewer_id: now_ts})
 
 
 async def offer_from_viewer(sio: socketio.AsyncServer, redis: Redis, viewer_id: int, data: dict) -> None:
-    streamer_id = await redis.hget("viewers:streamers", viewer_id)
-    streamer_sid = await redis.hget("streamers:sid", streamer_id)
+    streamer_id = await presence_cache.hget(redis, "viewers:streamers", viewer_id)
+    streamer_sid = await presence_cache.hget(redis, "streamers:sid", streamer_id)
     await sio.emit("webrtc:offer", data, to=streamer_sid, namespace=namespaces.streamers)
 
 
 async def answer_from_viewer(sio: socketio.AsyncServer, redis: Redis, viewer_id: int, data: dict) -> None:
-    streamer_id = await redis.hget("viewers:streamers", viewer_id)
-    streamer_sid = await redis.hget("streamers:sid", streamer_id)
+    streamer_id = await presence_cache.hget(redis, "viewers:streamers", viewer_id)
+    streamer_sid = await presence_cache.hget(redis, "streamers:sid", streamer_id)
     await sio.emit("webrtc:answer", data, to=streamer_sid, namespace=namespaces.streamers)
 
 
 async def ice_from_viewer(sio: socketio.AsyncServer, redis: Redis, viewer_id: int, data: dict) -> None:
-    streamer_id = await redis.hget("viewers:streamers", viewer_id)
-    streamer_sid = await redis.hget("streamers:sid", streamer_id)
+    streamer_id = await presence_cache.hget(redis, "viewers:streamers", viewer_id)
+    streamer_sid = await presence_cache.hget(redis, "streamers:sid", streamer_id)
     await sio.emit("webrtc:ice", data, to=streamer_sid, namespace=namespaces.streamers)
 
 
@@ -97,18 +173,48 @@ def serialize_viewer(viewer: ViewerProfile) -> ViewerSchema:
     return ViewerSchema(id=viewer.id, name=viewer.name)
 
 
-async def get_viewer(db: AsyncSession, viewer_id: int) -> ViewerSchema:
-    repo = ViewerProfileRepository(db)
-    viewer = await repo.first(ViewerProfile.id == viewer_id)
-    if not viewer:
+viewers_cards: TwoTierCache[int] = TwoTierCache(
+    "viewers:cards",
+    other_settings.profile_cards_ttl,
+    other_settings.profile_cards_local_ttl,
+    other_settings.profile_cards_max_size,
+)
+
+
+async def _load_viewers_cards(viewers_ids: list[int]) -> dict[int, str]:
+    async with _get_db() as db:
+        viewers = await ViewerProfileRepository(db).list_by_ids(viewers_ids)
+    return {viewer.id: serialize_viewer(viewer).model_dump_json() for viewer in viewers}
+
+
+async def get_viewers_cards(redis: Redis, viewers_ids: Iterable[int]) -> dict[int, str]:
+    """JSON карточек ViewerSchema. Несуществующих зрителей в ответе нет"""
+    return await viewers_cards.get_many(redis, viewers_ids, _load_viewers_cards)
+
+
+async def get_viewer_card(redis: Redis, viewer_id: int) -> str:
+    card = (await get_viewers_cards(redis, [viewer_id])).get(viewer_id)
+    if card is None:
         raise Http404
+    return card
+
+
+async def get_viewer(redis: Redis, viewer_id: int) -> ViewerSchema:
+    return ViewerSchema.model_validate_json(await get_viewer_card(redis, viewer_id))
+
+
+async def get_viewers_batch(redis: Redis, viewers_ids: list[int]) -> str:
+    return serialize_cards_batch(viewers_ids, await get_viewers_cards(redis, viewers_ids))
+
 
-    return serialize_viewer(viewer)
+async def invalidate_viewer_card(redis: Redis, viewer_id: int) -> None:
+    """Звать после коммита, иначе параллельный запрос успеет закэшировать старую карточку"""
+    await viewers_cards.invalidate(redis, viewer_id)
 
 
-async def get_streamer_viewer(db: AsyncSession, redis: Redis, streamer_id: int) -> ViewerSchema:
-    viewer_id = await redis.hget("streamers:viewers", streamer_id)
+async def get_streamer_viewer(redis: Redis, streamer_id: int) -> ViewerSchema:
+    viewer_id = await presence_cache.hget(redis, "streamers:viewers", streamer_id)
     if not viewer_id:
         raise Http404
 
-    return await get_viewer(db, viewer_id)
+    return await get_viewer(redis, int(viewer_id))
@@ -0,0 +1,36 @@
+"""add_messages_pair_index
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: str | None = "0005"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # concurrently - без блокировки записи в большую таблицу
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_streamer_id_viewer_id_id",
+            "messages",
+            ["streamer_id", "viewer_id", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_messages_streamer_id_viewer_id_id", table_name="messages", postgresql_concurrently=True)
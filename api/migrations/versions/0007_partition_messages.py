@@ -0,0 +1,123 @@
+"""partition_messages
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: str | None = "0006"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # старая таблица становится партицией с уже накопленными сообщениями, данные не копируются.
+    # Ключ (id, created) для нее строим заранее без блокировки записи
+    with op.get_context().autocommit_block():
+        op.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS messages_legacy_pkey ON messages (id, created)")
+    op.execute("ALTER TABLE messages DROP CONSTRAINT messages_pkey")
+    op.execute("ALTER TABLE messages ADD CONSTRAINT messages_legacy_pkey PRIMARY KEY USING INDEX messages_legacy_pkey")
+
+    # sequence принадлежит колонке старой таблицы - отвязываем, иначе удалится вместе с партицией
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE messages RENAME TO messages_legacy")
+    op.execute(
+        "ALTER TABLE messages_legacy RENAME CONSTRAINT messages_streamer_id_fkey TO messages_legacy_streamer_id_fkey"
+    )
+    op.execute(
+        "ALTER TABLE messages_legacy RENAME CONSTRAINT messages_viewer_id_fkey TO messages_legacy_viewer_id_fkey"
+    )
+    op.execute("ALTER INDEX ix_messages_streamer_id_viewer_id_id RENAME TO ix_messages_legacy_streamer_id_viewer_id_id")
+
+    # в ключ партиционированной таблицы обязан входить created
+    op.execute("""
+        CREATE TABLE messages (
+            created timestamp with time zone NOT NULL,
+            updated timestamp with time zone NOT NULL,
+            streamer_id integer NOT NULL,
+            viewer_id integer NOT NULL,
+            from_streamer boolean NOT NULL,
+            text text NOT NULL,
+            id bigint NOT NULL DEFAULT nextval('messages_id_seq'),
+            CONSTRAINT messages_pkey PRIMARY KEY (id, created),
+            CONSTRAINT messages_streamer_id_fkey
+                FOREIGN KEY (streamer_id) REFERENCES streamers_profiles (id) ON DELETE RESTRICT,
+            CONSTRAINT messages_viewer_id_fkey
+                FOREIGN KEY (viewer_id) REFERENCES viewers_profiles (id) ON DELETE RESTRICT
+        ) PARTITION BY RANGE (created)
+    """)
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute("CREATE INDEX ix_messages_streamer_id_viewer_id_id ON messages (streamer_id, viewer_id, id)")
+
+    op.execute("""
+        DO $$
+        DECLARE
+            -- дальше партиции создает maintain_messages_partitions (messages_partitions_ahead)
+            partitions_ahead CONSTANT int := 3;
+            month_start timestamptz := date_trunc('month', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+            legacy_end timestamptz;
+            partition_start timestamptz;
+        BEGIN
+            -- граница старой партиции - по данным: на живой базе в ней есть сообщения текущего месяца,
+            -- и ATTACH с границей в начале месяца не прошел бы проверку. Запись заблокирована RENAME выше
+            SELECT greatest(
+                month_start,
+                date_trunc('month', max(created) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' + interval '1 month'
+            )
+            INTO legacy_end
+            FROM messages_legacy;
+            EXECUTE format(
+                'ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+                legacy_end
+            );
+            FOR i IN 0..partitions_ahead LOOP
+                partition_start := legacy_end + make_interval(months => i);
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                    'messages_' || to_char(partition_start AT TIME ZONE 'UTC', '"y"YYYY"m"MM'),
+                    partition_start,
+                    partition_start + interval '1 month'
+                );
+            END LOOP;
+        END $$
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("""
+        CREATE TABLE messages_plain (
+            created timestamp with time zone NOT NULL,
+            updated timestamp with time zone NOT NULL,
+            streamer_id integer NOT NULL,
+            viewer_id integer NOT NULL,
+            from_streamer boolean NOT NULL,
+            text text NOT NULL,
+            id bigint NOT NULL DEFAULT nextval('messages_id_seq')
+        )
+    """)
+    op.execute("""
+        INSERT INTO messages_plain
+        SELECT created, updated, streamer_id, viewer_id, from_streamer, text, id FROM messages
+    """)
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY NONE")
+    op.execute("DROP TABLE messages")
+    op.execute("ALTER TABLE messages_plain RENAME TO messages")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute("ALTER TABLE messages ADD CONSTRAINT messages_pkey PRIMARY KEY (id)")
+    op.execute("""
+        ALTER TABLE messages
+            ADD CONSTRAINT messages_streamer_id_fkey
+                FOREIGN KEY (streamer_id) REFERENCES streamers_profiles (id) ON DELETE RESTRICT,
+            ADD CONSTRAINT messages_viewer_id_fkey
+                FOREIGN KEY (viewer_id) REFERENCES viewers_profiles (id) ON DELETE RESTRICT
+    """)
+    op.execute("CREATE INDEX ix_messages_streamer_id_viewer_id_id ON messages (streamer_id, viewer_id, id)")
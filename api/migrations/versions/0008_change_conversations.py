@@ -0,0 +1,58 @@
+"""change_conversations
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: str | None = "0007"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "conversations",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("updated", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("streamer_id", sa.Integer(), nullable=False),
+        sa.Column("viewer_id", sa.Integer(), nullable=False),
+        sa.Column("last_message_id", sa.BigInteger(), nullable=False),
+        sa.Column("last_message_created", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("last_message_from_streamer", sa.Boolean(), nullable=False),
+        sa.Column("last_message_text", sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(["streamer_id"], ["streamers_profiles.id"], ondelete="RESTRICT"),
+        sa.ForeignKeyConstraint(["viewer_id"], ["viewers_profiles.id"], ondelete="RESTRICT"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("streamer_id", "viewer_id"),
+    )
+    op.create_index("ix_conversations_streamer_id_last_message_id", "conversations", ["streamer_id", "last_message_id"])
+    op.create_index("ix_conversations_viewer_id_last_message_id", "conversations", ["viewer_id", "last_message_id"])
+    # последнее сообщение каждой пары из уже накопленной истории, один проход по индексу пары
+    op.execute("""
+        INSERT INTO conversations (
+            created, updated, streamer_id, viewer_id,
+            last_message_id, last_message_created, last_message_from_streamer, last_message_text
+        )
+        SELECT DISTINCT ON (streamer_id, viewer_id)
+            created, now(), streamer_id, viewer_id, id, created, from_streamer, text
+        FROM messages
+        ORDER BY streamer_id, viewer_id, id DESC
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_conversations_viewer_id_last_message_id", table_name="conversations")
+    op.drop_index("ix_conversations_streamer_id_last_message_id", table_name="conversations")
+    op.drop_table("conversations")
@@ -0,0 +1,53 @@
+"""add_messages_text_search
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 13:30:00.000000
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0009"
+down_revision: str | None = "0008"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+TEXT_SEARCH = "to_tsvector('russian'::regconfig, text)"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # без хранимой колонки: ADD COLUMN ... STORED переписал бы все партиции под эксклюзивной блокировкой.
+    # Индекс родителя создается пустым (ON ONLY), индексы партиций - CONCURRENTLY, без блокировки записи.
+    # Когда подключены индексы всех партиций, индекс родителя становится валидным и создается в новых партициях
+    op.execute(f"CREATE INDEX IF NOT EXISTS ix_messages_text_search ON ONLY messages USING gin ({TEXT_SEARCH})")
+    partitions = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'messages'::regclass ORDER BY c.relname"
+            )
+        )
+        .scalars()
+        .all()
+    )
+    with op.get_context().autocommit_block():
+        for partition in partitions:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_{partition}_text_search" '
+                f'ON "{partition}" USING gin ({TEXT_SEARCH})'
+            )
+    for partition in partitions:
+        op.execute(f'ALTER INDEX ix_messages_text_search ATTACH PARTITION "ix_{partition}_text_search"')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # индексы партиций удаляются вместе с индексом родителя
+    op.execute("DROP INDEX ix_messages_text_search")
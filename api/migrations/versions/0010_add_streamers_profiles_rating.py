@@ -0,0 +1,40 @@
+"""add_streamers_profiles_rating
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0010"
+down_revision: str | None = "0009"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("streamers_profiles", sa.Column("rating_sum", sa.Integer(), server_default="0", nullable=False))
+    op.add_column("streamers_profiles", sa.Column("rating_count", sa.Integer(), server_default="0", nullable=False))
+    op.execute("""
+        UPDATE streamers_profiles sp
+        SET rating_sum = marks.rating_sum, rating_count = marks.rating_count
+        FROM (
+            SELECT streamer_id, sum(mark) AS rating_sum, count(*) AS rating_count
+            FROM streamers_marks
+            GROUP BY streamer_id
+        ) marks
+        WHERE marks.streamer_id = sp.id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("streamers_profiles", "rating_count")
+    op.drop_column("streamers_profiles", "rating_sum")
@@ -1,10 +1,24 @@
+from datetime import datetime
 from typing import TYPE_CHECKING
 
-from sqlalchemy import BigInteger, Boolean, ForeignKey, Text
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    ColumnElement,
+    ForeignKey,
+    Index,
+    Integer,
+    Text,
+    UniqueConstraint,
+    func,
+    literal_column,
+)
 from sqlalchemy.orm import Mapped, mapped_column
 
 from models.bases import BaseIdMixin, BaseSQLAlchemyModel, DateFieldsMixin
 
+MESSAGES_SEARCH_CONFIG = "russian"  # латиница в этой конфигурации стеммится как английский
+
 if TYPE_CHECKING:
     pass
 
@@ -12,8 +26,42 @@ if TYPE_CHECKING:
 class Message(BaseIdMixin[BigInteger], DateFieldsMixin, BaseSQLAlchemyModel):
     __tablename__ = "messages"
     __engine__ = "default"
+    # история переписки пары листается по id.
+    # Таблица партиционирована по месяцам created, в БД первичный ключ (id, created)
+    __table_args__ = (Index("ix_messages_streamer_id_viewer_id_id", "streamer_id", "viewer_id", "id"),)
 
     streamer_id: Mapped[int] = mapped_column(ForeignKey("streamers_profiles.id", ondelete="RESTRICT"))
     viewer_id: Mapped[int] = mapped_column(ForeignKey("viewers_profiles.id", ondelete="RESTRICT"))
     from_streamer: Mapped[bool] = mapped_column(Boolean)
     text: Mapped[str] = mapped_column(Text)
+
+
+def messages_text_search(text: ColumnElement[str]) -> ColumnElement:
+    """
+    tsvector для полнотекстового поиска в админке. Хранимой колонки нет - индекс по выражению,
+    запрос должен совпадать с ним буквально, поэтому конфигурация подставляется константой, а не параметром
+    """
+    return func.to_tsvector(literal_column(f"'{MESSAGES_SEARCH_CONFIG}'::regconfig"), text)
+
+
+Index("ix_messages_text_search", messages_text_search(Message.text), postgresql_using="gin")
+
+
+class Conversation(BaseIdMixin[Integer], DateFieldsMixin, BaseSQLAlchemyModel):
+    """Последнее сообщение пары стример-зритель. Обновляется воркером вместе с записью сообщений"""
+
+    __tablename__ = "conversations"
+    __engine__ = "default"
+    # список переписок листается по last_message_id с обеих сторон
+    __table_args__ = (
+        UniqueConstraint("streamer_id", "viewer_id"),
+        Index("ix_conversations_streamer_id_last_message_id", "streamer_id", "last_message_id"),
+        Index("ix_conversations_viewer_id_last_message_id", "viewer_id", "last_message_id"),
+    )
+
+    streamer_id: Mapped[int] = mapped_column(ForeignKey("streamers_profiles.id", ondelete="RESTRICT"))
+    viewer_id: Mapped[int] = mapped_column(ForeignKey("viewers_profiles.id", ondelete="RESTRICT"))
+    last_message_id: Mapped[int] = mapped_column(BigInteger)
+    last_message_created: Mapped[datetime]
+    last_message_from_streamer: Mapped[bool] = mapped_column(Boolean)
+    last_message_text: Mapped[str] = mapped_column(Text)
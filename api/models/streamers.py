@@ -25,9 +25,16 @@ class StreamerProfile(BaseIdMixin[Integer], BaseSQLAlchemyModel):
     force_rating: Mapped[float] = mapped_column(Numeric(3, 2), nullable=True)
     avatar: Mapped[StorageImage] = mapped_column(ImageType(storage=avatars_storage), nullable=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="RESTRICT"), unique=True)
+    # сумма и количество оценок, меняются вместе с оценками в rate_streamer
+    rating_sum: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    rating_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
 
     user: Mapped["User"] = relationship(back_populates="streamer_profile")
 
+    @property
+    def rating(self) -> float | None:
+        return self.force_rating or (self.rating_count and self.rating_sum / self.rating_count) or None
+
     @property
     def avatar_url(self) -> str | None:
         return self.avatar and str(Path("/media") / self.avatar.name) or None
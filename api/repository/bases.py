@@ -1,11 +1,27 @@
 import typing
 from abc import ABC, abstractmethod
 from collections import defaultdict
-from collections.abc import AsyncIterator, Iterable, Mapping, MutableMapping
+from collections.abc import AsyncIterator, Callable, Iterable, Mapping, MutableMapping
 from typing import Any, Literal, Protocol, Self, cast
 
 import sqlalchemy.exc
-from sqlalchemy import Column, ColumnElement, Result, Select, delete, desc, select, true, update
+from sqlalchemy import (
+    Column,
+    ColumnElement,
+    Executable,
+    Result,
+    Select,
+    UniqueConstraint,
+    bindparam,
+    delete,
+    desc,
+    select,
+    true,
+    tuple_,
+    update,
+    values as sql_values,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.engine.result import ScalarResult
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import joinedload, load_only
@@ -154,6 +170,28 @@ class BaseExternalSourceRequestRepository(ABC):
     ) -> ResponseProtocol: ...
 
 
+class prebuilt[StatementT: Executable]:  # noqa: N801
+    """
+    Запрос репозитория, который собирается один раз на класс репозитория, а не на каждый вызов.
+    Меняющиеся значения - bindparam, передаются при выполнении: await self.scalars(self.by_ids_query, ids=[1, 2]).
+    Для горячих запросов: SQLAlchemy не строит select заново и берет ключ кэша компиляции из памяти объекта
+    """
+
+    def __init__(self, build: Callable[[type["BaseSQLRepository"]], StatementT]) -> None:
+        self.build = build
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.attr_name = f"_prebuilt_{name}"
+
+    def __get__(self, instance: object, owner: type) -> StatementT:
+        # в __dict__ конкретного класса: у наследника своя модель и свой запрос
+        statement = owner.__dict__.get(self.attr_name)
+        if statement is None:
+            statement = self.build(owner)
+            setattr(owner, self.attr_name, statement)
+        return statement
+
+
 class BaseSQLRepository[T: BaseSQLAlchemyModel](BaseRepositoryAbstract):
     """
     Базовый класс для управления моделями
@@ -194,6 +232,10 @@ class BaseSQLRepository[T: BaseSQLAlchemyModel](BaseRepositoryAbstract):
         result = await self.exec(statement)
         return result.scalars()
 
+    async def scalars(self, statement: Executable, **params) -> ScalarResult:
+        """Выполнить запрос со значениями bindparam, например prebuilt"""
+        return await self.db.scalars(statement, params)
+
     def _select_query_builder(  # noqa: C901
         self,
         *args,
@@ -409,6 +451,172 @@ class BaseSQLRepository[T: BaseSQLAlchemyModel](BaseRepositoryAbstract):
             self.add(instance)
             return instance, True
 
+    def _conflict_columns(self, fields: Iterable[str]) -> list[str]:
+        """Уникальный ключ модели (UniqueConstraint, unique-колонка или первичный ключ), целиком входящий в fields"""
+        fields = set(fields)
+        table = self.model.__table__
+        keys = [key.columns.keys() for key in table.constraints if isinstance(key, UniqueConstraint)]
+        keys.sort(key=lambda key: (len(key), key))
+        keys.append(table.primary_key.columns.keys())
+        for key in keys:
+            if set(key) <= fields:
+                return key
+        raise ValueError(f"No unique constraint of {self.model.__name__} covered by fields {sorted(fields)}")
+
+    async def bulk_upsert(
+        self,
+        values: list[dict],
+        *,
+        conflict_columns: Iterable[str] | None = None,
+        update_fields: Iterable[str] | None = None,
+        where: ColumnElement | None = None,
+    ) -> list[T]:
+        """
+        INSERT ... ON CONFLICT DO UPDATE ... RETURNING одним запросом, без SELECT и блокировок.
+        Ключ конфликта по умолчанию - уникальный ключ модели из переданных полей,
+        обновляются все переданные поля кроме ключа (и поля с onupdate, например updated).
+        where - условие обновления существующей строки, строки без обновления не возвращаются.
+        На SQLite (тесты) тот же запрос через диалект sqlite
+        """
+        if not values:
+            return []
+
+        fields = values[0].keys()
+        conflict_columns = list(conflict_columns or self._conflict_columns(fields))
+        update_fields = set(update_fields or fields) - set(conflict_columns)
+        update_fields |= {column.key for column in self.model.__table__.columns if column.onupdate is not None}
+
+        dialect = self.db.get_bind(self.model).dialect.name
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        statement = insert(self.model)
+        set_ = {field: statement.excluded[field] for field in update_fields}
+        statement = statement.on_conflict_do_update(index_elements=conflict_columns, set_=set_, where=where)
+
+        result = await self.db.scalars(
+            statement.returning(self.model), values, execution_options={"populate_existing": True}
+        )
+        return list(result.all())
+
+    async def upsert(self, values: dict, **kwargs) -> T | None:
+        """Одна строка через bulk_upsert. None - строка не обновлена из-за where"""
+        objects = await self.bulk_upsert([values], **kwargs)
+        return objects[0] if objects else None
+
+    @staticmethod
+    def _python_default(default) -> tuple[bool, Any]:
+        """Значение default/onupdate колонки, если его можно посчитать без БД"""
+        if default is None or default.is_sequence or default.is_clause_element:
+            return False, None
+        return True, default.arg(None) if default.is_callable else default.arg
+
+    def _insert_rows(self, values: list[dict]) -> tuple[list[Column], list[tuple]] | None:
+        """
+        Колонки и строки для COPY: пропущенные поля с python default заполняются здесь (один раз на пачку),
+        серверные умолчания и sequence - в БД. None - нужен default, который считает только SQLAlchemy
+        """
+        table = self.model.__table__
+        fields = list(values[0])
+        defaults = {}
+        for column in table.columns:
+            if column.key in fields or column.default is None or column.default.is_sequence:
+                continue
+            has_value, value = self._python_default(column.default)
+            if not has_value:
+                return None
+            defaults[column] = value
+        default_values = tuple(defaults.values())
+        rows = [(*(row[field] for field in fields), *default_values) for row in values]
+        return [*(table.columns[field] for field in fields), *defaults], rows
+
+    async def bulk_insert(self, values: list[dict], *, copy: bool = True, batch_size: int = 10_000) -> int:
+        """
+        Вставка строк в обход ORM: без объектов, identity map и RETURNING. Все строки с одинаковым набором полей.
+        На Postgres - COPY через asyncpg, иначе (или copy=False) - executemany пачками по batch_size.
+        Ограничения, триггеры и партиционирование работают как у обычного INSERT
+        """
+        if not values:
+            return 0
+
+        dialect = self.db.get_bind(self.model).dialect
+        prepared = copy and dialect.driver == "asyncpg" and self._insert_rows(values)
+        if not prepared:
+            table = self.model.__table__
+            for i in range(0, len(values), batch_size):
+                await self.db.execute(table.insert(), values[i : i + batch_size])
+            return len(values)
+
+        columns, rows = prepared
+        # типы, которые SQLAlchemy приводит сама (enum, json), приводятся так же, как при обычном INSERT
+        processors = [column.type.dialect_impl(dialect).bind_processor(dialect) for column in columns]
+        if any(processors):
+            rows = [
+                tuple(process(value) if process else value for process, value in zip(processors, row, strict=True))
+                for row in rows
+            ]
+        connection = await self.db.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            self.model.__tablename__, records=rows, columns=[column.name for column in columns]
+        )
+        return len(rows)
+
+    async def bulk_update(self, values: list[dict], *, batch_size: int = 1000) -> int:
+        """
+        UPDATE по первичному ключу в обход ORM, загруженные в сессию объекты не меняются.
+        Все строки с одинаковым набором полей, включая первичный ключ. Колонки с onupdate (updated) обновляются.
+        На Postgres - один UPDATE ... FROM (VALUES ...) на пачку, иначе executemany
+        """
+        if not values:
+            return 0
+
+        table = self.model.__table__
+        primary_key = list(table.primary_key.columns)
+        fields = [key for key in values[0] if key not in table.primary_key.columns]
+        onupdate = {}
+        for column in table.columns:
+            if column.key not in fields and column.onupdate is not None:
+                has_value, value = self._python_default(column.onupdate)
+                if has_value:
+                    onupdate[column.key] = value
+
+        if self.db.get_bind(self.model).dialect.name != "postgresql":
+            statement = (
+                table.update()
+                .where(*(column == bindparam(f"pk_{column.key}") for column in primary_key))
+                .values({field: bindparam(field) for field in fields} | onupdate)
+            )
+            rows = [{f"pk_{column.key}": row[column.key] for column in primary_key} | row for row in values]
+            result = await self.db.execute(statement, rows)
+            return result.rowcount
+
+        updated = 0
+        columns = [*primary_key, *(table.columns[field] for field in fields)]
+        for i in range(0, len(values), batch_size):
+            rows = [tuple(row[column.key] for column in columns) for row in values[i : i + batch_size]]
+            data = sql_values(*(Column(column.name, column.type) for column in columns), name="data").data(rows)
+            statement = (
+                table.update()
+                .where(*(column == data.c[column.name] for column in primary_key))
+                .values({field: data.c[table.columns[field].name] for field in fields} | onupdate)
+            )
+            updated += (await self.db.execute(statement)).rowcount
+        return updated
+
+    async def bulk_delete(self, ids: Iterable, *, batch_size: int = 10_000) -> int:
+        """
+        DELETE по первичным ключам пачками в обход ORM: без загрузки объектов и каскадов ORM,
+        удаленные объекты в сессии не помечаются. Для составного ключа ids - кортежи
+        """
+        table = self.model.__table__
+        primary_key = list(table.primary_key.columns)
+        key = primary_key[0] if len(primary_key) == 1 else tuple_(*primary_key)
+        ids = list(ids)
+        deleted = 0
+        for i in range(0, len(ids), batch_size):
+            result = await self.db.execute(table.delete().where(key.in_(ids[i : i + batch_size])))
+            deleted += result.rowcount
+        return deleted
+
     async def _filter(
         self,
         *args,
@@ -1,6 +1,104 @@
-from models.messages import Message
+import re
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from models.messages import Conversation, Message
 from repository.bases import BaseSQLRepository
 
+PARTITION_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
 
 class MessageRepository(BaseSQLRepository[Message]):
-    pass
+    async def bulk_insert(self, values: list[dict], **kwargs) -> int:
+        """id обязателен: его выдает next_message_id, sequence таблицы с этой схемой расходится"""
+        if values and "id" not in values[0]:
+            raise ValueError("Message id must be set, use next_message_id")
+        return await super().bulk_insert(values, **kwargs)
+
+    async def insert_ignore_existing(self, values: list[dict]) -> None:
+        """Одним multi-row insert. Уже записанные id пропускаются - повторная доставка из стрима безопасна"""
+        if not values:
+            return
+        statement = insert(Message).values(values).on_conflict_do_nothing(index_elements=[Message.id, Message.created])
+        await self.exec(statement)
+
+    async def list_partitions(self) -> dict[str, datetime | None]:
+        """Партиции и их верхние границы (None - DEFAULT партиция)"""
+        result = await self.exec(
+            text("""
+                SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+                FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = CAST(:table AS regclass)
+            """).bindparams(table=Message.__tablename__)
+        )
+        partitions = {}
+        for name, bound in result.all():
+            upper = PARTITION_UPPER_BOUND.search(bound)
+            partitions[name] = upper and datetime.fromisoformat(upper[1])
+        return partitions
+
+    async def list_detached_partitions(self) -> list[str]:
+        """Отцепленные, но еще не удаленные партиции: не доархивированные прошлыми запусками"""
+        result = await self.exec(
+            text(r"""
+                SELECT c.relname
+                FROM pg_class c
+                WHERE c.relkind = 'r'
+                    AND c.relnamespace = current_schema()::regnamespace
+                    AND (c.relname LIKE 'messages\_y%' OR c.relname = 'messages_legacy')
+                    AND NOT c.relispartition
+                ORDER BY c.relname
+            """)
+        )
+        return list(result.scalars().all())
+
+    async def create_partition(self, name: str, start: datetime, end: datetime) -> None:
+        await self.exec(
+            text(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF {Message.__tablename__} '
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+        )
+
+    async def detach_partition(self, name: str) -> None:
+        await self.exec(text(f'ALTER TABLE {Message.__tablename__} DETACH PARTITION "{name}"'))
+
+    async def drop_partition(self, name: str) -> None:
+        """Только для уже отцепленных партиций"""
+        await self.exec(text(f'DROP TABLE "{name}"'))
+
+    async def copy_partition(self, name: str, output: Callable[[bytes], Awaitable[None]]) -> None:
+        """COPY в CSV через asyncpg, без загрузки строк в python"""
+        connection = await self.db.connection()
+        raw_connection = await connection.get_raw_connection()
+        columns = [column.name for column in Message.__table__.columns]
+        await raw_connection.driver_connection.copy_from_table(
+            name, columns=columns, output=output, format="csv", header=True
+        )
+
+
+class ConversationRepository(BaseSQLRepository[Conversation]):
+    async def upsert_last_messages(self, values: list[dict]) -> None:
+        """
+        Одним insert ... on conflict на пачку (не больше одной строки на пару).
+        Более старое сообщение не перетирает уже записанное - порядок и повторы пачек не важны
+        """
+        if not values:
+            return
+        statement = insert(Conversation).values(values)
+        excluded = statement.excluded
+        statement = statement.on_conflict_do_update(
+            index_elements=[Conversation.streamer_id, Conversation.viewer_id],
+            set_={
+                "updated": excluded.updated,
+                "last_message_id": excluded.last_message_id,
+                "last_message_created": excluded.last_message_created,
+                "last_message_from_streamer": excluded.last_message_from_streamer,
+                "last_message_text": excluded.last_message_text,
+            },
+            where=Conversation.last_message_id < excluded.last_message_id,
+        )
+        await self.exec(statement)
@@ -1,10 +1,43 @@
+from sqlalchemy import Select, bindparam, select, true
+from sqlalchemy.dialects.postgresql import insert
+
 from models.streamers import StreamerMark, StreamerProfile
-from repository.bases import BaseSQLRepository
+from repository.bases import BaseSQLRepository, prebuilt
 
 
 class StreamerProfileRepository(BaseSQLRepository[StreamerProfile]):
-    pass
+    by_ids_query: Select = prebuilt(
+        lambda cls: select(cls.model).where(cls.model.id.in_(bindparam("ids", expanding=True)))
+    )
+    exists_query: Select = prebuilt(lambda cls: select(true()).where(cls.model.id == bindparam("id")))
+
+    async def list_by_ids(self, ids: list[int]) -> list[StreamerProfile]:
+        result = await self.scalars(self.by_ids_query, ids=ids)
+        return list(result.all())
+
+    async def exists_by_id(self, streamer_id: int) -> bool:
+        result = await self.scalars(self.exists_query, id=streamer_id)
+        return bool(result.first())
 
 
 class StreamerMarkRepository(BaseSQLRepository[StreamerMark]):
-    pass
+    async def upsert_mark(self, viewer_id: int, streamer_id: int, mark: int) -> int | None:
+        """
+        Оценка одним INSERT ... ON CONFLICT. Возвращает прежнюю оценку (None - ее не было):
+        CTE читает снимок до вставки, отдельный SELECT не нужен
+        """
+        previous = (
+            select(StreamerMark.mark)
+            .where(StreamerMark.viewer_id == viewer_id, StreamerMark.streamer_id == streamer_id)
+            .cte("previous")
+        )
+        statement = insert(StreamerMark).values(viewer_id=viewer_id, streamer_id=streamer_id, mark=mark)
+        statement = (
+            statement.on_conflict_do_update(
+                index_elements=[StreamerMark.streamer_id, StreamerMark.viewer_id],
+                set_={"mark": statement.excluded.mark, "updated": statement.excluded.updated},
+            )
+            .add_cte(previous)
+            .returning(select(previous.c.mark).scalar_subquery())
+        )
+        return (await self.exec(statement)).scalar_one()
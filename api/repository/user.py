@@ -1,10 +1,36 @@
+from sqlalchemy import Select, bindparam, select
+from sqlalchemy.orm import contains_eager, joinedload
+
 from models.user import User, UserSession
-from repository.bases import BaseSQLRepository
+from repository.bases import BaseSQLRepository, prebuilt
 
 
 class UserRepository(BaseSQLRepository[User]):
-    pass
+    by_username_query: Select = prebuilt(
+        lambda cls: select(cls.model).where(cls.model.username == bindparam("username")).order_by(cls.model.id).limit(1)
+    )
+
+    async def get_by_username(self, username: str) -> User | None:
+        result = await self.scalars(self.by_username_query, username=username)
+        return result.first()
 
 
 class UserSessionRepository(BaseSQLRepository[UserSession]):
-    pass
+    # запрос каждого авторизованного запроса и подключения сокета
+    active_user_query: Select = prebuilt(
+        lambda cls: select(cls.model)
+        .join(User)
+        .where(
+            cls.model.token == bindparam("token"),
+            cls.model.is_active,
+            cls.model.expired >= bindparam("now"),
+            User.is_active,
+        )
+        .options(
+            contains_eager(cls.model.user),
+            joinedload(cls.model.user, User.streamer_profile),
+            joinedload(cls.model.user, User.viewer_profile),
+        )
+        .order_by(cls.model.id)
+        .limit(1)
+    )
@@ -1,6 +1,14 @@
+from sqlalchemy import Select, bindparam, select
+
 from models.viewers import ViewerProfile
-from repository.bases import BaseSQLRepository
+from repository.bases import BaseSQLRepository, prebuilt
 
 
 class ViewerProfileRepository(BaseSQLRepository[ViewerProfile]):
-    pass
+    by_ids_query: Select = prebuilt(
+        lambda cls: select(cls.model).where(cls.model.id.in_(bindparam("ids", expanding=True)))
+    )
+
+    async def list_by_ids(self, ids: list[int]) -> list[ViewerProfile]:
+        result = await self.scalars(self.by_ids_query, ids=ids)
+        return list(result.all())
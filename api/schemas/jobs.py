@@ -17,6 +17,7 @@ class JobContext(TypedDict):
     _exit_stack: AsyncExitStack
     redis: ArqRedis  # задается в arq
     _redis_pool: ConnectionPool
+    _redis: Redis
     _db_maker: Callable[[], AsyncSession]
 
     # инициализируется в job_startup
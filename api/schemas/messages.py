@@ -4,6 +4,7 @@ from pydantic import BaseModel, field_serializer
 
 
 class MessageSchema(BaseModel):
+    id: int
     created: datetime
     from_streamer: bool
     text: str
@@ -11,3 +12,9 @@ class MessageSchema(BaseModel):
     @field_serializer("created")
     def serialize_created(self, value: datetime, _info):
         return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class ConversationSchema(BaseModel):
+    streamer_id: int
+    viewer_id: int
+    last_message: MessageSchema
@@ -13,5 +13,15 @@ class ViewerSchema(BaseModel):
     name: str | None = None
 
 
+class StreamersBatchSchema(BaseModel):
+    items: list[StreamerSchema] = Field(description="Найденные стримеры в порядке запроса")
+    missing: list[int] = Field(description="id, которых нет")
+
+
+class ViewersBatchSchema(BaseModel):
+    items: list[ViewerSchema] = Field(description="Найденные зрители в порядке запроса")
+    missing: list[int] = Field(description="id, которых нет")
+
+
 class StreamerMarkSchema(BaseModel):
     mark: int = Field(ge=1, le=5)
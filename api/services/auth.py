@@ -1,7 +1,6 @@
 import datetime
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import contains_eager, joinedload
 
 from models import User, UserSession
 from repository.user import UserSessionRepository
@@ -23,16 +22,6 @@ class UserSessionService(BaseServiceAbstract):
         await self.sessions.update(UserSession.token == token, values=values)
 
     async def get_user(self, token: str) -> User | None:
-        session = await self.sessions.first(
-            UserSession.token == token,
-            UserSession.is_active,
-            (UserSession.expired >= utc_now()),
-            User.is_active,
-            join=(User,),
-            options=(
-                contains_eager(UserSession.user),
-                joinedload(UserSession.user, User.streamer_profile),
-                joinedload(UserSession.user, User.viewer_profile),
-            ),
-        )
+        result = await self.sessions.scalars(self.sessions.active_user_query, token=token, now=utc_now())
+        session = result.first()
         return session and session.user or None
@@ -8,8 +8,8 @@ from utils.libs import utc_now
 
 class JwtTokenService(BaseServiceAbstract):
     @classmethod
-    def create_token(cls, user_id: int, ttl: datetime.timedelta, secret_key: str) -> str:
-        to_encode = {"sub": str(user_id), "iat": utc_now(), "exp": utc_now() + ttl}
+    def create_token(cls, user_id: int, ttl: datetime.timedelta, secret_key: str, **claims) -> str:
+        to_encode = {"sub": str(user_id), "iat": utc_now(), "exp": utc_now() + ttl, **claims}
         token = jwt.encode(to_encode, secret_key, algorithm="HS256")
         return token
 
@@ -10,4 +10,4 @@ class UserService(BaseServiceAbstract):
         self.users = UserRepository(db)
 
     async def get_user_by_username(self, username: str) -> User | None:
-        return await self.users.first(User.username == username)
+        return await self.users.get_by_username(username)
@@ -4,9 +4,40 @@ from functools import wraps
 from typing import Any
 
 import socketio
+from engineio.packet import Packet
+from loguru import logger
+
+from dependencies.redis import get_redis_client
+from logic.auth import is_streamer_user
+from services.jwt import JwtTokenService
+from settings.conf import other_settings, sockets_limits, sockets_namespaces
+from utils.libs import get_socketio_cookie as get_cookie, get_socketio_query_param as get_query_param
+from utils.outbound import OutboundLimiter, packet_event
+from utils.rate_limit import AdmissionController, ConnectPriority, EventsRateLimiter
 
 from . import lobby, streamers
 
+admission_controller = AdmissionController(
+    sockets_limits.admission_rate,
+    sockets_limits.admission_burst,
+    {
+        ConnectPriority.viewer: sockets_limits.admission_viewers_reserve,
+        ConnectPriority.lobby: sockets_limits.admission_lobby_reserve,
+    },
+)
+events_limiter = EventsRateLimiter(sockets_limits.events_limits, sockets_limits.events_max_violations)
+
+
+def is_droppable_packet(pkt: Packet) -> bool:
+    """Терять можно только дельты лобби: клиент перезапросит список. Сигналинг и служебные пакеты - никогда"""
+    namespace, event = packet_event(pkt)
+    return namespace == sockets_namespaces.lobby and event in sockets_limits.outbound_droppable_lobby_events
+
+
+outbound_limiter = OutboundLimiter(
+    sockets_limits.outbound_max_bytes, sockets_limits.outbound_disconnect_bytes, is_droppable_packet
+)
+
 
 class registrator:
     def __init__(self, sio: socketio.AsyncServer) -> None:
@@ -14,17 +45,31 @@ class registrator:
         self.namespace = None
 
     def __call__(self, func: Callable[..., Any], event: str | None = None) -> None:
+        event = event or func.__name__
+        namespace = self.namespace
+
         def decorator(func: Callable[..., Any]):
             @wraps(func)
             async def wrapper(*args, **kwargs):
+                # лимит проверяется до with_db/with_redis, отброшенное событие не занимает ни сессию, ни соединение
+                sid = args[0]
+                if events_limiter.is_limited(event) and not events_limiter.hit(sid, event):
+                    if events_limiter.is_offender(sid):
+                        logger.warning("Disconnecting sid {} for flooding {} in {}", sid, event, namespace)
+                        await self.sio.disconnect(sid, namespace)
+                    return None
+
                 if "sio" in inspect.signature(func).parameters:
                     kwargs["sio"] = self.sio
-                return await func(*args, **kwargs)
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    if event == "disconnect":
+                        events_limiter.forget(sid)
 
             return wrapper
 
-        event = event or func.__name__
-        self.sio.on(event, decorator(func), self.namespace)
+        self.sio.on(event, decorator(func), namespace)
 
 
 def register_handlers(sio: socketio.AsyncServer) -> None:
@@ -34,6 +79,7 @@ def register_handlers(sio: socketio.AsyncServer) -> None:
     register(streamers.connect)
     register(streamers.disconnect)
     register(streamers.message)
+    register(streamers.messages_read, "messages:read")
     register(streamers.ping)
     register(streamers.webrtc_offer, "webrtc:offer")
     register(streamers.webrtc_answer, "webrtc:answer")
@@ -42,3 +88,38 @@ def register_handlers(sio: socketio.AsyncServer) -> None:
     register.namespace = lobby.namespace
     register(lobby.connect)
     register(lobby.disconnect)
+    register(lobby.matchmaking_join, "matchmaking:join")
+    register(lobby.matchmaking_leave, "matchmaking:leave")
+
+
+async def get_connect_priority(environ) -> ConnectPriority:
+    """
+    Namespace на уровне engine.io еще неизвестен, поэтому смотрим на query и claims токена, без сессии в БД.
+    ?streamer_id= может передать любой авторизованный клиент, в том числе лобби, и занять приоритет зрителя.
+    Это допустимо: приоритет дает только резерв общего ведра подключений, права проверяет connect namespace.
+    Без валидного токена подключение всегда идет как лобби
+    """
+    token = get_cookie(environ, other_settings.access_token_cookie_name)
+    payload = token and JwtTokenService.decode_token(token, other_settings.jwt_secret, suppress=True)
+    if not payload:
+        return ConnectPriority.lobby
+
+    streamer_id = get_query_param(environ, "streamer_id")
+    if streamer_id and streamer_id.isdigit():
+        return ConnectPriority.viewer
+
+    is_streamer = payload.get("is_streamer")
+    if is_streamer is None:
+        # токены, выданные до claim is_streamer, живут до users_session_ttl: флаг из кэша, в БД только промах
+        is_streamer = await is_streamer_user(None, get_redis_client(), int(payload["sub"]))
+    return ConnectPriority.streamer if is_streamer else ConnectPriority.lobby
+
+
+def register_admission(sio: socketio.AsyncServer) -> None:
+    if sockets_limits.admission_enabled:
+        sio.eio.on("connect", admission_controller.wrap(sio.eio.handlers["connect"], get_connect_priority))
+
+
+def register_outbound_limits(sio: socketio.AsyncServer) -> None:
+    if sockets_limits.outbound_enabled:
+        outbound_limiter.install(sio.eio)
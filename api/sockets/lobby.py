@@ -1,10 +1,13 @@
 import socketio
 from loguru import logger
+from redis.asyncio import Redis
 from socketio.exceptions import ConnectionRefusedError as SocketIOConnectionRefusedError
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
 from dependencies.db import with_db
+from dependencies.redis import with_redis
 from logic.auth import get_user_by_token
+from logic.matchmaking import dequeue_viewer, enqueue_viewer
 from settings.conf import sockets_namespaces
 
 namespace = sockets_namespaces.lobby
@@ -25,7 +28,34 @@ async def connect(sid, environ, auth, db: AsyncSession, sio: socketio.AsyncServe
     return True
 
 
-async def disconnect(sid, sio: socketio.AsyncServer):
+@with_redis()
+async def disconnect(sid, redis: Redis, sio: socketio.AsyncServer):
     session = await sio.get_session(sid, namespace)
     user = session["user"]
+    if session.get("queued"):
+        await dequeue_viewer(redis, user.viewer_profile.id)
     logger.debug("Disconnected from lobby; id: {}, sid: {}", user.id, sid)
+
+
+@with_redis()
+async def matchmaking_join(sid, data, redis: Redis, sio: socketio.AsyncServer):
+    session = await sio.get_session(sid, namespace)
+    user = session["user"]
+    # стример из очереди мог бы попасть сам к себе
+    if user.is_streamer:
+        await sio.emit("matchmaking:error", {"message": "FORBIDDEN"}, to=sid, namespace=namespace)
+        return
+
+    session["queued"] = True
+    await sio.save_session(sid, session, namespace)
+    await enqueue_viewer(sio, redis, user.viewer_profile.id, sid)
+    logger.debug("Viewer (id: {}) joined matchmaking queue", user.viewer_profile.id)
+
+
+@with_redis()
+async def matchmaking_leave(sid, data, redis: Redis, sio: socketio.AsyncServer):
+    session = await sio.get_session(sid, namespace)
+    user = session["user"]
+    session["queued"] = False
+    await sio.save_session(sid, session, namespace)
+    await dequeue_viewer(redis, user.viewer_profile.id)
@@ -5,10 +5,11 @@ from socketio.exceptions import ConnectionRefusedError as SocketIOConnectionRefu
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
 from dependencies.db import with_db
-from dependencies.redis import with_redis
+from dependencies.redis import presence_cache, with_redis
 from exceptions.streamers import NoSeatsError
-from logic.auth import get_user_by_token
-from logic.messages import create_message
+from logic.auth import create_resume_token, get_user_by_token, pop_resume_token, refresh_resume_token
+from logic.matchmaking import match_viewers
+from logic.messages import create_message, mark_messages_read
 from logic.streamers import (
     answer_from_streamer,
     connect_streamer,
@@ -16,8 +17,16 @@ from logic.streamers import (
     is_streamer_exists,
     offer_from_streamer,
     ping_streamer,
+    resume_streamer,
+)
+from logic.viewers import (
+    answer_from_viewer,
+    connect_viewer,
+    ice_from_viewer,
+    offer_from_viewer,
+    ping_viewer,
+    resume_viewer,
 )
-from logic.viewers import answer_from_viewer, connect_viewer, ice_from_viewer, offer_from_viewer, ping_viewer
 from settings.conf import other_settings, sockets_namespaces
 from utils.libs import get_socketio_cookie as get_cookie, get_socketio_query_param as get_query_param
 
@@ -27,6 +36,10 @@ namespace = sockets_namespaces.streamers
 @with_db()
 @with_redis()
 async def connect(sid, environ, auth, db: AsyncSession, redis: Redis, sio: socketio.AsyncServer):
+    resume_token = auth and auth.get("resume_token")
+    if resume_token and await resume(sid, resume_token, redis, sio):
+        return True
+
     token = get_cookie(environ, other_settings.access_token_cookie_name)
     user = token and await get_user_by_token(db, token)
     if not user:
@@ -50,7 +63,8 @@ async def connect(sid, environ, auth, db: AsyncSession, redis: Redis, sio: socke
 
     if is_streamer:
         logger.debug("Connecting streamer (id: {})", user.streamer_profile.id)
-        await connect_streamer(sio, redis, user.streamer_profile.id, sid)
+        await connect_streamer(sio, redis, user.streamer_profile.id, sid, float(user.streamer_profile.rating or 0))
+        await match_viewers(sio, redis)
     else:
         try:
             logger.debug("Connecting viewer (id: {})", user.viewer_profile.id)
@@ -63,23 +77,54 @@ async def connect(sid, environ, auth, db: AsyncSession, redis: Redis, sio: socke
             )
             raise SocketIOConnectionRefusedError("ROOM_FULL")
 
-    session = {"user": user, "streamer_id": streamer_id, "is_streamer": is_streamer}
-    await sio.save_session(sid, session, namespace)
+    session = {
+        "user_id": user.id,
+        "streamer_id": streamer_id,
+        "viewer_id": None if is_streamer else user.viewer_profile.id,
+        "is_streamer": is_streamer,
+    }
+    await start_session(sid, session, redis, sio)
     logger.debug("✅ Connected sid: {}", sid)
     return True
 
 
+async def resume(sid, resume_token: str, redis: Redis, sio: socketio.AsyncServer) -> bool:
+    """Переподключение по токену: без БД, без переподключения пары и без событий в лобби"""
+    session = await pop_resume_token(redis, resume_token)
+    if not session:
+        logger.debug("Resume token expired, fallback to full connect")
+        return False
+
+    if session["is_streamer"]:
+        resumed = await resume_streamer(sio, redis, session["streamer_id"], sid)
+    else:
+        resumed = await resume_viewer(sio, redis, session["viewer_id"], sid, session["streamer_id"])
+    if not resumed:
+        logger.debug("Presence of user (id: {}) already lost, fallback to full connect", session["user_id"])
+        return False
+
+    await start_session(sid, session, redis, sio)
+    logger.debug("✅ Resumed sid: {} (user id: {})", sid, session["user_id"])
+    return True
+
+
+async def start_session(sid, session: dict, redis: Redis, sio: socketio.AsyncServer) -> None:
+    session["resume_token"] = await create_resume_token(redis, session)
+    await sio.save_session(sid, session, namespace)
+    await sio.emit("connect:ok", {"resume_token": session["resume_token"]}, to=sid, namespace=namespace)
+
+
 async def disconnect(sid, sio: socketio.AsyncServer):
     session = await sio.get_session(sid, namespace)
-    user = session.get("user")
     streamer_id = session.get("streamer_id")
+    viewer_id = session.get("viewer_id")
     is_streamer = session.get("is_streamer")
 
-    if user:
+    if session.get("user_id"):
         if is_streamer:
-            logger.debug("Disconnecting streamer (id: {})", user.streamer_profile.id)
+            logger.debug("Disconnecting streamer (id: {})", streamer_id)
         else:
-            logger.debug("Disconnecting viewer (id: {}) from streamer (id: {})", user.viewer_profile.id, streamer_id)
+            logger.debug("Disconnecting viewer (id: {}) from streamer (id: {})", viewer_id, streamer_id)
 
     logger.debug("Disconnected sid: {}", sid)
 
@@ -87,67 +132,84 @@ async def disconnect(sid, sio: socketio.AsyncServer):
 @with_redis()
 async def ping(sid, data, redis: Redis, sio: socketio.AsyncServer):
     session = await sio.get_session(sid, namespace)
-    user = session["user"]
     streamer_id = session["streamer_id"]
+    viewer_id = session["viewer_id"]
     is_streamer = session["is_streamer"]
 
     if is_streamer:
-        logger.debug("Ping streamer (id: {})", user.id)
-        await ping_streamer(redis, user.streamer_profile.id)
+        logger.debug("Ping streamer (id: {})", streamer_id)
+        await ping_streamer(redis, streamer_id)
     else:
-        logger.debug("Ping viewer (id: {}) to streamer (id: {})", user.id, streamer_id)
-        await ping_viewer(redis, user.viewer_profile.id)
+        logger.debug("Ping viewer (id: {}) to streamer (id: {})", viewer_id, streamer_id)
+        await ping_viewer(redis, viewer_id)
+    await refresh_resume_token(redis, session["resume_token"])
 
 
 @with_redis()
 async def webrtc_offer(sid, data, sio: socketio.AsyncServer, redis: Redis):
     session = await sio.get_session(sid, namespace)
-    user = session["user"]
+    streamer_id = session["streamer_id"]
+    viewer_id = session["viewer_id"]
     is_streamer = session["is_streamer"]
 
     if is_streamer:
-        await offer_from_streamer(sio, redis, user.streamer_profile.id, data)
-        logger.debug("offer from streamer (id: {})", user.streamer_profile.id)
+        await offer_from_streamer(sio, redis, streamer_id, data)
+        logger.debug("offer from streamer (id: {})", streamer_id)
     else:
-        await offer_from_viewer(sio, redis, user.viewer_profile.id, data)
-        logger.debug("offer from viewer (id: {})", user.viewer_profile.id)
+        await offer_from_viewer(sio, redis, viewer_id, data)
+        logger.debug("offer from viewer (id: {})", viewer_id)
 
 
 @with_redis()
 async def webrtc_answer(sid, data, sio: socketio.AsyncServer, redis: Redis):
     session = await sio.get_session(sid, namespace)
-    user = session["user"]
+    streamer_id = session["streamer_id"]
+    viewer_id = session["viewer_id"]
     is_streamer = session["is_streamer"]
 
     if is_streamer:
-        await answer_from_streamer(sio, redis, user.streamer_profile.id, data)
-        logger.debug("answer from streamer (id: {})", user.streamer_profile.id)
+        await answer_from_streamer(sio, redis, streamer_id, data)
+        logger.debug("answer from streamer (id: {})", streamer_id)
     else:
-        await answer_from_viewer(sio, redis, user.viewer_profile.id, data)
-        logger.debug("answer from viewer (id: {})", user.viewer_profile.id)
+        await answer_from_viewer(sio, redis, viewer_id, data)
+        logger.debug("answer from viewer (id: {})", viewer_id)
 
 
 @with_redis()
 async def webrtc_ice(sid, data, sio: socketio.AsyncServer, redis: Redis):
     session = await sio.get_session(sid, namespace)
-    user = session["user"]
+    streamer_id = session["streamer_id"]
+    viewer_id = session["viewer_id"]
     is_streamer = session["is_streamer"]
 
     if is_streamer:
-        await ice_from_streamer(sio, redis, user.streamer_profile.id, data)
-        logger.debug("ice from streamer (id: {})", user.streamer_profile.id)
+        await ice_from_streamer(sio, redis, streamer_id, data)
+        logger.debug("ice from streamer (id: {})", streamer_id)
     else:
-        await ice_from_viewer(sio, redis, user.viewer_profile.id, data)
-        logger.debug("ice from viewer (id: {})", user.viewer_profile.id)
+        await ice_from_viewer(sio, redis, viewer_id, data)
+        logger.debug("ice from viewer (id: {})", viewer_id)
+
+
+@with_redis()
+async def message(sid, data, sio: socketio.AsyncServer, redis: Redis):
+    session = await sio.get_session(sid, namespace)
+    streamer_id = session["streamer_id"]
+    is_streamer = session["is_streamer"]
+    await create_message(sio, redis, streamer_id, is_streamer, data["text"])
 
 
-@with_db()
 @with_redis()
-async def message(sid, data, sio: socketio.AsyncServer, db: AsyncSession, redis: Redis):
+async def messages_read(sid, data, sio: socketio.AsyncServer, redis: Redis):
     session = await sio.get_session(sid, namespace)
     streamer_id = session["streamer_id"]
     is_streamer = session["is_streamer"]
-    await create_message(sio, db, redis, streamer_id, is_streamer, data["text"])
+
+    if is_streamer:
+        viewer_id = await presence_cache.hget(redis, "streamers:viewers", streamer_id)
+        if viewer_id:
+            await mark_messages_read(redis, streamer_id, True, int(viewer_id))
+    else:
+        await mark_messages_read(redis, session["viewer_id"], False, streamer_id)
 
 
 # NOTE: register new handlers in api/sockets/__init__.py
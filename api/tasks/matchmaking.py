@@ -0,0 +1,8 @@
+from logic.matchmaking import release_expired_reservations
+from schemas.jobs import JobContext
+
+
+async def release_expired_reservations_task(ctx: JobContext) -> None:
+    sio = ctx["sio"]
+    redis = ctx["redis_session"]
+    await release_expired_reservations(sio, redis)
@@ -0,0 +1,28 @@
+import os
+import socket
+from pathlib import Path
+
+from logic.messages import archive_messages_partition, flush_messages, maintain_messages_partitions
+from schemas.jobs import JobContext
+from settings.conf import other_settings, settings
+
+
+async def flush_messages_task(ctx: JobContext) -> None:
+    db = ctx["db_session"]
+    redis = ctx["redis_session"]
+    await flush_messages(db, redis, f"{socket.gethostname()}:{os.getpid()}")
+
+
+async def maintain_messages_partitions_task(ctx: JobContext) -> None:
+    db = ctx["db_session"]
+    expired = await maintain_messages_partitions(
+        db, other_settings.messages_partitions_ahead, other_settings.messages_retention_months
+    )
+    await db.commit()
+
+    archive_dir = Path(settings.local_storage_path) / "archive" / "messages"
+    for name in expired:
+        await archive_messages_partition(
+            db, name, archive_dir, ctx.get("s3_client"), other_settings.messages_archive_bucket
+        )
+        await db.commit()
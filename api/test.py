@@ -84,13 +84,12 @@ async def main():
 
 
 async def main2():
-    from dependencies.db import _get_db
     from dependencies.redis import _get_redis
     from logic.streamers import get_free_online_streamers, get_free_online_streamers_ids
 
-    async with _get_redis() as redis, _get_db() as db:
+    async with _get_redis() as redis:
         r = await get_free_online_streamers_ids(redis)
-        r2 = await get_free_online_streamers(db, redis)
+        r2 = await get_free_online_streamers(redis)
         print(r)
         print(r2)
 
@@ -0,0 +1,60 @@
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from starlette.requests import Request
+
+from admin.messages import MessageAdmin
+from models.messages import Message
+from repository.messages import MessageRepository
+from utils.libs import utc_now
+
+
+def make_request(**query_params: str) -> Request:
+    query_string = "&".join(f"{key}={value}" for key, value in query_params.items())
+    return Request({"type": "http", "query_string": query_string.encode(), "headers": []})
+
+
+async def test_message_admin(db, engine: AsyncEngine):
+    texts = ["greeting", "how are you", "greetings to all", "bye", "see you"]
+    await MessageRepository(db).insert_ignore_existing(
+        [
+            {
+                "id": i,
+                "created": utc_now(),
+                "streamer_id": i % 2 + 1,
+                "viewer_id": 1,
+                "from_streamer": True,
+                "text": text,
+            }
+            for i, text in enumerate(texts, 1)
+        ]
+    )
+    await db.commit()
+
+    view = MessageAdmin()
+    view.session_maker = async_sessionmaker(engine)
+    view.is_async = True
+    assert not (view.can_create or view.can_edit or view.can_delete)
+
+    async def page(**query_params: str) -> tuple[list[int], int | None, int | None]:
+        pagination = await view.list(make_request(pageSize="2", **query_params))
+        return [row.id for row in pagination.rows], pagination.previous_cursor, pagination.next_cursor
+
+    # от новых к старым, курсоры соседних страниц
+    assert await page() == ([5, 4], None, 4)
+    assert await page(before_id="4") == ([3, 2], 3, 2)
+    assert await page(before_id="2") == ([1], 1, None)
+    assert await page(after_id="2") == ([4, 3], 4, 3)
+    assert await page(after_id="4") == ([5], None, 5)
+
+    # полнотекстовый поиск со стеммингом и фильтр по id из url
+    assert await page(search="greet") == ([3, 1], None, None)
+    assert await page(search="greet", streamer_id="2") == ([3, 1], None, None)
+    assert await page(streamer_id="1") == ([4, 2], None, None)
+    assert await page(streamer_id="abc") == ([5, 4], None, 4)
+
+    # выражение поиска совпадает с индексом по выражению
+    await db.execute(text("SET LOCAL enable_seqscan = off"))
+    statement = view.search_query(select(Message), "greet").compile(dialect=postgresql.dialect(paramstyle="named"))
+    plan = "\n".join((await db.execute(text(f"EXPLAIN {statement}"), statement.params)).scalars())
+    assert "_text_search" in plan
@@ -11,14 +11,14 @@ from anyio import to_thread
 from arq import ArqRedis
 from httpx import ASGITransport, AsyncClient
 from redis.asyncio import Redis
-from sqlalchemy import text
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from starlette.templating import Jinja2Templates
 
 from admin.bases import AdminBackend
 from app import FastAPI, init_admin, init_app, init_sockets_app
 from app_logging import set_logging_config
-from dependencies.db import get_db
+from dependencies.db import EngineTypeEnum, engines, get_binds, get_db
 from dependencies.httpx import get_httpx_client
 from dependencies.redis import get_redis
 from dependencies.tasks import get_task_manager
@@ -27,6 +27,7 @@ from models.bases import BaseSQLAlchemyModel
 from settings.conf import databases, other_settings, settings
 from tests.fake_repositories import FakeHttpxClient
 from tests.fixtures.bases import load_fixtures
+from utils.cache import caches
 
 
 async def _create_database() -> str:
@@ -95,11 +96,30 @@ async def db_dsn() -> str:
 @pytest_asyncio.fixture
 async def engine(db_dsn: str) -> AsyncEngine:
     engine = create_async_engine(db_dsn, echo=settings.echo_sql)
+    # собственные сессии логики, сокетов и админки (_get_db) - тоже в базу теста
+    default_engine = engines[EngineTypeEnum.DEFAULT_ENGINE]
+    engines[EngineTypeEnum.DEFAULT_ENGINE] = engine
+    get_binds.cache_clear()
     yield engine
+    engines[EngineTypeEnum.DEFAULT_ENGINE] = default_engine
+    get_binds.cache_clear()
     await _truncate(engine)
     await engine.dispose()
 
 
+@pytest_asyncio.fixture
+async def queries(engine: AsyncEngine) -> list[str]:
+    """SQL, выполненный через engine во время теста. Для тестов на количество запросов"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
 @pytest_asyncio.fixture
 async def db(engine: AsyncEngine) -> AsyncSession:
     async_session = async_sessionmaker(
@@ -124,6 +144,8 @@ async def db(engine: AsyncEngine) -> AsyncSession:
 async def redis() -> Redis:
     server = fakeredis.FakeServer()
     r = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    # локальные кэши процесса переживают тест, а Redis под ними каждый раз новый
+    caches.clear()
     yield r
 
 
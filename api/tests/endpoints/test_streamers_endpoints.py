@@ -0,0 +1,77 @@
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy import update
+
+from logic.streamers import connect_streamer
+from models.streamers import StreamerProfile
+from settings import conf
+from tests.custom_faker import fake_sid
+
+
+async def login(client: AsyncClient) -> None:
+    response = await client.post("/tokens/login", json={"username": "user", "password": "test"})
+    client.cookies[conf.other_settings.access_token_cookie_name] = response.json()["access_token"]
+
+
+async def test_conditional_get(client: AsyncClient, db, sio, redis):
+    await login(client)
+
+    for url in ("/streamers/1", "/viewers/1", "/tokens/me", "/streamers/"):
+        response = await client.get(url)
+        assert response.status_code == status.HTTP_200_OK, response.text
+        etag = response.headers["etag"]
+        assert response.headers["cache-control"].startswith("private")
+
+        response = await client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED, url
+        assert not response.content
+        assert response.headers["etag"] == etag
+
+    response = await client.get("/tokens/me")
+    last_modified = response.headers["last-modified"]
+    response = await client.get("/tokens/me", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    # оценка сбрасывает карточку стримера, новый стример в лобби меняет версию списка
+    await db.execute(update(StreamerProfile).where(StreamerProfile.id == 2).values(force_rating=None))
+    await db.commit()
+    response = await client.get("/streamers/2")
+    etag = response.headers["etag"]
+    # у профилей нет updated - карточке нечем проставить Last-Modified
+    assert "last-modified" not in response.headers
+    response = await client.post("/streamers/2/rate", json={"mark": 5})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    response = await client.get("/streamers/2", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["rating"] == 5
+    response = await client.get("/streamers/2", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    assert response.status_code == status.HTTP_200_OK
+
+    etag = (await client.get("/streamers/")).headers["etag"]
+    await connect_streamer(sio, redis, 1, fake_sid(), 4.546)
+    response = await client.get("/streamers/", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert [streamer["id"] for streamer in response.json()] == [1]
+
+
+async def test_profiles_batch(client: AsyncClient):
+    await login(client)
+
+    response = await client.get("/streamers/batch", params={"ids": [2, 99, 1, 2]})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert response.json() == {
+        "items": [
+            {"id": 2, "name": "Streamer 2", "avatar_url": None, "rating": 3.3},
+            {"id": 1, "name": "Streamer 1", "avatar_url": None, "rating": 4.55},
+        ],
+        "missing": [99],
+    }
+
+    response = await client.get("/viewers/batch", params={"ids": [3, 100, 1]})
+    assert response.status_code == status.HTTP_200_OK, response.text
+    assert [viewer["id"] for viewer in response.json()["items"]] == [3, 1]
+    assert response.json()["missing"] == [100]
+
+    ids = list(range(conf.other_settings.profiles_batch_max_size + 1))
+    response = await client.get("/viewers/batch", params={"ids": ids})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY, response.text
@@ -6,3 +6,5 @@ class StreamerProfileFactory(BaseSQLAlchemyFactory[StreamerProfile]):
     avatar = None
     force_rating = None
     force_rating_votes = None
+    rating_sum = 0
+    rating_count = 0
@@ -0,0 +1,29 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from logic.auth import is_streamer_user
+from services.jwt import JwtTokenService
+from settings import conf
+from sockets import get_connect_priority
+from utils.rate_limit import ConnectPriority
+
+
+def environ(query: str = "", **claims) -> dict:
+    token = JwtTokenService.create_token(5, timedelta(hours=1), conf.other_settings.jwt_secret, **claims)
+    return {"QUERY_STRING": query, "HTTP_COOKIE": f"{conf.other_settings.access_token_cookie_name}={token}"}
+
+
+async def test_connect_priority(db, redis, queries):
+    with patch("sockets.get_redis_client", return_value=redis):
+        assert await get_connect_priority({"QUERY_STRING": "streamer_id=1"}) == ConnectPriority.lobby
+        assert await get_connect_priority(environ("streamer_id=1", is_streamer=True)) == ConnectPriority.viewer
+        assert await get_connect_priority(environ("streamer_id=abc", is_streamer=False)) == ConnectPriority.lobby
+
+        # токен без claim: флаг грузится из БД один раз, дальше из кэша
+        queries.clear()
+        assert await get_connect_priority(environ()) == ConnectPriority.streamer
+        assert await get_connect_priority(environ()) == ConnectPriority.streamer
+        assert len(queries) == 1
+        assert await redis.exists("users:is_streamer:5")
+
+    assert not await is_streamer_user(None, redis, 7)
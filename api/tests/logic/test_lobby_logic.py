@@ -1,11 +1,24 @@
+import asyncio
 from datetime import datetime, timedelta
 
+import orjson
 from freezegun import freeze_time
 
-from logic.streamers import connect_streamer, get_free_online_streamers, get_free_online_streamers_ids, ping_streamer
-from logic.viewers import clean_offline_viewers, connect_viewer
+from logic.streamers import (
+    connect_streamer,
+    get_free_online_streamers,
+    get_free_online_streamers_ids,
+    get_free_online_streamers_payload,
+    ping_streamer,
+    rate_streamer,
+    rebuild_free_streamers,
+    update_online_streamer_rating,
+)
+from logic.viewers import clean_offline_viewers, connect_viewer, disconnect_viewer
 from schemas.streamers import StreamerSchema
 from tests.custom_faker import fake_sid
+from tests.factories.auth import UserFactory
+from tests.factories.streamers import StreamerProfileFactory
 
 
 async def test_get_free_online_streamers_ids(redis, sio):
@@ -34,12 +47,108 @@ async def test_get_free_online_streamers_ids(redis, sio):
 
 
 async def test_get_free_online_streamers(sio, db, redis):
-    await connect_streamer(sio, redis, 1, fake_sid())
-    await connect_streamer(sio, redis, 2, fake_sid())
+    await connect_streamer(sio, redis, 1, fake_sid(), 4.546)
+    await connect_streamer(sio, redis, 2, fake_sid(), 3.3)
 
     expected_streamers = [
         StreamerSchema(id=1, name="Streamer 1", rating=4.55),
         StreamerSchema(id=2, name="Streamer 2", rating=3.3),
     ]
-    streamers = await get_free_online_streamers(db, redis)
+    streamers = await get_free_online_streamers(redis)
     assert streamers == expected_streamers
+
+
+async def test_get_free_online_streamers_queries_count(sio, db, redis, queries):
+    # стримеры без force_rating, рейтинг из оценок
+    for i in range(10, 20):
+        db.add(UserFactory.build(id=i, is_streamer=True))
+        db.add(StreamerProfileFactory.build(id=i, user_id=i, name=f"Streamer {i}"))
+    await db.flush()
+    for i in range(10, 20):
+        await rate_streamer(db, 7, 4, i)
+        await rate_streamer(db, 8, 5, i)
+    await db.commit()
+
+    await connect_streamer(sio, redis, 1, fake_sid(), 4.546)
+    await connect_streamer(sio, redis, 10, fake_sid(), 4.5)
+    queries.clear()
+    streamers = await get_free_online_streamers(redis)
+    assert [streamer.rating for streamer in streamers] == [4.55, 4.5]
+    few_streamers_queries = len(queries)
+
+    for i in range(11, 20):
+        await connect_streamer(sio, redis, i, fake_sid())
+    queries.clear()
+    streamers = await get_free_online_streamers(redis)
+    assert len(streamers) == 11
+    assert len(queries) == few_streamers_queries == 1
+
+
+async def test_get_free_online_streamers_pages(sio, db, redis):
+    for streamer_id, rating in ((1, 4.546), (2, 3.3)):
+        await connect_streamer(sio, redis, streamer_id, fake_sid(), rating)
+
+    streamers = await get_free_online_streamers(redis, limit=1)
+    assert [streamer.id for streamer in streamers] == [1]
+    streamers = await get_free_online_streamers(redis, limit=1, cursor=1)
+    assert [streamer.id for streamer in streamers] == [2]
+    assert await get_free_online_streamers(redis, limit=1, cursor=2) == []
+    streamers = await get_free_online_streamers(redis, sort="rating")
+    assert [streamer.id for streamer in streamers] == [2, 1]
+
+    # занятый стример пропадает из выдачи и возвращается на свое место, когда зритель уходит
+    await connect_viewer(sio, redis, 7, fake_sid(), 1)
+    assert await get_free_online_streamers_ids(redis) == [2]
+    await disconnect_viewer(sio, redis, 7, "test")
+    assert await get_free_online_streamers_ids(redis) == [1, 2]
+
+
+async def test_get_free_online_streamers_payload(sio, db, redis, queries):
+    await connect_streamer(sio, redis, 1, fake_sid())
+    payload = await get_free_online_streamers_payload(redis)
+    assert [streamer["id"] for streamer in orjson.loads(payload)] == [1]
+
+    # пока присутствие не менялось - ни одного запроса в БД
+    queries.clear()
+    assert await get_free_online_streamers_payload(redis) == payload
+    assert not queries
+
+    # переход присутствия меняет версию, конкурентные запросы собирают ответ один раз
+    await connect_streamer(sio, redis, 2, fake_sid())
+    payloads = await asyncio.gather(*(get_free_online_streamers_payload(redis) for _ in range(5)))
+    assert len(queries) == 1
+    assert {streamer["id"] for streamer in orjson.loads(payloads[0])} == {1, 2}
+    assert len(set(payloads)) == 1
+
+    await connect_viewer(sio, redis, 7, fake_sid(), 2)
+    assert [streamer["id"] for streamer in orjson.loads(await get_free_online_streamers_payload(redis))] == [1]
+
+    # отмена запроса, начавшего пересборку, не ломает ее остальным
+    await disconnect_viewer(sio, redis, 7, "test")
+    first = asyncio.create_task(get_free_online_streamers_payload(redis))
+    second = asyncio.create_task(get_free_online_streamers_payload(redis))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert {streamer["id"] for streamer in orjson.loads(await second)} == {1, 2}
+
+
+async def test_rebuild_free_streamers(sio, db, redis):
+    # присутствие, записанное до появления streamers:free, и мусор от прошлого запуска
+    await redis.zadd("streamers:online", {1: 1, 2: 1})
+    await redis.hset("streamers:viewers", 2, 7)
+    await redis.zadd("streamers:free", {5: 1})
+    await rebuild_free_streamers(db, redis)
+    assert await get_free_online_streamers_ids(redis) == [1]
+    assert await redis.zscore("streamers:rating", 2) == 3.3
+    assert not await redis.zscore("streamers:free", 5)
+
+    # новый рейтинг меняет порядок лобби сразу, офлайн стримеров не трогает
+    await redis.hdel("streamers:viewers", 2)
+    await rebuild_free_streamers(db, redis)
+    assert await get_free_online_streamers_ids(redis) == [1, 2]
+    version = await redis.get("streamers:free:version")
+    await update_online_streamer_rating(redis, 2, 5)
+    assert await get_free_online_streamers_ids(redis) == [2, 1]
+    assert await redis.get("streamers:free:version") != version
+    await update_online_streamer_rating(redis, 3, 5)
+    assert not await redis.zscore("streamers:rating", 3)
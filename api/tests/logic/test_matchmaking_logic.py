@@ -0,0 +1,72 @@
+from datetime import timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+from freezegun import freeze_time
+
+from exceptions.streamers import NoSeatsError
+from logic.matchmaking import dequeue_viewer, enqueue_viewer, release_expired_reservations
+from logic.streamers import connect_streamer, get_free_online_streamers_ids
+from logic.viewers import connect_viewer, disconnect_viewer
+from settings.conf import sockets_namespaces
+from tests.custom_faker import fake_sid
+from utils.libs import utc_now
+
+
+def matched_events(sio: AsyncMock) -> list[tuple[str, int]]:
+    return [
+        (call.kwargs["to"], call.args[1]["streamer_id"])
+        for call in sio.emit.call_args_list
+        if call.args[0] == "matchmaking:matched"
+    ]
+
+
+async def test_matchmaking_queue(redis):
+    sio = AsyncMock()
+    await connect_streamer(sio, redis, 1, fake_sid(), 4.546)
+    await connect_viewer(sio, redis, 7, fake_sid(), 1)
+
+    # мест нет - зрители ждут в порядке входа
+    sid_8, sid_9 = fake_sid(), fake_sid()
+    assert await enqueue_viewer(sio, redis, 8, sid_8) == 0
+    assert await enqueue_viewer(sio, redis, 9, sid_9) == 1
+    assert await enqueue_viewer(sio, redis, 8, sid_8) == 0
+    assert not matched_events(sio)
+
+    # освободившееся место сразу бронируется за первым в очереди и в лобби не появляется
+    await disconnect_viewer(sio, redis, 7, "test")
+    assert matched_events(sio) == [(sid_8, 1)]
+    assert await get_free_online_streamers_ids(redis) == []
+    with pytest.raises(NoSeatsError):
+        await connect_viewer(sio, redis, 9, fake_sid(), 1)
+    await connect_viewer(sio, redis, 8, fake_sid(), 1)
+    assert await redis.hget("streamers:viewers", 1) == "8"
+    assert not await redis.hexists("streamers:reserved", 1)
+
+    # новый стример достается следующему
+    sio.emit.reset_mock()
+    await connect_streamer(sio, redis, 2, fake_sid(), 3.3)
+    await enqueue_viewer(sio, redis, 9, sid_9)
+    assert matched_events(sio) == [(sid_9, 2)]
+
+
+async def test_matchmaking_reservation_expired(redis):
+    sio = AsyncMock()
+    await connect_viewer(sio, redis, 7, fake_sid(), 1)
+    sid_8 = fake_sid()
+    await enqueue_viewer(sio, redis, 8, sid_8)
+    await enqueue_viewer(sio, redis, 9, fake_sid())
+    await dequeue_viewer(redis, 9)
+
+    await connect_streamer(sio, redis, 2, fake_sid(), 3.3)
+    await enqueue_viewer(sio, redis, 8, sid_8)
+    assert matched_events(sio) == [(sid_8, 2)]
+
+    await release_expired_reservations(sio, redis)
+    assert await redis.hget("streamers:reserved", 2) == "8"
+
+    # зритель не пришел - место возвращается в лобби, очередь пуста
+    with freeze_time(utc_now() + timedelta(minutes=1)):
+        await release_expired_reservations(sio, redis)
+    assert await get_free_online_streamers_ids(redis) == [2]
+    sio.emit.assert_any_await("matchmaking:expired", {"streamer_id": 2}, to=sid_8, namespace=sockets_namespaces.lobby)
@@ -0,0 +1,256 @@
+import gzip
+from datetime import timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+from sqlalchemy import select, text as sql_text
+from sqlalchemy.dialects import postgresql
+
+from logic.messages import (
+    MESSAGES_EPOCH_MS,
+    MESSAGES_GROUP,
+    MESSAGES_STREAM,
+    _messages_page_filters,
+    _upload_multipart,
+    archive_messages_partition,
+    create_message,
+    flush_messages,
+    get_conversations,
+    get_messages,
+    get_unread_counters,
+    maintain_messages_partitions,
+    mark_messages_read,
+    message_id_time,
+    push_recent_message,
+)
+from models.messages import Message
+from repository.messages import ConversationRepository, MessageRepository
+from schemas.messages import MessageSchema
+from settings.conf import other_settings
+from tests.custom_faker import fake_sid
+from utils.libs import utc_now
+
+
+async def test_create_and_flush_messages(db, redis):
+    sio = AsyncMock()
+    viewer_sid = fake_sid()
+    await redis.hset("streamers:viewers", 1, 3)
+    await redis.hset("viewers:sid", 3, viewer_sid)
+
+    await create_message(sio, redis, 1, True, "привет")
+    await create_message(sio, redis, 1, False, "hi")
+
+    # доставлено сразу, в БД еще ничего нет
+    event, data = sio.emit.call_args_list[0].args
+    assert event == "message"
+    assert data["text"] == "привет"
+    assert sio.emit.call_args_list[0].kwargs["to"] == viewer_sid
+    assert not await MessageRepository(db).list_()
+    # но история уже видна из буфера последних сообщений
+    assert [message.text for message in await get_messages(db, redis, 1, 3)] == ["привет", "hi"]
+
+    assert await flush_messages(db, redis, "test") == 2
+    messages = await get_messages(db, redis, 1, 3)
+    assert {message.text for message in messages} == {"привет", "hi"}
+    assert data["id"] in {message.id for message in messages}
+    assert await redis.xlen(MESSAGES_STREAM) == 0
+    assert await flush_messages(db, redis, "test") == 0
+
+
+async def test_flush_messages_redelivery(db, redis):
+    sio = AsyncMock()
+    await redis.hset("streamers:viewers", 1, 3)
+    await create_message(sio, redis, 1, True, "привет")
+
+    # воркер прочитал запись и упал до XACK - ее заберет следующий
+    await redis.xgroup_create(MESSAGES_STREAM, MESSAGES_GROUP, id="0", mkstream=True)
+    [[_, [(_, fields)]]] = await redis.xreadgroup(MESSAGES_GROUP, "dead", {MESSAGES_STREAM: ">"})
+    assert await flush_messages(db, redis, "test", min_idle_time=0) == 1
+
+    # повторная доставка уже записанного сообщения не создает дубль
+    await redis.xadd(MESSAGES_STREAM, fields)
+    assert await flush_messages(db, redis, "test") == 1
+    assert len(await get_messages(db, redis, 1, 3)) == 1
+
+
+async def test_get_conversations(db, redis):
+    sio = AsyncMock()
+    for streamer_id, viewer_id, text in [(1, 3, "a"), (2, 3, "b"), (1, 4, "c"), (1, 3, "d")]:
+        await redis.hset("streamers:viewers", streamer_id, viewer_id)
+        await create_message(sio, redis, streamer_id, True, text)
+    assert await flush_messages(db, redis, "test") == 4
+
+    conversations = await get_conversations(db, streamer_id=1)
+    assert [(c.viewer_id, c.last_message.text) for c in conversations] == [(3, "d"), (4, "c")]
+    assert [c.streamer_id for c in await get_conversations(db, viewer_id=3)] == [1, 2]
+
+    # пагинация по id последнего сообщения
+    [first] = await get_conversations(db, streamer_id=1, limit=1)
+    [second] = await get_conversations(db, streamer_id=1, limit=1, before_id=first.last_message.id)
+    assert second.viewer_id == 4
+
+    # сообщение из более старой пачки не перетирает последнее
+    await ConversationRepository(db).upsert_last_messages(
+        [
+            {
+                **second.model_dump(exclude={"last_message"}),
+                "created": utc_now(),
+                "updated": utc_now(),
+                "last_message_id": 1,
+                "last_message_created": utc_now(),
+                "last_message_from_streamer": False,
+                "last_message_text": "old",
+            }
+        ]
+    )
+    assert (await get_conversations(db, streamer_id=1))[1].last_message.text == "c"
+
+
+async def test_unread_counters(redis):
+    sio = AsyncMock()
+    await redis.hset("streamers:viewers", 1, 3)
+    await redis.hset("streamers:viewers", 2, 3)
+    await create_message(sio, redis, 1, True, "a")
+    await create_message(sio, redis, 1, True, "b")
+    await create_message(sio, redis, 2, True, "c")
+    await create_message(sio, redis, 1, False, "d")
+
+    assert await get_unread_counters(redis, 3, False) == {1: 2, 2: 1}
+    assert await get_unread_counters(redis, 1, True) == {3: 1}
+
+    await mark_messages_read(redis, 3, False, 1)
+    assert await get_unread_counters(redis, 3, False) == {2: 1}
+    await mark_messages_read(redis, 1, True, 3)
+    assert await get_unread_counters(redis, 1, True) == {}
+
+
+async def test_get_messages_pages(db, redis, monkeypatch):
+    monkeypatch.setattr(other_settings, "recent_messages_size", 4)
+    repo = MessageRepository(db)
+    created = utc_now()
+    await repo.insert_ignore_existing(
+        [
+            {"id": i, "streamer_id": 1, "viewer_id": 3, "from_streamer": True, "text": str(i), "created": created}
+            for i in range(1, 8)
+        ]
+    )
+
+    assert [m.id for m in await get_messages(db, redis, 1, 3, limit=3)] == [5, 6, 7]
+    # первая страница и догрузка пропущенного - из буфера, без БД
+    assert [m.id for m in await get_messages(None, redis, 1, 3, limit=3)] == [5, 6, 7]
+    assert [m.id for m in await get_messages(None, redis, 1, 3, since_id=5)] == [6, 7]
+    assert await get_messages(None, redis, 1, 3, since_id=7) == []
+    # то, что старше буфера - из БД
+    assert [m.id for m in await get_messages(db, redis, 1, 3, limit=3, before_id=5)] == [2, 3, 4]
+    assert [m.id for m in await get_messages(db, redis, 1, 3, limit=3, before_id=2)] == [1]
+    assert [m.id for m in await get_messages(db, redis, 1, 3, limit=3, since_id=2)] == [3, 4, 5]
+    assert await get_messages(db, redis, 1, 4) == []
+    assert await get_messages(None, redis, 1, 4) == []
+
+
+async def test_recent_messages_eviction(db, redis, monkeypatch):
+    monkeypatch.setattr(other_settings, "recent_messages_size", 4)
+    created = utc_now()
+    await MessageRepository(db).insert_ignore_existing(
+        [
+            {"id": i, "streamer_id": 1, "viewer_id": 3, "from_streamer": True, "text": str(i), "created": created}
+            for i in range(1, 8)
+        ]
+    )
+
+    def message(message_id: int) -> MessageSchema:
+        return MessageSchema(id=message_id, created=created, from_streamer=False, text=str(message_id))
+
+    await get_messages(db, redis, 1, 3)
+    # метка заполненности переживает вытеснение старых сообщений из буфера
+    await push_recent_message(redis, 1, 3, message(8))
+    assert [m.id for m in await get_messages(None, redis, 1, 3, limit=3)] == [6, 7, 8]
+
+    # список вытеснили: новое сообщение не делает буфер заполненным, история доливается из БД
+    await redis.delete("messages:1:3:recent")
+    await push_recent_message(redis, 1, 3, message(9))
+    assert [m.id for m in await get_messages(db, redis, 1, 3, limit=3)] == [6, 7, 9]
+    assert [m.id for m in await get_messages(None, redis, 1, 3, since_id=5)] == [6, 7, 9]
+
+
+async def test_get_messages_partition_pruning(db):
+    month_start = utc_now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    cursor_time = month_start + timedelta(days=1)
+    cursor = int(cursor_time.timestamp() * 1000 - MESSAGES_EPOCH_MS) << 20
+    assert message_id_time(cursor) == cursor_time
+    assert message_id_time(7) is None
+    partitions = set(await MessageRepository(db).list_partitions())
+    current = f"messages_y{month_start:%Y}m{month_start:%m}"
+
+    async def scanned(before_id: int | None = None, since_id: int | None = None) -> set[str]:
+        statement = select(Message).where(*_messages_page_filters(1, 3, before_id, since_id))
+        sql = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+        plan = "\n".join((await db.execute(sql_text(f"EXPLAIN {sql}"))).scalars())
+        return {name for name in partitions if f" {name} " in plan}
+
+    # граница created из времени курсора: старше - без будущих партиций, новее - без прошлых
+    older = await scanned(before_id=cursor)
+    assert current in older
+    assert all(name <= current for name in older - {"messages_legacy"})
+    newer = await scanned(since_id=cursor)
+    assert current in newer
+    assert "messages_legacy" not in newer
+    assert all(name >= current for name in newer)
+    # по id из sequence время не узнать - проверяются все партиции
+    assert await scanned(before_id=7) == partitions
+
+
+async def test_maintain_messages_partitions(db, tmp_path):
+    repo = MessageRepository(db)
+    month_start = utc_now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    await repo.insert_ignore_existing(
+        [
+            {
+                "id": 1,
+                "streamer_id": 1,
+                "viewer_id": 3,
+                "from_streamer": True,
+                "text": "старое",
+                "created": month_start - timedelta(days=1),
+            }
+        ]
+    )
+
+    expired = await maintain_messages_partitions(db, months_ahead=6, retention_months=0)
+    partitions = await repo.list_partitions()
+    assert expired == ["messages_legacy"]
+    assert len([name for name, upper in partitions.items() if upper > month_start]) == 7
+
+    location = await archive_messages_partition(db, "messages_legacy", tmp_path)
+    with gzip.open(location, "rt") as file:
+        header, row, *_ = file.read().splitlines()
+    assert "text" in header.split(",")
+    assert "старое" in row
+    assert not await repo.list_()
+    assert "messages_legacy" not in await repo.list_partitions()
+
+    # партиция, отцепленная упавшим запуском, подбирается следующим
+    name = max(partitions)
+    await repo.detach_partition(name)
+    assert await maintain_messages_partitions(db, months_ahead=0, retention_months=0) == [name]
+    await archive_messages_partition(db, name, tmp_path)
+    assert await repo.list_detached_partitions() == []
+
+
+async def test_upload_archive_multipart(tmp_path):
+    path = tmp_path / "archive.csv.gz"
+    path.write_bytes(b"x" * 25)
+    s3_client = AsyncMock()
+    s3_client.create_multipart_upload.return_value = {"UploadId": "upload"}
+    s3_client.upload_part.side_effect = lambda **kwargs: {"ETag": str(kwargs["PartNumber"])}
+
+    await _upload_multipart(s3_client, "bucket", "messages/archive.csv.gz", path, part_size=10)
+    assert [len(call.kwargs["Body"]) for call in s3_client.upload_part.call_args_list] == [10, 10, 5]
+    parts = s3_client.complete_multipart_upload.call_args.kwargs["MultipartUpload"]["Parts"]
+    assert parts == [{"PartNumber": i, "ETag": str(i)} for i in (1, 2, 3)]
+
+    # оборванная загрузка не оставляет в бакете недогруженных частей
+    s3_client.upload_part.side_effect = OSError
+    with pytest.raises(OSError):
+        await _upload_multipart(s3_client, "bucket", "messages/archive.csv.gz", path, part_size=10)
+    s3_client.abort_multipart_upload.assert_awaited_once()
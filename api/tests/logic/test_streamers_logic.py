@@ -3,13 +3,25 @@ from unittest.mock import AsyncMock
 
 import pytest
 from freezegun import freeze_time
+from socketio.exceptions import ConnectionRefusedError as SocketIOConnectionRefusedError
+from sqlalchemy import update
 
 from exceptions.streamers import NoSeatsError
 from logic.auth import login_user_by_password
-from logic.streamers import clean_offline_streamers, connect_streamer, ping_streamer
-from logic.viewers import clean_offline_viewers, connect_viewer, ping_viewer
+from logic.streamers import (
+    clean_offline_streamers,
+    connect_streamer,
+    ping_streamer,
+    rate_streamer,
+    refresh_streamer_rating,
+    resume_streamer,
+)
+from logic.viewers import clean_offline_viewers, connect_viewer, ping_viewer, resume_viewer
+from models.streamers import StreamerProfile
+from settings.conf import sockets_namespaces
 from sockets.streamers import connect
 from tests.custom_faker import fake_sid
+from tests.factories.streamers import StreamerProfileFactory
 from utils.libs import utc_now
 
 
@@ -61,3 +73,57 @@ async def test_streamers_connect(db, redis):
     sid = fake_sid()
     token = await login_user_by_password(db, "streamer_1", "test")
     await connect(sid, {"HTTP_COOKIE": f"access_token={token}; test=test;"}, {}, db=db, redis=redis, sio=sio)
+
+
+async def test_resume_viewer(redis, sio):
+    await connect_streamer(sio, redis, 5, fake_sid())
+    await connect_viewer(sio, redis, 7, fake_sid(), 5)
+
+    sid = fake_sid()
+    assert await resume_viewer(sio, redis, 7, sid, 5)
+    assert await redis.hget("viewers:sid", 7) == sid
+    assert await redis.hget("streamers:viewers", 5) == "7"
+
+    assert not await resume_viewer(sio, redis, 7, fake_sid(), 6)
+    assert not await resume_viewer(sio, redis, 8, fake_sid(), 5)
+    assert not await resume_streamer(sio, redis, 6, fake_sid())
+
+
+async def test_streamers_resume(db, redis):
+    sio = AsyncMock()
+    token = await login_user_by_password(db, "streamer_1", "test")
+    await connect(fake_sid(), {"HTTP_COOKIE": f"access_token={token}; test=test;"}, {}, db=db, redis=redis, sio=sio)
+    resume_token = sio.save_session.call_args.args[1]["resume_token"]
+
+    sio.reset_mock()
+    sid = fake_sid()
+    # без кук и без БД: все берется из токена
+    assert await connect(sid, {}, {"resume_token": resume_token}, db=None, redis=redis, sio=sio)
+    assert await redis.hget("streamers:sid", 1) == sid
+    assert sio.save_session.call_args.args[1]["resume_token"] != resume_token
+    assert not any(call.kwargs.get("namespace") == sockets_namespaces.lobby for call in sio.emit.call_args_list)
+
+    # токен одноразовый
+    with pytest.raises(SocketIOConnectionRefusedError):
+        await connect(fake_sid(), {}, {"resume_token": resume_token}, db=db, redis=redis, sio=sio)
+
+
+async def test_rate_streamer(db, queries):
+    streamer = StreamerProfileFactory.build(id=10, user_id=4, name="Streamer 10")
+    db.add(streamer)
+    await db.flush()
+
+    await rate_streamer(db, 7, 5, 10)
+    await rate_streamer(db, 8, 2, 10)
+    assert (streamer.rating_sum, streamer.rating_count, streamer.rating) == (7, 2, 3.5)
+
+    # смена оценки не добавляет голос. Запросы: блокировка стримера, upsert оценки, агрегаты
+    queries.clear()
+    await rate_streamer(db, 8, 4, 10)
+    assert (streamer.rating_sum, streamer.rating_count, streamer.rating) == (9, 2, 4.5)
+    assert len(queries) == 3
+
+    await db.execute(update(StreamerProfile).where(StreamerProfile.id == 10).values(rating_sum=0, rating_count=0))
+    await refresh_streamer_rating(db, 10)
+    await db.refresh(streamer)
+    assert (streamer.rating_sum, streamer.rating_count) == (9, 2)
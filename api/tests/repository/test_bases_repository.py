@@ -0,0 +1,181 @@
+import time
+from collections.abc import Awaitable, Callable
+from datetime import timedelta
+from itertools import count
+from unittest.mock import MagicMock
+
+import pytest
+from loguru import logger
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import contains_eager, joinedload
+
+from models.messages import Message
+from models.streamers import StreamerMark
+from models.user import User, UserSession
+from repository.messages import MessageRepository
+from repository.streamers import StreamerMarkRepository, StreamerProfileRepository
+from repository.user import UserRepository, UserSessionRepository
+from services.auth import UserSessionService
+from tests.custom_faker import fake_sid
+from utils.libs import utc_now
+
+
+async def _check_bulk_upsert(db: AsyncSession):
+    repo = StreamerMarkRepository(db)
+    marks = await repo.bulk_upsert(
+        [{"streamer_id": 1, "viewer_id": 7, "mark": 3}, {"streamer_id": 1, "viewer_id": 8, "mark": 4}]
+    )
+    assert [(mark.viewer_id, mark.mark) for mark in marks] == [(7, 3), (8, 4)]
+
+    # ключ конфликта - UniqueConstraint(streamer_id, viewer_id), строка обновляется на месте
+    updated = await repo.upsert({"streamer_id": 1, "viewer_id": 7, "mark": 5})
+    assert (updated.id, updated.mark) == (marks[0].id, 5)
+    assert updated.updated >= updated.created
+    assert len(await repo.list_()) == 2
+
+    # where не пропустил обновление
+    assert await repo.upsert({"streamer_id": 1, "viewer_id": 8, "mark": 1}, where=StreamerMark.mark < 4) is None
+    assert (await repo.first(StreamerMark.viewer_id == 8)).mark == 4
+
+
+async def test_bulk_upsert(db):
+    await _check_bulk_upsert(db)
+
+
+async def _check_bulk_writes(db: AsyncSession):
+    repo = StreamerMarkRepository(db)
+    values = [{"streamer_id": 1, "viewer_id": viewer_id, "mark": 3} for viewer_id in range(1, 10)]
+    assert await repo.bulk_insert(values) == 9
+    marks = await repo.list_(order_by=StreamerMark.viewer_id)
+    assert [(mark.viewer_id, mark.mark) for mark in marks] == [(viewer_id, 3) for viewer_id in range(1, 10)]
+    assert all(mark.created and mark.updated for mark in marks)
+
+    assert await repo.bulk_update([{"id": mark.id, "mark": mark.viewer_id % 5 + 1} for mark in marks[:3]]) == 3
+    assert await repo.bulk_delete(mark.id for mark in marks[3:]) == 6
+    db.expire_all()
+    marks = await repo.list_(order_by=StreamerMark.viewer_id)
+    assert [(mark.viewer_id, mark.mark) for mark in marks] == [(1, 2), (2, 3), (3, 4)]
+    assert marks[0].updated > marks[0].created
+
+
+async def test_bulk_writes(db):
+    await _check_bulk_writes(db)
+
+
+async def test_bulk_upsert_sqlite():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(StreamerMark.metadata.create_all, tables=[StreamerMark.__table__])
+    async with AsyncSession(engine) as db:
+        await _check_bulk_upsert(db)
+        await StreamerMarkRepository(db).delete_all()
+        await _check_bulk_writes(db)
+    await engine.dispose()
+
+
+async def test_bulk_insert_messages_without_id(db):
+    with pytest.raises(ValueError):
+        await MessageRepository(db).bulk_insert([{"streamer_id": 1, "viewer_id": 7, "text": "message"}])
+
+
+@pytest.mark.benchmark
+async def test_bulk_writes_benchmark(db):
+    """Пропускная способность записи сообщений: ORM против bulk_insert/bulk_update/bulk_delete, строк в секунду"""
+    repo = MessageRepository(db)
+    rows = 5000
+    ids = count(1)
+
+    def make_values() -> list[dict]:
+        return [
+            {"id": next(ids), "streamer_id": 1, "viewer_id": 7, "from_streamer": bool(i % 2), "text": f"message {i}"}
+            for i in range(rows)
+        ]
+
+    async def measure(name: str, write: Callable[[], Awaitable]) -> float:
+        started = time.perf_counter()
+        await write()
+        speed = rows / (time.perf_counter() - started)
+        logger.info("{}: {:.0f} rows/s", name, speed)
+        return speed
+
+    orm = await measure("add_all", lambda: repo.add_all(Message(**value) for value in make_values()))
+    db.expunge_all()
+    executemany = await measure("bulk_insert executemany", lambda: repo.bulk_insert(make_values(), copy=False))
+    copy = await measure("bulk_insert copy", lambda: repo.bulk_insert(make_values()))
+    assert await repo.exists(Message.text == "message 1")
+    assert copy > orm
+    assert executemany > orm
+
+    ids = (await db.scalars(select(Message.id))).all()
+    assert len(ids) == rows * 3
+    await measure("bulk_update", lambda: repo.bulk_update([{"id": id_, "text": "edited"} for id_ in ids[:rows]]))
+    await measure("bulk_delete", lambda: repo.bulk_delete(ids[:rows]))
+    assert await db.scalar(select(func.count()).where(Message.text == "edited")) == 0
+    assert await db.scalar(select(func.count()).select_from(Message)) == rows * 2
+
+
+async def test_prebuilt(db):
+    repo = StreamerProfileRepository(db)
+    assert repo.by_ids_query is StreamerProfileRepository.by_ids_query
+    assert [streamer.id for streamer in await repo.list_by_ids([2, 1, 99])] == [1, 2]
+    assert await repo.exists_by_id(1)
+    assert not await repo.exists_by_id(99)
+
+    user = await UserRepository(db).get_by_username("user")
+    token = fake_sid()
+    await UserSessionService(db).create_session(user.id, token, timedelta(hours=1))
+    assert (await UserSessionService(db).get_user(token)).id == user.id
+    assert await UserSessionService(db).get_user(fake_sid()) is None
+
+
+class CompileOnlySession:
+    """Сессия без БД: с запросом делается только то, что SQLAlchemy делает до похода в базу - ключ кэша компиляции"""
+
+    def __init__(self, row: object) -> None:
+        self.result = MagicMock()
+        self.result.scalars.return_value.first.return_value = row
+        self.result.first.return_value = row
+
+    async def execute(self, statement, params=None):
+        statement._generate_cache_key()
+        return self.result
+
+    async def scalars(self, statement, params=None):
+        return (await self.execute(statement, params)).scalars()
+
+
+@pytest.mark.benchmark
+async def test_prebuilt_benchmark():
+    """Накладные расходы Python на запрос авторизации без похода в БД: first() с билдером против prebuilt"""
+    session = UserSession(token=fake_sid())
+    repo = UserSessionRepository(CompileOnlySession(session))
+
+    async def build():
+        return await repo.first(
+            UserSession.token == fake_sid(),
+            UserSession.is_active,
+            UserSession.expired >= utc_now(),
+            User.is_active,
+            join=(User,),
+            options=(
+                contains_eager(UserSession.user),
+                joinedload(UserSession.user, User.streamer_profile),
+                joinedload(UserSession.user, User.viewer_profile),
+            ),
+        )
+
+    async def prebuilt():
+        return (await repo.scalars(repo.active_user_query, token=fake_sid(), now=utc_now())).first()
+
+    timings = {}
+    for name, call in (("builder", build), ("prebuilt", prebuilt)):
+        assert await call() is session
+        best = []
+        for _ in range(3):
+            started = time.perf_counter()
+            for _ in range(200):
+                await call()
+            best.append(time.perf_counter() - started)
+        timings[name] = min(best) / 200 * 1e6
+    logger.info("builder: {builder:.1f} us, prebuilt: {prebuilt:.1f} us", **timings)
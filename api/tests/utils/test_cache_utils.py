@@ -0,0 +1,212 @@
+import asyncio
+from datetime import timedelta
+from unittest.mock import AsyncMock, patch
+
+import orjson
+
+from models.streamers import StreamerProfile
+from utils.cache import INVALIDATE_CHANNEL, CacheEntry, CacheRegistry, LRUCache, TwoTierCache
+from utils.helpers import transient_models
+from utils.libs import cached
+
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2, ttl=timedelta(minutes=1))
+    cache.set(1, "a")
+    cache.set(2, "b")
+    assert cache.get(1) == "a"
+    cache.set(3, "c")  # 2 дольше всех не читали
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+
+    cache.ttl = -1
+    cache.set(4, "d")
+    assert cache.get(4) is None
+
+
+async def test_two_tier_cache(redis):
+    loader = AsyncMock(side_effect=lambda keys: {key: str(key) for key in keys if key != 3})
+    cache = TwoTierCache("test", timedelta(minutes=1), timedelta(minutes=1), 100, registry=CacheRegistry())
+
+    assert await cache.get_many(redis, [1, 2, 3], loader) == {1: "1", 2: "2"}
+    assert await cache.get_many(redis, [2, 1], loader) == {1: "1", 2: "2"}
+    loader.assert_awaited_once_with([1, 2, 3])
+    assert CacheEntry.decode(await redis.get("test:1")).value == "1"
+
+    # другой процесс: локальный кэш пустой, значения из Redis
+    other = TwoTierCache("test", timedelta(minutes=1), timedelta(minutes=1), 100, registry=CacheRegistry())
+    assert await other.get(redis, 1, loader) == "1"
+    assert loader.await_count == 1
+
+    await cache.invalidate(redis, 1)
+    assert await cache.get(redis, 1, loader) == "1"
+    assert loader.await_args.args == ([1],)
+    assert cache.stats() | {"load_avg_ms": 0} == {
+        "local_hits": 2,
+        "redis_hits": 0,
+        "misses": 4,
+        "early_refreshes": 0,
+        "loads": 2,
+        "load_avg_ms": 0,
+        "local_size": 2,
+    }
+
+
+async def test_two_tier_cache_single_flight(redis):
+    started = asyncio.Event()
+
+    async def slow_loader(keys: list[int]) -> dict[int, str]:
+        started.set()
+        await asyncio.sleep(0.01)
+        return {key: str(key) for key in keys}
+
+    loader = AsyncMock(side_effect=slow_loader)
+    cache = TwoTierCache("test", timedelta(minutes=1), timedelta(minutes=1), 100, registry=CacheRegistry())
+
+    # второй запрос ждет уже идущую загрузку 1 и грузит только 2
+    first = asyncio.create_task(cache.get(redis, 1, loader))
+    await started.wait()
+    results = await asyncio.gather(cache.get_many(redis, [1, 2], loader), cache.get(redis, 1, loader), first)
+    assert results == [{1: "1", 2: "2"}, "1", "1"]
+    assert [call.args for call in loader.await_args_list] == [([1],), ([2],)]
+    assert not cache._inflight
+
+
+async def test_two_tier_cache_invalidate_during_load(redis):
+    values = {1: "old"}
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def slow_loader(keys: list[int]) -> dict[int, str]:
+        loaded = {key: values[key] for key in keys}
+        started.set()
+        await release.wait()
+        return loaded
+
+    cache = TwoTierCache("test", timedelta(minutes=1), timedelta(minutes=1), 100, registry=CacheRegistry())
+    other = TwoTierCache("test", timedelta(minutes=1), timedelta(minutes=1), 100, registry=CacheRegistry())
+
+    # загрузка прочитала старое значение, и тут ключ сбросили - в этом же процессе и из другого
+    for invalidating in (cache, other):
+        values[1] = "old"
+        started.clear()
+        release.clear()
+        stale = asyncio.create_task(cache.get(redis, 1, slow_loader))
+        await started.wait()
+        values[1] = "new"
+        await invalidating.invalidate(redis, 1)
+        release.set()
+
+        # ждавшие загрузку получают ее результат, но в кэш он не попадает
+        assert await stale == "old"
+        assert not await redis.exists("test:1")
+        assert cache.local.get("test:1") is None
+        assert await cache.get(redis, 1, slow_loader) == "new"
+        assert not cache._inflight
+        await cache.invalidate(redis, 1)
+
+
+async def test_two_tier_cache_tags(redis):
+    registry = CacheRegistry()
+    loader = AsyncMock(side_effect=lambda keys: {key: str(key) for key in keys})
+    cache = TwoTierCache("test", timedelta(minutes=1), timedelta(minutes=1), 100, registry=registry)
+    other = TwoTierCache("test", timedelta(minutes=1), timedelta(minutes=1), 100, registry=CacheRegistry())
+
+    await cache.get_many(redis, [1, 2], loader, tags=["streamer:1"])
+    await cache.get(redis, 3, loader, tags=["streamer:2"])
+    await other.get_many(redis, [1, 2, 3], loader)
+    assert loader.await_count == 2
+
+    async with redis.pubsub() as pubsub:
+        await pubsub.subscribe(INVALIDATE_CHANNEL)
+        await pubsub.get_message(timeout=1)
+        await other.invalidate_tags(redis, "streamer:1")
+        message = await pubsub.get_message(timeout=1)
+    assert sorted(orjson.loads(message["data"])) == ["test:1", "test:2"]
+    assert await redis.exists("test:1", "test:2", "test:tags:streamer:1") == 0
+    assert await redis.exists("test:3") == 1
+
+    # в этот процесс инвалидация приходит через подписку
+    assert await cache.get(redis, 1, loader) == "1"
+    assert loader.await_count == 2
+    registry.invalidate_local(orjson.loads(message["data"]))
+    assert await cache.get(redis, 1, loader) == "1"
+    assert loader.await_args.args == ([1],)
+
+
+async def test_two_tier_cache_early_refresh(redis):
+    loader = AsyncMock(side_effect=lambda keys: {key: str(key) for key in keys})
+    cache = TwoTierCache("test", timedelta(minutes=1), timedelta(minutes=1), 100, registry=CacheRegistry())
+    await cache.get(redis, 1, loader)
+    cache.local.clear()
+
+    # загрузка длилась почти весь ttl - запись пересчитывается заранее
+    entry = CacheEntry.decode(await redis.get("test:1"))
+    await redis.set("test:1", entry._replace(delta=60).encode())
+    with patch("utils.cache.random.random", return_value=0.99):
+        assert await cache.get(redis, 1, loader) == "1"
+    assert loader.await_count == 2
+    assert cache.early_refreshes == 1
+
+    cache.local.clear()
+    assert await cache.get(redis, 1, loader) == "1"
+    assert cache.redis_hits == 1
+
+
+async def test_cached(redis):
+    calls = []
+
+    @cached("test:cached", ttl=timedelta(minutes=1))
+    async def get_value(db, redis, value_id: int) -> dict:
+        calls.append(value_id)
+        return {"id": value_id}
+
+    assert await get_value(None, redis, 1) == {"id": 1}
+    assert await get_value(None, redis, value_id=1) == {"id": 1}
+    assert calls == [1]
+
+    await get_value.invalidate(redis=redis, value_id=1)
+    assert await get_value(None, redis, 1) == {"id": 1}
+    assert calls == [1, 1]
+
+
+async def test_cached_pickle(db, redis):
+    calls = []
+
+    @cached(
+        "test:cached:pickle",
+        ttl=timedelta(minutes=1),
+        serializer="pickle",
+        tags=lambda db, redis, profile_id: ["streamers"],
+    )
+    @transient_models
+    async def get_profile(db, redis, profile_id: int) -> StreamerProfile:
+        calls.append(profile_id)
+        return await db.get(StreamerProfile, profile_id)
+
+    first = await get_profile(db, redis, 1)
+    second = await get_profile(db, redis, 1)
+    assert calls == [1]
+    assert isinstance(second, StreamerProfile)
+    assert second is not first
+    assert (second.id, second.name) == (first.id, first.name)
+
+    await get_profile.invalidate_tags(redis, "streamers")
+    await get_profile(db, redis, 1)
+    assert calls == [1, 1]
+
+
+async def test_cached_own_session(db, redis):
+    started = asyncio.Event()
+
+    @cached("test:cached:session", ttl=timedelta(minutes=1))
+    async def get_name(db, redis, profile_id: int) -> str:
+        started.set()
+        await asyncio.sleep(0.01)
+        return (await db.get(StreamerProfile, profile_id)).name
+
+    # загрузку начал запрос без сессии, и его отменили - остальные все равно получают значение
+    first = asyncio.create_task(get_name(None, redis, 1))
+    await started.wait()
+    second = asyncio.create_task(get_name(None, redis, 1))
+    first.cancel()
+    assert await second == "Streamer 1"
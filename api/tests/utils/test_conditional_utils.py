@@ -0,0 +1,22 @@
+from datetime import UTC, datetime
+
+from utils.conditional import etag_matches, make_etag, not_modified_since
+
+
+def test_etag_matches():
+    etag = make_etag(1, "2026-10-19")
+    assert etag.startswith('W/"')
+    assert etag != make_etag(1, "2026-10-20")
+
+    assert etag_matches(etag, etag)
+    assert etag_matches(etag.removeprefix("W/"), etag)
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+
+
+def test_not_modified_since():
+    last_modified = datetime(2026, 10, 19, 12, 0, 0, 500_000, tzinfo=UTC)
+    assert not_modified_since("Mon, 19 Oct 2026 12:00:00 GMT", last_modified)
+    assert not not_modified_since("Mon, 19 Oct 2026 11:59:59 GMT", last_modified)
+    assert not not_modified_since("garbage", last_modified)
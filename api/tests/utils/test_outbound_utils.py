@@ -0,0 +1,42 @@
+import engineio
+from engineio.async_socket import AsyncSocket
+from engineio.packet import MESSAGE, Packet
+
+from sockets import is_droppable_packet
+from utils.outbound import OutboundLimiter, packet_event
+
+
+def event_packet(namespace: str, event: str, size: int = 0) -> Packet:
+    return Packet(MESSAGE, data=f'2{namespace},["{event}",{{"pad":"{"x" * size}"}}]')
+
+
+def test_packet_event():
+    assert packet_event(event_packet("/lobby", "streamers:free")) == ("/lobby", "streamers:free")
+    assert packet_event(Packet(MESSAGE, data='2["message",{}]')) == ("/", "message")
+    assert packet_event(Packet(MESSAGE, data='0/streamers,{"sid":"x"}')) == ("/streamers", None)
+
+
+async def test_outbound_limiter():
+    eio = engineio.AsyncServer(async_mode="asgi")
+    limiter = OutboundLimiter(max_bytes=1000, disconnect_bytes=2000, is_droppable=is_droppable_packet)
+    limiter.install(eio)
+    socket = AsyncSocket(eio, "sid")
+    eio.sockets["sid"] = socket
+
+    for _ in range(5):
+        await eio.send_packet("sid", event_packet("/lobby", "streamers:free", 300))
+    assert socket.queue.qsize() == 2
+    assert limiter.dropped == 3
+
+    # сигналинг не теряется, вместо него выкидываются дельты лобби
+    for _ in range(3):
+        await eio.send_packet("sid", event_packet("/streamers", "webrtc:ice", 300))
+    assert [packet_event(pkt)[1] for pkt in socket.queue._queue] == ["webrtc:ice"] * 3
+    assert socket.queue.buffered_bytes == limiter.buffered_bytes > 1000
+
+    for _ in range(3):
+        await eio.send_packet("sid", event_packet("/streamers", "webrtc:ice", 300))
+    assert limiter.disconnected == 1
+    assert "sid" not in eio.sockets
+    assert limiter.buffered_bytes == 0
+    assert limiter.stats() == {"buffered_bytes": 0, "dropped": 5, "disconnected": 1}
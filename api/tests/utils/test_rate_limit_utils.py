@@ -0,0 +1,68 @@
+from unittest.mock import AsyncMock, MagicMock
+
+from sockets import events_limiter, registrator
+from tests.custom_faker import fake_sid
+from utils.rate_limit import AdmissionController, ConnectPriority, EventsRateLimiter, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.consume() == 0
+    assert bucket.consume() == 0
+    assert bucket.consume() > 0
+
+    bucket.updated -= 0.1  # прошло 100мс - накопился токен
+    assert bucket.consume() == 0
+
+
+async def test_admission_controller_priorities():
+    controller = AdmissionController(rate=1, burst=3, reserves={ConnectPriority.viewer: 1, ConnectPriority.lobby: 2})
+    handler = controller.wrap(AsyncMock(return_value=None), AsyncMock(side_effect=lambda environ: environ["priority"]))
+
+    assert await handler("sid", {"priority": ConnectPriority.lobby}) is None
+    rejected = await handler("sid", {"priority": ConnectPriority.lobby})
+    assert rejected["message"] == "TOO_MANY_CONNECTIONS"
+    assert rejected["retry_after"] > 0
+
+    assert await handler("sid", {"priority": ConnectPriority.viewer}) is None
+    assert await handler("sid", {"priority": ConnectPriority.viewer})
+    assert await handler("sid", {"priority": ConnectPriority.streamer}) is None
+
+    stats = controller.stats()
+    assert stats["admitted"] == {"lobby": 1, "viewer": 1, "streamer": 1}
+    assert stats["rejected"] == {"lobby": 1, "viewer": 1}
+
+
+def test_events_rate_limiter():
+    limiter = EventsRateLimiter({"ping": (1, 2)}, max_violations=2)
+    sid = fake_sid()
+
+    assert limiter.hit(sid, "ping")
+    assert limiter.hit(sid, "ping")
+    assert not limiter.hit(sid, "ping")
+    assert not limiter.is_offender(sid)
+    assert not limiter.hit(sid, "ping")
+    assert limiter.is_offender(sid)
+    assert not limiter.is_offender(sid)
+
+    limiter.forget(sid)
+    assert limiter.hit(sid, "ping")
+    assert limiter.stats() == {"sids": 1, "dropped": {"ping": 2}, "disconnected": 1}
+
+
+async def test_registrator_drops_flood():
+    sio = MagicMock(disconnect=AsyncMock())
+    handler = AsyncMock()
+    register = registrator(sio)
+    register.namespace = "/test"
+    register(handler, "ping")
+    wrapper = sio.on.call_args.args[1]
+
+    sid = fake_sid()
+    burst = int(events_limiter.limits["ping"][1])
+    for _ in range(burst + events_limiter.max_violations):
+        await wrapper(sid, {})
+
+    assert handler.await_count == burst
+    sio.disconnect.assert_awaited_once_with(sid, "/test")
+    events_limiter.forget(sid)
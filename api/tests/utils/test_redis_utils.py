@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+from redis.exceptions import ResponseError
+
+from utils.redis import INVALIDATE_CHANNEL, AutoPipelineRedis, TrackedHashCache
+
+
+@pytest.fixture
+def pipelined_redis(redis) -> AutoPipelineRedis:
+    return AutoPipelineRedis(connection_pool=redis.connection_pool)
+
+
+async def test_auto_pipeline_coalesces_concurrent_commands(pipelined_redis):
+    await pipelined_redis.hset("streamers:sid", mapping={str(i): f"sid-{i}" for i in range(50)})
+    pipelined_redis.pipelines_count = pipelined_redis.commands_count = 0
+
+    results = await asyncio.gather(*(pipelined_redis.hget("streamers:sid", i) for i in range(50)))
+
+    assert results == [f"sid-{i}" for i in range(50)]
+    assert pipelined_redis.pipelines_count == 1
+    assert pipelined_redis.commands_count == 50
+
+
+async def test_auto_pipeline_errors_are_per_command(pipelined_redis):
+    await pipelined_redis.set("string", "value")
+
+    ok, error = await asyncio.gather(
+        pipelined_redis.get("string"),
+        pipelined_redis.hget("string", "field"),
+        return_exceptions=True,
+    )
+    assert ok == "value"
+    assert isinstance(error, ResponseError)
+
+
+async def test_auto_pipeline_lock_and_explicit_pipeline(pipelined_redis):
+    async with pipelined_redis.lock("streamers:1:connect:lock", timeout=5):
+        pipe = pipelined_redis.pipeline()
+        pipe.zadd("streamers:online", {1: 100})
+        pipe.zrange("streamers:online", 0, -1)
+        _, online = await pipe.execute()
+
+    assert online == ["1"]
+
+
+async def test_tracked_hash_cache(redis):
+    cache = TrackedHashCache(("streamers:sid", "viewers:sid"))
+    await redis.hset("streamers:sid", 1, "sid-1")
+
+    # трекинг не запущен - читаем напрямую
+    assert await cache.hget(redis, "streamers:sid", 1) == "sid-1"
+    assert cache.stats()["misses"] == 0
+
+    cache._enabled = True
+    assert await cache.hget(redis, "streamers:sid", 1) == "sid-1"
+    assert await cache.hget(redis, "streamers:sid", 2) is None
+    await redis.hset("streamers:sid", mapping={1: "sid-1-new", 2: "sid-2"})
+    assert await cache.hget(redis, "streamers:sid", 1) == "sid-1"
+    assert await cache.hget(redis, "streamers:sid", 2) is None
+    assert cache.stats() == {"hits": 2, "misses": 2, "invalidations": 0, "size": 2}
+
+    cache._on_message(["message", INVALIDATE_CHANNEL, ["viewers:sid"]])
+    assert await cache.hget(redis, "streamers:sid", 1) == "sid-1"
+
+    cache._on_message(["message", INVALIDATE_CHANNEL, ["streamers:sid"]])
+    assert await cache.hget(redis, "streamers:sid", 1) == "sid-1-new"
+    assert await cache.hget(redis, "streamers:sid", 2) == "sid-2"
+    assert cache.stats() == {"hits": 3, "misses": 4, "invalidations": 2, "size": 2}
@@ -0,0 +1,366 @@
+import asyncio
+import math
+import random
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+from datetime import timedelta
+from functools import partial
+from typing import Any, NamedTuple
+
+import orjson
+from loguru import logger
+from redis.asyncio import Redis
+
+INVALIDATE_CHANNEL = "cache:invalidate"
+
+# ключи всех тегов забираются и удаляются атомарно, иначе ключ, добавленный между чтением и удалением тега,
+# останется без тега до конца ttl. ARGV[1] - ttl поколений ключей (см. SET_IF_GENERATION_SCRIPT)
+POP_TAGS_SCRIPT = """
+local keys = {}
+for _, tag in ipairs(KEYS) do
+    for _, key in ipairs(redis.call('SMEMBERS', tag)) do
+        table.insert(keys, key)
+    end
+    redis.call('DEL', tag)
+end
+for _, key in ipairs(keys) do
+    redis.call('INCR', key .. ':gen')
+    redis.call('EXPIRE', key .. ':gen', ARGV[1])
+end
+for i = 1, #keys, 1000 do
+    redis.call('DEL', unpack(keys, i, math.min(i + 999, #keys)))
+end
+return keys
+"""
+
+# загрузка пишет значение, только если поколение ключа не сменилось с момента, когда его прочитали до загрузки.
+# Инвалидация сначала меняет поколение, потом удаляет ключ - загрузка, начатая раньше, старое значение не запишет.
+# ARGV: ttl, затем пары (поколение, значение) для KEYS. Возвращает 1/0 - записан ли ключ
+SET_IF_GENERATION_SCRIPT = """
+local written = {}
+for i, key in ipairs(KEYS) do
+    if (redis.call('GET', key .. ':gen') or '') == ARGV[i * 2] then
+        redis.call('SET', key, ARGV[i * 2 + 1], 'EX', ARGV[1])
+        written[i] = 1
+    else
+        written[i] = 0
+    end
+end
+return written
+"""
+
+type Loader[KeyT] = Callable[[list[KeyT]], Awaitable[dict[KeyT, str]]]
+
+
+class LRUCache:
+    """Локальный кэш процесса, ограниченный по размеру и по времени жизни записи"""
+
+    def __init__(self, max_size: int, ttl: timedelta) -> None:
+        self.max_size = max_size
+        self.ttl = ttl.total_seconds()
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, *keys: Hashable) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class CacheEntry(NamedTuple):
+    value: str
+    expires_at: float  # unix time, когда запись истечет в Redis
+    delta: float  # сколько секунд значение считалось
+
+    def encode(self) -> str:
+        return f"{self.expires_at:.3f} {self.delta:.4f} {self.value}"
+
+    @classmethod
+    def decode(cls, raw: str) -> "CacheEntry | None":
+        try:
+            expires_at, delta, value = raw.split(" ", 2)
+            return cls(value, float(expires_at), float(delta))
+        except ValueError:
+            return None
+
+
+class TwoTierCache[KeyT: Hashable]:
+    """
+    Кэш сериализованных значений: локальный LRU процесса поверх Redis.
+
+    - конкурентные промахи одного ключа в процессе склеиваются в одну загрузку (single-flight);
+    - инвалидация по ключам и тегам удаляет ключи из Redis и рассылается остальным процессам через pub/sub
+      (см. CacheRegistry). local_ttl - страховка на время, пока подписка не работает;
+    - загрузка, начатая до инвалидации, свой результат не кэширует: новые запросы ее не ждут,
+      а запись в Redis сверяется с поколением ключа;
+    - запись может пересчитаться раньше срока с вероятностью, растущей к концу ttl и со временем загрузки
+      (XFetch, beta > 1 - раньше, 0 - выключено), чтобы горячий ключ не истекал у всех разом
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        ttl: timedelta,
+        local_ttl: timedelta,
+        max_size: int,
+        beta: float = 1,
+        registry: "CacheRegistry | None" = None,
+    ) -> None:
+        self.prefix = prefix
+        self.ttl = ttl
+        self.beta = beta
+        self.local = LRUCache(max_size, local_ttl)
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.early_refreshes = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self._inflight: dict[KeyT, asyncio.Future[dict[KeyT, str]]] = {}
+        (registry or caches).register(self)
+
+    def key(self, key: KeyT) -> str:
+        return f"{self.prefix}:{key}"
+
+    @staticmethod
+    def generation_key(full_key: str) -> str:
+        return f"{full_key}:gen"
+
+    def tag_key(self, tag: str) -> str:
+        return f"{self.prefix}:tags:{tag}"
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "early_refreshes": self.early_refreshes,
+            "loads": self.loads,
+            "load_avg_ms": round(self.load_seconds / self.loads * 1000, 2) if self.loads else 0,
+            "local_size": len(self.local),
+        }
+
+    async def get(self, redis: Redis, key: KeyT, loader: Loader[KeyT], tags: Iterable[str] = ()) -> str | None:
+        return (await self.get_many(redis, [key], loader, tags)).get(key)
+
+    async def get_many(
+        self, redis: Redis, keys: Iterable[KeyT], loader: Loader[KeyT], tags: Iterable[str] = ()
+    ) -> dict[KeyT, str]:
+        """
+        Значения по ключам: сначала LRU, затем один MGET, остальное одним вызовом loader.
+        Ключей, которых нет и у loader, нет и в ответе. tags проставляются загруженным значениям
+        """
+        values = {}
+        missed = []
+        for key in dict.fromkeys(keys):
+            entry = self.local.get(self.key(key))
+            if entry is None or self._should_refresh(entry):
+                missed.append(key)
+            else:
+                self.local_hits += 1
+                values[key] = entry.value
+        if not missed:
+            return values
+
+        # поколения читаются тем же MGET, до загрузки - с ними сверится запись результата
+        full_keys = [self.key(key) for key in missed]
+        raws = await redis.mget([*full_keys, *map(self.generation_key, full_keys)])
+        not_cached = {}
+        for key, raw, generation in zip(missed, raws[: len(missed)], raws[len(missed) :], strict=True):
+            entry = raw and CacheEntry.decode(raw)
+            if not entry:
+                not_cached[key] = generation or ""
+            elif self._should_refresh(entry):
+                self.early_refreshes += 1
+                not_cached[key] = generation or ""
+            else:
+                self.redis_hits += 1
+                self.local.set(self.key(key), entry)
+                values[key] = entry.value
+
+        if not_cached:
+            self.misses += len(not_cached)
+            values.update(await self._load(redis, not_cached, loader, tuple(tags)))
+        return values
+
+    def _should_refresh(self, entry: CacheEntry) -> bool:
+        # 1 - random() в (0, 1], log <= 0: чем дольше загрузка, тем раньше срабатывает
+        return time.time() - entry.delta * self.beta * math.log(1 - random.random()) >= entry.expires_at  # noqa: S311
+
+    async def _load(
+        self, redis: Redis, generations: dict[KeyT, str], loader: Loader[KeyT], tags: tuple[str, ...]
+    ) -> dict[KeyT, str]:
+        keys = list(generations)
+        new_keys = [key for key in keys if key not in self._inflight]
+        if new_keys:
+            new_generations = {key: generations[key] for key in new_keys}
+            load = asyncio.ensure_future(self._load_and_set(redis, new_generations, loader, tags))
+            self._inflight.update(dict.fromkeys(new_keys, load))
+            load.add_done_callback(partial(self._forget_inflight, new_keys))
+
+        loads = {key: self._inflight[key] for key in keys}
+        values = {}
+        for load in set(loads.values()):
+            # отмена одного запроса не должна отменять загрузку для остальных
+            loaded = await asyncio.shield(load)
+            values.update((key, loaded[key]) for key in keys if loads[key] is load and key in loaded)
+        return values
+
+    def _forget_inflight(self, keys: list[KeyT], load: asyncio.Future) -> None:
+        for key in keys:
+            if self._inflight.get(key) is load:
+                del self._inflight[key]
+
+    async def _load_and_set(
+        self, redis: Redis, generations: dict[KeyT, str], loader: Loader[KeyT], tags: tuple[str, ...]
+    ) -> dict[KeyT, str]:
+        started = time.perf_counter()
+        values = await loader(list(generations))
+        delta = time.perf_counter() - started
+        self.loads += 1
+        self.load_seconds += delta
+        if not values:
+            return values
+
+        expires_at = time.time() + self.ttl.total_seconds()
+        entries = {key: CacheEntry(value, expires_at, delta) for key, value in values.items()}
+        pipe = redis.pipeline(transaction=False)
+        # теги - до записи: сброс тега между ними сменит поколение, и запись не пройдет
+        for tag in tags:
+            pipe.sadd(self.tag_key(tag), *(self.key(key) for key in entries))
+            pipe.expire(self.tag_key(tag), self.ttl)
+        pipe.eval(
+            SET_IF_GENERATION_SCRIPT,
+            len(entries),
+            *(self.key(key) for key in entries),
+            int(self.ttl.total_seconds()),
+            *(arg for key, entry in entries.items() for arg in (generations[key], entry.encode())),
+        )
+        written = (await pipe.execute())[-1]
+
+        load = asyncio.current_task()
+        for (key, entry), is_written in zip(entries.items(), written, strict=True):
+            # ключ сбросили, пока шла загрузка (в том числе из другого процесса) - локально не кэшируем
+            if is_written and self._inflight.get(key) is load:
+                self.local.set(self.key(key), entry)
+        return values
+
+    async def invalidate(self, redis: Redis, *keys: KeyT) -> None:
+        full_keys = [self.key(key) for key in keys]
+        if not full_keys:
+            return
+        self.invalidate_local(full_keys)
+        pipe = redis.pipeline(transaction=False)
+        for full_key in full_keys:
+            pipe.incr(self.generation_key(full_key))
+            pipe.expire(self.generation_key(full_key), self.ttl)
+        pipe.delete(*full_keys)
+        await pipe.execute()
+        await publish_invalidation(redis, full_keys)
+
+    async def invalidate_tags(self, redis: Redis, *tags: str) -> None:
+        """Сбросить все ключи с любым из тегов"""
+        if not tags:
+            return
+        tag_keys = [self.tag_key(tag) for tag in tags]
+        full_keys = await redis.eval(POP_TAGS_SCRIPT, len(tag_keys), *tag_keys, int(self.ttl.total_seconds()))
+        if full_keys:
+            self.invalidate_local(full_keys)
+            await publish_invalidation(redis, full_keys)
+
+    def invalidate_local(self, full_keys: Iterable[str]) -> None:
+        """Сбросить ключи в LRU и забыть их текущие загрузки: следующий промах загрузит заново"""
+        full_keys = set(full_keys)
+        self.local.delete(*full_keys)
+        for key in [key for key in self._inflight if self.key(key) in full_keys]:
+            del self._inflight[key]
+
+
+async def publish_invalidation(redis: Redis, keys: list[str]) -> None:
+    await redis.publish(INVALIDATE_CHANNEL, orjson.dumps(keys))
+
+
+class CacheRegistry:
+    """
+    Кэши процесса: общая статистика и подписка на инвалидации из других процессов.
+    Пока подписка не работает, локальные копии живут до своего local_ttl
+    """
+
+    def __init__(self, health_check_interval: float = 5) -> None:
+        self.health_check_interval = health_check_interval
+        self.invalidations = 0
+        self._caches: list[TwoTierCache] = []
+        self._task: asyncio.Task | None = None
+
+    def register(self, cache: TwoTierCache) -> None:
+        self._caches.append(cache)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "subscribed": self._task is not None and not self._task.done(),
+            "invalidations": self.invalidations,
+            "caches": {cache.prefix: cache.stats() for cache in self._caches},
+        }
+
+    def clear(self) -> None:
+        for cache in self._caches:
+            cache.local.clear()
+
+    def invalidate_local(self, keys: list[str]) -> None:
+        self.invalidations += 1
+        for cache in self._caches:
+            cache.invalidate_local(keys)
+
+    async def start(self, redis: Redis) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(redis))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, redis: Redis) -> None:
+        while True:
+            try:
+                await self._listen(redis)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cache invalidation subscription failed")
+                # что пропустили, пока не были подписаны, не узнать
+                self.clear()
+            await asyncio.sleep(self.health_check_interval)
+
+    async def _listen(self, redis: Redis) -> None:
+        async with redis.pubsub() as pubsub:
+            await pubsub.subscribe(INVALIDATE_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    self.invalidate_local(orjson.loads(message["data"]))
+
+
+caches = CacheRegistry()
@@ -0,0 +1,69 @@
+import hashlib
+from collections.abc import Callable
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any
+
+from fastapi import Request, Response, status
+
+
+def make_etag(*parts: Any) -> str:
+    """Слабый ETag из версии ответа: id, updated, счетчики, версия присутствия и т.п."""
+    digest = hashlib.blake2b("\x1f".join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Слабое сравнение (RFC 9110 13.1.2): W/ не учитывается"""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def not_modified_since(if_modified_since: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    # в заголовке точность до секунды
+    return since.tzinfo is not None and last_modified.replace(microsecond=0) <= since
+
+
+class ResponseValidator:
+    """
+    Валидаторы ответа одного запроса. Эндпоинт считает дешевую версию ответа до сериализации,
+    если копия клиента свежая - отдает 304 без тела
+    """
+
+    def __init__(self, request: Request, response: Response, cache_control: str) -> None:
+        self.request = request
+        self.response = response
+        # заголовки ответа. Если эндпоинт сам возвращает Response, их нужно передать в него явно
+        self.headers = {"Cache-Control": cache_control}
+        response.headers.update(self.headers)
+
+    def check(self, *version: Any, last_modified: datetime | None = None) -> Response | None:
+        """Проставить ETag и Last-Modified. Вернет 304, если ответ не изменился"""
+        self.headers["ETag"] = make_etag(*version)
+        if last_modified:
+            self.headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+        self.response.headers.update(self.headers)
+
+        # If-Modified-Since смотрим, только если клиент не прислал If-None-Match (RFC 9110 13.1.3)
+        if_none_match = self.request.headers.get("if-none-match")
+        if_modified_since = self.request.headers.get("if-modified-since")
+        if if_none_match is not None:
+            fresh = etag_matches(if_none_match, self.headers["ETag"])
+        else:
+            fresh = bool(last_modified and if_modified_since and not_modified_since(if_modified_since, last_modified))
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=self.headers) if fresh else None
+
+
+def conditional_get(cache_control: str) -> Callable[[Request, Response], ResponseValidator]:
+    """Зависимость для GET эндпоинтов: Cache-Control эндпоинта и проверка If-None-Match/If-Modified-Since"""
+
+    def dependency(request: Request, response: Response) -> ResponseValidator:
+        return ResponseValidator(request, response, cache_control)
+
+    return dependency
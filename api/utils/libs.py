@@ -1,16 +1,18 @@
 import asyncio
+import base64
 import inspect
+import pickle
 import signal
 from collections import defaultdict
-from collections.abc import Awaitable, Callable
+from collections.abc import Awaitable, Callable, Iterable
 from datetime import UTC, datetime, timedelta
+from functools import wraps
 from http.cookies import SimpleCookie
-from typing import Concatenate, Literal, Optional, overload
+from typing import Any, Concatenate, Literal, Optional, overload
 from urllib.parse import parse_qs
 
 import orjson
 import phonenumbers
-from aiocache import cached as aiocache
 from loguru import logger
 from phonenumbers import (
     NumberParseException,
@@ -25,7 +27,7 @@ from phonenumbers import (
 from phonenumbers.phonenumber import PhoneNumber
 from pydantic import BaseModel, create_model
 
-from settings.conf import ServerRole, settings
+from utils.cache import TwoTierCache
 
 MOBILE_NUMBER_TYPES = PhoneNumberType.MOBILE, PhoneNumberType.FIXED_LINE_OR_MOBILE
 
@@ -205,20 +207,75 @@ async def catch(coro):
         logger.exception("Coro failed")
 
 
-def cached(*args, **kwargs):
+def cached(
+    prefix: str,
+    ttl: timedelta,
+    local_ttl: timedelta = timedelta(seconds=10),
+    max_size: int = 10_000,
+    tags: Callable[..., Iterable[str]] | None = None,
+    serializer: Literal["json", "pickle"] = "json",
+    beta: float = 1,
+):
+    """
+    Кэш корутины в TwoTierCache (LRU процесса + Redis). Корутина принимает redis, ключ - остальные аргументы,
+    кроме db и redis. Значение хранится сериализованным, каждый вызов получает свою копию.
+    Загрузку ждут все конкурентные промахи ключа, поэтому db вызова в нее не передается: корутина получает
+    свою сессию (сессию запроса закрывают вместе с его отменой).
+    json - для JSON-совместимых значений, pickle - для остального, в том числе ORM моделей:
+    тогда декоратор ставится поверх @transient_models, чтобы в кэш попадали отключенные от сессии модели.
+    tags(<аргументы вызова>) - теги значения для func.invalidate_tags(redis, *tags).
+    Сброс по ключу: await func.invalidate(<те же аргументы>), db можно не передавать
+    """
+    cache = TwoTierCache(prefix, ttl, local_ttl, max_size, beta)
+    dumps, loads = _serializers[serializer]
+
     def wrapped(func):
-        if settings.server_role == ServerRole.local:
-            return func
+        signature = inspect.signature(func)
+
+        def bind(args, kwargs) -> tuple[Any, str, inspect.BoundArguments]:
+            bound = signature.bind_partial(*args, **kwargs)
+            bound.apply_defaults()
+            key = ":".join(str(value) for name, value in bound.arguments.items() if name not in ("db", "redis"))
+            return bound.arguments["redis"], key, bound
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            redis, key, bound = bind(args, kwargs)
+
+            async def loader(keys: list[str]) -> dict[str, str]:
+                if "db" not in signature.parameters:
+                    return {key: dumps(await func(*args, **kwargs))}
+                from dependencies.db import _get_db  # dependencies.db -> models -> utils.libs
 
-        # в сервисах декорируем методы
-        kwargs.setdefault("noself", True)
-        # по дефолту NullSerializer, который не делает копии mutable объектов
-        # для создания копии значения используйте PickleSerializer (оверхед на копирование)
-        return aiocache(*args, **kwargs)(func)
+                async with _get_db() as db:
+                    bound.arguments["db"] = db
+                    return {key: dumps(await func(*bound.args, **bound.kwargs))}
+
+            value_tags = tags(*bound.args, **bound.kwargs) if tags else ()
+            return loads(await cache.get(redis, key, loader, value_tags))
+
+        async def invalidate(*args, **kwargs) -> None:
+            redis, key, _ = bind(args, kwargs)
+            await cache.invalidate(redis, key)
+
+        wrapper.cache = cache
+        wrapper.invalidate = invalidate
+        wrapper.invalidate_tags = cache.invalidate_tags
+        return wrapper
 
     return wrapped
 
 
+# redis отдает строки (decode_responses), поэтому pickle хранится в base64
+_serializers: dict[str, tuple[Callable[[Any], str], Callable[[str], Any]]] = {
+    "json": (lambda value: orjson.dumps(value).decode(), orjson.loads),
+    "pickle": (
+        lambda value: base64.b64encode(pickle.dumps(value)).decode(),
+        lambda value: pickle.loads(base64.b64decode(value)),  # noqa: S301 - пишем в кэш только мы сами
+    ),
+}
+
+
 class AsyncInitMeta(type):
     async def __call__(cls, *args, **kwargs):
         # Создаем экземпляр класса
@@ -0,0 +1,119 @@
+import asyncio
+from collections.abc import Callable
+from typing import Any
+
+import engineio
+from engineio.packet import Packet
+from loguru import logger
+
+type PacketPredicate = Callable[[Packet], bool]
+
+
+def packet_size(pkt: Packet | None) -> int:
+    data = pkt and pkt.data
+    return len(data) if isinstance(data, str | bytes) else 0
+
+
+def packet_event(pkt: Packet) -> tuple[str, str | None]:
+    """
+    Namespace и имя события из закодированного socket.io пакета вида 2/namespace,["event",...].
+    Для служебных пакетов событие None
+    """
+    data = pkt.data if isinstance(pkt.data, str) else ""
+    namespace = "/"
+    if data[1:2] == "/":
+        namespace = data[1 : data.find(",")]
+    start = data.find('["')
+    if not data.startswith(("2", "5")) or start == -1:
+        return namespace, None
+    return namespace, data[start + 2 : data.find('"', start + 2)]
+
+
+class OutboundQueue(asyncio.Queue):
+    """Очередь исходящих пакетов engine.io сокета, которая считает буферизованные байты"""
+
+    def __init__(self, limiter: "OutboundLimiter", *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+        self.buffered_bytes = 0
+
+    def _put(self, item: Packet | None) -> None:
+        super()._put(item)
+        self._account(packet_size(item))
+
+    def _get(self) -> Packet | None:
+        item = super()._get()
+        self._account(-packet_size(item))
+        return item
+
+    def _account(self, size: int) -> None:
+        self.buffered_bytes += size
+        self.limiter.buffered_bytes += size
+
+    def drop(self, predicate: PacketPredicate, max_bytes: int) -> int:
+        """Выкинуть самые старые подходящие пакеты, пока в очереди больше max_bytes"""
+        dropped = 0
+        for item in list(self._queue):
+            if self.buffered_bytes <= max_bytes:
+                break
+            if item is None or not predicate(item):
+                continue
+            self._queue.remove(item)
+            self._account(-packet_size(item))
+            self.task_done()  # иначе socket.close() будет вечно ждать queue.join()
+            dropped += 1
+        return dropped
+
+
+class OutboundLimiter:
+    """
+    Ограничение исходящего буфера на соединение.
+    Выше max_bytes выкидываются самые старые пакеты, которые можно терять (и новый такой же пакет),
+    остальные не трогаются. Выше disconnect_bytes клиент считается медленным и отключается
+    """
+
+    def __init__(self, max_bytes: int, disconnect_bytes: int, is_droppable: PacketPredicate) -> None:
+        self.max_bytes = max_bytes
+        self.disconnect_bytes = disconnect_bytes
+        self.is_droppable = is_droppable
+        self.buffered_bytes = 0
+        self.dropped = 0
+        self.disconnected = 0
+
+    def stats(self) -> dict[str, Any]:
+        return {"buffered_bytes": self.buffered_bytes, "dropped": self.dropped, "disconnected": self.disconnected}
+
+    def install(self, eio: engineio.AsyncServer) -> None:
+        send_packet = eio.send_packet
+
+        async def limited_send_packet(sid, pkt: Packet) -> None:
+            if await self.admit(eio, sid, pkt):
+                await send_packet(sid, pkt)
+
+        eio.create_queue = lambda *args, **kwargs: OutboundQueue(self, *args, **kwargs)
+        eio.send_packet = limited_send_packet
+
+    async def admit(self, eio: engineio.AsyncServer, sid: str, pkt: Packet) -> bool:
+        socket = eio.sockets.get(sid)
+        queue = socket and socket.queue
+        if not isinstance(queue, OutboundQueue) or socket.closing:
+            return True
+
+        size = packet_size(pkt)
+        if queue.buffered_bytes + size <= self.max_bytes:
+            return True
+
+        self.dropped += queue.drop(self.is_droppable, self.max_bytes - size)
+        if queue.buffered_bytes + size > self.max_bytes and self.is_droppable(pkt):
+            self.dropped += 1
+            return False
+
+        if queue.buffered_bytes + size > self.disconnect_bytes:
+            logger.warning("Disconnecting slow consumer {}: {} bytes buffered", sid, queue.buffered_bytes)
+            self.disconnected += 1
+            queue.drop(lambda pkt: True, 0)
+            await socket.close(wait=False, abort=True)
+            queue.put_nowait(None)  # writer сокета завершится, не дожидаясь клиента
+            eio.sockets.pop(sid, None)
+            return False
+        return True
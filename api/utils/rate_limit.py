@@ -0,0 +1,133 @@
+import time
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from enum import IntEnum
+from typing import Any
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self, tokens: float = 1, reserve: float = 0) -> float:
+        """
+        Взять токены, не опуская ведро ниже reserve.
+        Возвращает 0, если токены взяты, иначе через сколько секунд их хватит
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens - tokens >= reserve:
+            self.tokens -= tokens
+            return 0
+        return (tokens + reserve - self.tokens) / self.rate
+
+
+class ConnectPriority(IntEnum):
+    streamer = 0
+    viewer = 1
+    lobby = 2
+
+
+class AdmissionController:
+    """
+    Общее на процесс ведро для новых подключений.
+    Менее приоритетные клиенты не могут опустошить ведро ниже своего резерва,
+    поэтому при шторме переподключений остаток достается стримерам
+    """
+
+    def __init__(self, rate: float, burst: float, reserves: dict[ConnectPriority, float], window: float = 5) -> None:
+        self.bucket = TokenBucket(rate, burst)
+        self.reserves = reserves
+        self.window = window
+        self.admitted: Counter[str] = Counter()
+        self.rejected: Counter[str] = Counter()
+        self.rate = 0.0
+        self._window_started = time.monotonic()
+        self._window_admitted = 0
+
+    def admit(self, priority: ConnectPriority) -> float:
+        """0 - подключение пропущено, иначе через сколько секунд повторить"""
+        retry_after = self.bucket.consume(reserve=self.reserves.get(priority, 0))
+        if retry_after:
+            self.rejected[priority.name] += 1
+        else:
+            self.admitted[priority.name] += 1
+            self._window_admitted += 1
+
+        now = time.monotonic()
+        if now - self._window_started >= self.window:
+            self.rate = self._window_admitted / (now - self._window_started)
+            self._window_started = now
+            self._window_admitted = 0
+        return retry_after
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "rate": round(self.rate, 2),
+            "tokens": round(self.bucket.tokens, 2),
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+        }
+
+    def wrap(
+        self, handler: Callable[..., Awaitable[Any]], get_priority: Callable[[dict], Awaitable[ConnectPriority]]
+    ) -> Callable[..., Awaitable[Any]]:
+        """Обертка над engine.io connect: отказ уходит клиенту 401 с телом {"message", "retry_after"}"""
+
+        async def wrapper(eio_sid, environ, *args):
+            retry_after = self.admit(await get_priority(environ))
+            if retry_after:
+                return {"message": "TOO_MANY_CONNECTIONS", "retry_after": round(retry_after, 2)}
+            return await handler(eio_sid, environ, *args)
+
+        return wrapper
+
+
+class EventsRateLimiter:
+    """
+    Ведра на пару (sid, событие). Лишние события отбрасываются,
+    после max_violations отброшенных событий sid считается нарушителем и должен быть отключен
+    """
+
+    def __init__(self, limits: dict[str, tuple[float, float]], max_violations: int) -> None:
+        self.limits = limits
+        self.max_violations = max_violations
+        self.dropped: Counter[str] = Counter()
+        self.disconnected = 0
+        self._buckets: dict[str, dict[str, TokenBucket]] = {}
+        self._violations: Counter[str] = Counter()
+
+    def is_limited(self, event: str) -> bool:
+        return event in self.limits
+
+    def hit(self, sid: str, event: str) -> bool:
+        """True - событие можно обработать"""
+        buckets = self._buckets.setdefault(sid, {})
+        if event not in buckets:
+            buckets[event] = TokenBucket(*self.limits[event])
+        if self._violations[sid] < self.max_violations and not buckets[event].consume():
+            return True
+
+        self.dropped[event] += 1
+        self._violations[sid] += 1
+        return False
+
+    def is_offender(self, sid: str) -> bool:
+        """True только один раз, чтобы не отключать sid на каждое следующее событие"""
+        if self._violations[sid] == self.max_violations:
+            self._violations[sid] += 1
+            self.disconnected += 1
+            return True
+        return False
+
+    def forget(self, sid: str) -> None:
+        self._buckets.pop(sid, None)
+        self._violations.pop(sid, None)
+
+    def stats(self) -> dict[str, Any]:
+        return {"sids": len(self._buckets), "dropped": dict(self.dropped), "disconnected": self.disconnected}
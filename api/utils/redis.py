@@ -0,0 +1,251 @@
+import asyncio
+from collections.abc import Iterable
+from typing import Any
+
+from loguru import logger
+from redis.asyncio import Redis
+
+from utils.libs import cancel_task
+
+INVALIDATE_CHANNEL = "__redis__:invalidate"
+
+# Команды, которые блокируют соединение или меняют его состояние. Их нельзя склеивать в общий пайплайн
+UNPIPELINED_COMMANDS = frozenset(
+    {
+        "AUTH",
+        "BLMOVE",
+        "BLMPOP",
+        "BLPOP",
+        "BRPOP",
+        "BRPOPLPUSH",
+        "BZMPOP",
+        "BZPOPMAX",
+        "BZPOPMIN",
+        "CLIENT",
+        "DISCARD",
+        "EXEC",
+        "HELLO",
+        "MONITOR",
+        "MULTI",
+        "PSUBSCRIBE",
+        "QUIT",
+        "RESET",
+        "SELECT",
+        "SSUBSCRIBE",
+        "SUBSCRIBE",
+        "UNWATCH",
+        "WAIT",
+        "WAITAOF",
+        "WATCH",
+    }
+)
+
+type QueuedCommand = tuple[tuple[Any, ...], dict[str, Any], asyncio.Future]
+
+
+def is_pipelinable(args: tuple[Any, ...]) -> bool:
+    command = str(args[0]).split(" ", 1)[0].upper()
+    if command in UNPIPELINED_COMMANDS:
+        return False
+    if command in ("XREAD", "XREADGROUP"):
+        return not any(str(arg).upper() == "BLOCK" for arg in args[1:])
+    return True
+
+
+class AutoPipelineRedis(Redis):
+    """
+    Клиент, который склеивает команды из конкурентных корутин, вызванные в одном тике event loop, в один пайплайн.
+    Каждая корутина получает свой результат (или свою ошибку), как при обычном вызове.
+
+    Клиент должен быть общим на процесс, иначе склеивать нечего.
+    Явные pipeline(), lock() и pubsub() работают как обычно
+    """
+
+    def __init__(self, *args, max_batch_size: int = 512, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.max_batch_size = max_batch_size
+        self.pipelines_count = 0
+        self.commands_count = 0
+        self._queue: list[QueuedCommand] = []
+        self._flush_scheduled = False
+        self._tasks: set[asyncio.Task] = set()
+
+    async def execute_command(self, *args, **options):
+        if self.single_connection_client or not is_pipelinable(args):
+            return await super().execute_command(*args, **options)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((args, options, future))
+        if not self._flush_scheduled:
+            # call_soon отработает на следующей итерации цикла, когда все готовые корутины уже добавят свои команды
+            self._flush_scheduled = True
+            loop.call_soon(self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        queue, self._queue = self._queue, []
+        for i in range(0, len(queue), self.max_batch_size):
+            task = asyncio.create_task(self._execute_batch(queue[i : i + self.max_batch_size]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute_batch(self, batch: list[QueuedCommand]) -> None:
+        batch = [command for command in batch if not command[2].done()]  # отмененные вызовы не отправляем
+        if not batch:
+            return
+
+        pipe = self.pipeline(transaction=False)
+        for args, options, _ in batch:
+            pipe.execute_command(*args, **options)
+
+        self.pipelines_count += 1
+        self.commands_count += len(batch)
+        try:
+            results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (*_, future), result in zip(batch, results, strict=True):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class TrackedHashCache:
+    """
+    Локальный кэш полей hash-ключей с серверной инвалидацией (CLIENT TRACKING ... BCAST + REDIRECT).
+    Redis пушит имена измененных ключей в отдельное соединение, подписанное на __redis__:invalidate,
+    и кэш ключа сбрасывается целиком.
+
+    Пока трекинг не запущен или соединение упало - кэш выключен и все чтения идут напрямую в Redis
+    """
+
+    def __init__(self, keys: Iterable[str], max_size: int = 100_000, health_check_interval: float = 5) -> None:
+        self.keys = tuple(keys)
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: dict[str, dict[str, Any]] = {key: {} for key in self.keys}
+        # поколение ключа растет при инвалидации. Ответ, прочитанный до инвалидации, в кэш не кладем
+        self._generations: dict[str, int] = dict.fromkeys(self.keys, 0)
+        self._enabled = False
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "size": sum(len(entries) for entries in self._entries.values()),
+        }
+
+    async def hget(self, redis: Redis, key: str, field: Any) -> Any:
+        if not self._enabled or key not in self._entries:
+            return await redis.hget(key, field)
+
+        field = str(field)
+        entries = self._entries[key]
+        if field in entries:
+            self.hits += 1
+            return entries[field]
+
+        self.misses += 1
+        generation = self._generations[key]
+        value = await redis.hget(key, field)
+        if self._enabled and generation == self._generations[key]:
+            if len(entries) >= self.max_size:
+                entries.clear()
+            entries[field] = value
+        return value
+
+    def invalidate(self, *keys: str) -> None:
+        """Сбросить ключи локально. Вызывается после своих записей, не дожидаясь пуша от Redis"""
+        for key in keys or self.keys:
+            if key in self._entries:
+                self._generations[key] += 1
+                self._entries[key].clear()
+                self.invalidations += 1
+
+    async def start(self, redis: Redis) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(redis))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            await cancel_task(self._task, raise_error=False)
+            self._task = None
+
+    async def _run(self, redis: Redis) -> None:
+        while True:
+            try:
+                await self._track(redis)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Client tracking for {} failed, cache disabled", self.keys)
+            await asyncio.sleep(self.health_check_interval)
+
+    async def _track(self, redis: Redis) -> None:
+        pool = redis.connection_pool
+        connections = []
+        try:
+            listener = await pool.get_connection()
+            connections.append(listener)
+            tracker = await pool.get_connection()
+            connections.append(tracker)
+
+            await listener.send_command("CLIENT", "ID")
+            client_id = await listener.read_response()
+
+            prefixes = [arg for key in self.keys for arg in ("PREFIX", key)]
+            await tracker.send_command("CLIENT", "TRACKING", "ON", "REDIRECT", client_id, "BCAST", *prefixes)
+            await tracker.read_response()
+
+            await listener.send_command("SUBSCRIBE", INVALIDATE_CHANNEL)
+            await listener.read_response()
+
+            self._enabled = True
+            logger.info("Client tracking for {} started", self.keys)
+            while True:
+                message = await listener.read_response(timeout=self.health_check_interval)
+                if message is None:
+                    # tracker ничего не читает, поэтому проверяем, что он жив (иначе пуши перестанут приходить)
+                    await tracker.send_command("PING")
+                    await tracker.read_response()
+                    continue
+                self._on_message(message)
+        finally:
+            self._enabled = False
+            self.invalidate()
+            # у соединений изменено состояние (подписка, трекинг), обратно в пул отдаем только отключенными
+            for connection in connections:
+                await connection.disconnect()
+                await pool.release(connection)
+
+    def _on_message(self, message: list) -> None:
+        kind, channel, keys = message
+        if kind not in ("message", b"message") or channel not in (INVALIDATE_CHANNEL, INVALIDATE_CHANNEL.encode()):
+            return
+        if keys is None:  # FLUSHALL/FLUSHDB
+            self.invalidate()
+            return
+
+        invalidated = set()
+        for key in keys:
+            key = key.decode() if isinstance(key, bytes) else key
+            invalidated.update(tracked for tracked in self.keys if key.startswith(tracked))
+        self.invalidate(*invalidated)